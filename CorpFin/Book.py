@@ -0,0 +1,127 @@
+from __future__ import absolute_import, division, print_function
+from numpy import arange, array, full, inf, zeros
+
+
+class Book:   # Capital Structures of many portfolio companies, marked together
+    def __init__(self, capital_structures=()):
+        # capital_structures: dict or sequence of (company, Capital Structure) pairs
+        self.companies = []
+        self.capital_structures = {}
+        self._stacks = {}
+        if isinstance(capital_structures, dict):
+            capital_structures = sorted(capital_structures.items())
+        for company, capital_structure in capital_structures:
+            self[company] = capital_structure
+
+    def __contains__(self, item):
+        return item in self.capital_structures
+
+    def __getitem__(self, item):
+        return self.capital_structures[item]
+
+    def __setitem__(self, key, value):
+        if key not in self.capital_structures:
+            self.companies.append(key)
+        self.capital_structures[key] = value
+
+    def __delitem__(self, key):
+        del self.capital_structures[key]
+        self.companies.remove(key)
+
+    def __iter__(self):
+        return iter(self.companies)
+
+    def __len__(self):
+        return len(self.companies)
+
+    def stack(self, pareto_equil_conversions=False, **kwargs):
+        # every company's piecewise-linear value table, padded to common shapes:
+        # breakpoints: companies x breakpoints, padded with +inf, hence never crossed;
+        # intercepts & slopes: companies x intervals x Securities / Owners, padded with 0
+        conversion_breakpoints = \
+            [self.capital_structures[company].conversion_breakpoints(
+                pareto_equil_conversions=pareto_equil_conversions, **kwargs)
+             for company in self.companies]
+
+        # Capital Structures cache their own tables until modified, so the stack is current iff its tables are
+        key = pareto_equil_conversions, frozenset(kwargs.items())
+        stack = self._stacks.get(key)
+        if (stack is not None) and (len(stack['conversion_breakpoints']) == len(conversion_breakpoints)) and \
+                all(a is b for a, b in zip(stack['conversion_breakpoints'], conversion_breakpoints)):
+            return stack
+
+        owners = []
+        owner_indices = {}
+        for table in conversion_breakpoints:
+            for owner in table.owners:
+                if owner not in owner_indices:
+                    owner_indices[owner] = len(owners)
+                    owners.append(owner)
+
+        nb_companies = len(conversion_breakpoints)
+        max_nb_breakpoints = max([len(table.breakpoints) for table in conversion_breakpoints] + [0])
+        max_nb_security_labels = max([len(table.security_labels) for table in conversion_breakpoints] + [0])
+        breakpoints = full((nb_companies, max_nb_breakpoints), inf)
+        security_val_intercepts = zeros((nb_companies, max_nb_breakpoints + 1, max_nb_security_labels))
+        security_val_slopes = zeros((nb_companies, max_nb_breakpoints + 1, max_nb_security_labels))
+        ownership_val_intercepts = zeros((nb_companies, max_nb_breakpoints + 1, len(owners)))
+        ownership_val_slopes = zeros((nb_companies, max_nb_breakpoints + 1, len(owners)))
+        for c, table in enumerate(conversion_breakpoints):
+            nb_intervals = len(table.breakpoints) + 1
+            nb_security_labels = len(table.security_labels)
+            j = [owner_indices[owner] for owner in table.owners]
+            breakpoints[c, :(nb_intervals - 1)] = table.breakpoints
+            security_val_intercepts[c, :nb_intervals, :nb_security_labels] = table.security_val_intercepts
+            security_val_slopes[c, :nb_intervals, :nb_security_labels] = table.security_val_slopes
+            ownership_val_intercepts[c, :nb_intervals][:, j] = table.ownership_val_intercepts
+            ownership_val_slopes[c, :nb_intervals][:, j] = table.ownership_val_slopes
+
+        self._stacks[key] = stack = \
+            dict(conversion_breakpoints=conversion_breakpoints,
+                 owners=owners,
+                 breakpoints=breakpoints,
+                 security_val_intercepts=security_val_intercepts,
+                 security_val_slopes=security_val_slopes,
+                 ownership_val_intercepts=ownership_val_intercepts,
+                 ownership_val_slopes=ownership_val_slopes)
+        return stack
+
+    def val(self, enterprise_vals, pareto_equil_conversions=False, **kwargs):
+        # enterprise_vals: one Enterprise Value per company, in the order of companies, or a dict company -> value;
+        # each value may be an array (e.g. of scenarios), all broadcasting together;
+        # all companies' waterfalls are evaluated together, by table look-up in their piecewise-linear values;
+        # values are NaN where a company has no Pareto-equilibrium Conversion Scenario
+        if isinstance(enterprise_vals, dict):
+            enterprise_vals = [enterprise_vals[company] for company in self.companies]
+        v = array(enterprise_vals, dtype=float)
+        if v.shape[:1] != (len(self),):
+            raise ValueError('need 1 Enterprise Value (or array of them) per company, i.e. %i' % len(self))
+
+        stack = self.stack(pareto_equil_conversions=pareto_equil_conversions, **kwargs)
+        breakpoints = stack['breakpoints'].reshape((len(self),) + (v.ndim - 1) * (1,) + (-1,))
+        i = (breakpoints <= v[..., None]).sum(axis=-1)
+        c = arange(len(self)).reshape((-1,) + (v.ndim - 1) * (1,))
+        security_vals = stack['security_val_intercepts'][c, i] + stack['security_val_slopes'][c, i] * v[..., None]
+        ownership_vals = stack['ownership_val_intercepts'][c, i] + stack['ownership_val_slopes'][c, i] * v[..., None]
+
+        return dict(
+            companies=list(self.companies),
+            owners=list(stack['owners']),
+            security_vals={company: {security_label: security_vals[k, ..., j]
+                                     for j, security_label in enumerate(table.security_labels)}
+                           for k, (company, table) in enumerate(zip(self.companies, stack['conversion_breakpoints']))},
+            ownership_vals=ownership_vals)   # companies x (Enterprise Value dimensions) x Owners
+
+    def __call__(self, enterprise_vals, pareto_equil_conversions=False, **kwargs):
+        val_results = self.val(enterprise_vals, pareto_equil_conversions=pareto_equil_conversions, **kwargs)
+        ownership_vals = val_results['ownership_vals']
+        if ownership_vals.ndim != 2:
+            raise ValueError('need exactly 1 Enterprise Value per company')
+        from pandas import DataFrame
+        # totals are NaN where a company has no Pareto-equilibrium Conversion Scenario, rather than understated
+        df = DataFrame(
+            list(ownership_vals) + [ownership_vals.sum(axis=0)],
+            index=val_results['companies'] + ['TOTAL'],
+            columns=val_results['owners'])
+        df['Val'] = df.values.sum(axis=1)
+        return df
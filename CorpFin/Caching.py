@@ -0,0 +1,153 @@
+from __future__ import absolute_import, division, print_function
+from collections import OrderedDict
+from hashlib import sha1
+from sys import getsizeof
+from threading import Lock
+from numbers import Real
+from numpy import ascontiguousarray, isnan, ndarray
+from .Instrumentation import METRICS
+
+try:
+    from collections.abc import Mapping
+except ImportError:   # Python 2
+    from collections import Mapping
+
+try:
+    string_types = basestring
+except NameError:
+    string_types = str
+
+
+class LRUCache:   # bounded mapping evicting the least-recently-used items, with hit & miss counts
+    def __init__(self, max_size=1000):
+        self.max_size = max_size
+        self.items = OrderedDict()
+        self.nb_hits = 0
+        self.nb_misses = 0
+        self.nb_evictions = 0
+        self.lock = Lock()
+
+    def __contains__(self, key):
+        return key in self.items
+
+    def __len__(self):
+        return len(self.items)
+
+    def get(self, key, default=None):
+        with self.lock:
+            if key in self.items:
+                # move to the most-recently-used end
+                value = self.items.pop(key)
+                self.items[key] = value
+                self.nb_hits += 1
+                return value
+            else:
+                self.nb_misses += 1
+                return default
+
+    def put(self, key, value):
+        with self.lock:
+            self.items.pop(key, None)
+            self.items[key] = value
+            while len(self.items) > self.max_size:
+                self.items.popitem(last=False)
+                self.nb_evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.items.clear()
+            self.nb_hits = self.nb_misses = self.nb_evictions = 0
+
+    def hit_rate(self):
+        nb_lookups = self.nb_hits + self.nb_misses
+        if nb_lookups:
+            return self.nb_hits / nb_lookups
+        else:
+            return 0.
+
+
+def canonical_key(obj):
+    # hashable canonical form of (nested) inputs, equal for equal inputs whatever their container types & key orders;
+    # TypeError for objects without a canonical form, e.g. user-defined ones
+    if isinstance(obj, (bool, string_types)) or (obj is None):
+        return obj
+    elif isinstance(obj, Real):   # incl. integers, so that e.g. 1 & 1. share results
+        return ('float', 'nan') if isnan(obj) else float(obj)   # NaN != NaN, hence tagged, unlike the string 'nan'
+    elif isinstance(obj, ndarray):
+        if obj.dtype == object:
+            return 'ndarray', obj.shape, tuple(canonical_key(x) for x in obj.ravel())
+        else:
+            return 'ndarray', obj.shape, str(obj.dtype), ascontiguousarray(obj).tobytes()
+    elif isinstance(obj, Mapping):
+        return 'mapping', tuple(sorted((canonical_key(k), canonical_key(v)) for k, v in obj.items()))
+    elif isinstance(obj, (list, tuple)):
+        return tuple(canonical_key(x) for x in obj)
+    elif isinstance(obj, (set, frozenset)):
+        return 'set', tuple(sorted(canonical_key(x) for x in obj))
+    else:
+        raise TypeError('no canonical form for %r' % (obj,))
+
+
+def canonical_hash(obj):
+    # compact digest of canonical_key(obj), or None if obj has no canonical form
+    try:
+        return sha1(repr(canonical_key(obj)).encode('utf-8')).hexdigest()
+    except TypeError:
+        return None
+
+
+def result_nb_bytes(result):
+    # approximate memory footprint of a cached result
+    if hasattr(result, 'memory_usage'):   # pandas DataFrame or Series
+        return int(result.memory_usage(index=True, deep=True).sum())
+    elif isinstance(result, ndarray):
+        return result.nbytes
+    elif isinstance(result, Mapping):
+        return getsizeof(result) + sum(result_nb_bytes(k) + result_nb_bytes(v) for k, v in result.items())
+    elif isinstance(result, (list, tuple)):
+        return getsizeof(result) + sum(result_nb_bytes(x) for x in result)
+    else:
+        return getsizeof(result)
+
+
+class ResultCache(LRUCache):   # LRU cache of results bounded by number of items AND total approximate memory
+    def __init__(self, max_size=1000, max_nb_bytes=10 ** 8, name='results'):
+        LRUCache.__init__(self, max_size=max_size)
+        self.max_nb_bytes = max_nb_bytes
+        self.name = name
+        self.item_nb_bytes = {}
+        self.nb_bytes = 0
+
+    def get(self, key, default=None):
+        value = LRUCache.get(self, key, default=default)
+        METRICS.increment('result_cache_misses' if value is default else 'result_cache_hits', cache=self.name)
+        return value
+
+    def put(self, key, value, nb_bytes=None):
+        if nb_bytes is None:
+            nb_bytes = result_nb_bytes(value)
+        if nb_bytes > self.max_nb_bytes:   # would evict everything else; not worth caching
+            return
+        with self.lock:
+            if key in self.items:
+                del self.items[key]
+                self.nb_bytes -= self.item_nb_bytes.pop(key)
+            self.items[key] = value
+            self.item_nb_bytes[key] = nb_bytes
+            self.nb_bytes += nb_bytes
+            while (len(self.items) > self.max_size) or (self.nb_bytes > self.max_nb_bytes):
+                evicted_key, _ = self.items.popitem(last=False)
+                self.nb_bytes -= self.item_nb_bytes.pop(evicted_key)
+                self.nb_evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.item_nb_bytes.clear()
+            self.nb_bytes = 0
+        LRUCache.clear(self)
+
+    def stats(self):
+        return dict(
+            nb_items=len(self), nb_bytes=self.nb_bytes,
+            nb_hits=self.nb_hits, nb_misses=self.nb_misses, nb_evictions=self.nb_evictions,
+            hit_rate=self.hit_rate())
@@ -1,12 +1,22 @@
 from __future__ import absolute_import, division, print_function
-from copy import copy, deepcopy
+from contextlib import contextmanager
+from copy import copy
 from frozendict import frozendict
 from namedlist import namedlist
-from numpy import allclose, float64, nan
-from pandas import DataFrame
-from sympy import Min, Piecewise, Symbol
-from HelpyFuncs.SymPy import sympy_theanify
+from numpy import \
+    add, allclose, array, broadcast, exp, float64, full, isclose, maximum, minimum, nan, nansum, ndim, searchsorted, \
+    sqrt, \
+    unique, where, zeros
+from numpy import rec
+from numpy.random import RandomState
+from sympy import Expr, Min, Piecewise, Symbol
+from .Caching import canonical_hash
+from .Compilation import theanify
+from .ExprGraphs import graph_stats_data_frame
+from .Instrumentation import METRICS
+from .ResultStore import ResultStore
 from .Security import Security
+from .Simulation import ExitSimulation
 
 
 def parse_security_info_set(security_info_set):
@@ -50,12 +60,129 @@ def parse_security_info_sets(security_info_sets):
 n_security_factory = namedlist('N_Security', ['n', 'security'])
 
 
+def data_frame_or_records(columns, index=None, records=False):
+    # build a view in one go from preassembled (name, values) columns, rather than row by row;
+    # index: optional (name, labels) pair, whose labels become the first field of a record array
+    if records:
+        if index is not None:
+            columns = [index] + columns
+        return rec.fromarrays([array(values) for name, values in columns], names=[name for name, values in columns])
+    else:
+        from pandas import DataFrame   # deferred, like every DataFrame view, until one is first asked for
+        return DataFrame(dict(columns), index=None if index is None else index[1],
+                         columns=[name for name, values in columns])
+
+
+class OwnershipLedger:   # columnar Owners x Securities view of a Capital Structure's Ownerships
+    def __init__(self, ownerships, security_labels):
+        self.owners = [owner for owner, holdings in ownerships.items() if holdings]
+        self.owner_indices = {owner: i for i, owner in enumerate(self.owners)}
+        self.security_labels = list(security_labels)
+        self.security_indices = {security_label: j for j, security_label in enumerate(self.security_labels)}
+
+        # sparse (COO) Quantity matrix, with each Owner's holdings stored contiguously from its start position
+        owner_holding_starts = []
+        holding_owner_indices = []
+        holding_security_indices = []
+        holding_quantities = []
+        for i, owner in enumerate(self.owners):
+            owner_holding_starts.append(len(holding_quantities))
+            for security_label, quantity in ownerships[owner].items():
+                holding_owner_indices.append(i)
+                holding_security_indices.append(self.security_indices[security_label])
+                holding_quantities.append(quantity)
+        self.owner_holding_starts = array(owner_holding_starts, dtype=int)
+        self.holding_owner_indices = array(holding_owner_indices, dtype=int)
+        self.holding_security_indices = array(holding_security_indices, dtype=int)
+        self.holding_quantities = array(holding_quantities, dtype=float)
+
+    def __len__(self):
+        return len(self.holding_quantities)
+
+    def holding_vals(self, security_vals):
+        # security_vals: Security values in the order of security_labels, optionally with further (scenario) axes
+        security_vals = array(security_vals, dtype=float)
+        return security_vals[self.holding_security_indices] * \
+            self.holding_quantities.reshape((-1,) + (security_vals.ndim - 1) * (1,))
+
+    def ownership_vals(self, security_vals):
+        if len(self):
+            return add.reduceat(self.holding_vals(security_vals), self.owner_holding_starts, axis=0)
+        else:
+            return zeros((0,) + array(security_vals).shape[1:])
+
+
+def pareto_alternative(conversion_scenario, alternative_conversion_scenario, owner):
+    # whether the Owner can move from one Conversion Scenario to the other by changing only its own conversions
+    for another_owner, another_owner_conversions in alternative_conversion_scenario.items():
+        if (another_owner != owner) and (conversion_scenario[another_owner] != another_owner_conversions):
+            return False
+    return True
+
+
+def pareto_equil_conversion_scenario(conversion_scenarios, conversion_scenario_ownership_vals):
+    for conversion_scenario in conversion_scenarios:
+        ownership_vals = conversion_scenario_ownership_vals[conversion_scenario]
+        pareto = True
+        for owner in conversion_scenario:
+            for alternative_conversion_scenario in conversion_scenarios:
+                if pareto_alternative(conversion_scenario, alternative_conversion_scenario, owner):
+                    alternative_ownership_val = \
+                        conversion_scenario_ownership_vals[alternative_conversion_scenario][owner]
+                    pareto &= \
+                        (ownership_vals[owner] >= alternative_ownership_val) or \
+                        isclose(ownership_vals[owner], alternative_ownership_val)
+                    if not pareto:
+                        break
+            if not pareto:
+                break
+        if pareto:
+            return conversion_scenario
+
+
+class ConversionBreakpoints:   # Pareto-equilibrium values of a Capital Structure, piecewise-linear in Enterprise Value
+    def __init__(self, breakpoints, conversion_scenarios, capital_structures, conversion_scenario_indices,
+                 security_labels, security_val_intercepts, security_val_slopes,
+                 owners, ownership_val_intercepts, ownership_val_slopes):
+        self.breakpoints = breakpoints   # sorted Enterprise Values at which values kink or conversions change
+        self.conversion_scenarios = conversion_scenarios
+        self.capital_structures = capital_structures
+        self.conversion_scenario_indices = conversion_scenario_indices   # per interval; -1 if there is no equilibrium
+        self.security_labels = security_labels
+        self.security_val_intercepts = security_val_intercepts   # intervals x Securities
+        self.security_val_slopes = security_val_slopes
+        self.owners = owners
+        self.ownership_val_intercepts = ownership_val_intercepts   # intervals x Owners
+        self.ownership_val_slopes = ownership_val_slopes
+
+    def intervals(self, enterprise_val):
+        return searchsorted(self.breakpoints, enterprise_val, side='right')
+
+    def __call__(self, enterprise_val):
+        v = array(enterprise_val, dtype=float)
+        i = self.intervals(v)
+        security_vals = self.security_val_intercepts[i] + self.security_val_slopes[i] * v[..., None]
+        ownership_vals = self.ownership_val_intercepts[i] + self.ownership_val_slopes[i] * v[..., None]
+        return dict(
+            conversion_scenario_indices=self.conversion_scenario_indices[i],
+            security_vals={security_label: security_vals[..., j]
+                           for j, security_label in enumerate(self.security_labels)},
+            ownership_vals={owner: ownership_vals[..., j]
+                            for j, owner in enumerate(self.owners)})
+
+
 class CapitalStructure:
     def __init__(self, *securities_and_optional_conversion_ratios):
         self.outstanding = {}
         self.lifo_liquidation_order = []
         self.optional_conversion_ratios = {}
         self.ownerships = {}
+        self.holders = {}   # reverse index of Ownerships: Security Label -> {Owner: Quantity}
+        self._owned = {'outstanding', 'lifo_liquidation_order', 'optional_conversion_ratios', 'ownerships', 'holders'}
+        self._derived = {}   # state derived from the above, shared with copies until either side is modified
+        self._waterfall_deferrals = 0
+        self._waterfall_pending = False
+        self.result_cache = None   # opt-in ResultCache of val & __call__ results, shared with copies
         for securities_and_optional_conversion_ratio in securities_and_optional_conversion_ratios:
             self.create_securities(securities_and_optional_conversion_ratio)
         self.common_share_label = self[0][0]
@@ -76,36 +203,110 @@ class CapitalStructure:
         return len(self.lifo_liquidation_order)
 
     def copy(self, deep=True):
-        if deep:   # to deep-copy; this is the safest option
-            return deepcopy(self)
-        else:   # to shallow-copy; NOTE: this can be unclear & unsafe
-            capital_structure = CapitalStructure()
-            capital_structure.outstanding = self.outstanding.copy()
-            capital_structure.lifo_liquidation_order = copy(self.lifo_liquidation_order)
-            capital_structure.optional_conversion_ratios = self.optional_conversion_ratios.copy()
-            capital_structure.ownerships = self.ownerships.copy()
-            capital_structure.waterfall()
-            return capital_structure
-
-    def show(self, ownerships=False):
+        # copy-on-write snapshot: the copy shares Outstanding Securities, Ownerships & Liquidation Order with this
+        # Capital Structure, and either side takes private copies of only the parts it later modifies;
+        # hence the copy is as safe as a deep copy, and as cheap as a shallow one, whichever "deep" is given
+        capital_structure = copy(self)
+        self._owned = set()
+        capital_structure._owned = set()
+        capital_structure._waterfall_deferrals = 0
+        return capital_structure
+
+    def _own(self, attr):
+        if attr not in self._owned:
+            setattr(self, attr, copy(getattr(self, attr)))
+            self._owned.add(attr)
+        return getattr(self, attr)
+
+    def _own_security(self, security_label):
+        outstanding = self._own('outstanding')
+        if ('outstanding', security_label) not in self._owned:
+            n, security = outstanding[security_label]
+            security = copy(security)
+            security._sensitivity_functions = {}   # else shared with the original, whose val_expr may differ
+            outstanding[security_label] = n_security_factory(n=n, security=security)
+            self._owned.add(('outstanding', security_label))
+        return outstanding[security_label]
+
+    def _own_item(self, attr, key):
+        container = self._own(attr)
+        if (attr, key) not in self._owned:
+            container[key] = copy(container.get(key, {}))
+            self._owned.add((attr, key))
+        return container[key]
+
+    def _add_holding(self, owner, security_label, quantity):
+        self._derived = {}
+        holdings = self._own_item('ownerships', owner)
+        holders = self._own_item('holders', security_label)
+        holdings[security_label] = holders[owner] = holdings.get(security_label, 0) + quantity
+        if (quantity < 0) and allclose(holdings[security_label], 0.):
+            del holdings[security_label]
+            if not holdings:
+                del self.ownerships[owner]
+                self._owned.discard(('ownerships', owner))
+            del holders[owner]
+            if not holders:
+                del self.holders[security_label]
+                self._owned.discard(('holders', security_label))
+
+    def ownership_ledger(self):
+        if 'ownership_ledger' not in self._derived:
+            self._derived['ownership_ledger'] = OwnershipLedger(self.ownerships, self.outstanding)
+        return self._derived['ownership_ledger']
+
+    def state_token(self):
+        # token replaced on every modification, and shared with copies until either side is modified
+        return self._derived.setdefault('state_token', object())
+
+    def result_cache_key(self, method, **kwargs):
+        # None if results are not cached, or if kwargs have no canonical form
+        if self.result_cache is not None:
+            digest = canonical_hash(kwargs)
+            if digest is not None:
+                return self.state_token(), method, digest
+
+    def _refresh(self):
+        self._derived = {}
+        if self._waterfall_deferrals:
+            self._waterfall_pending = True
+        else:
+            self.waterfall()
+
+    @contextmanager
+    def deferred_waterfall(self, rebuild=True):
+        # defer waterfall rebuilds to the end of a batch of issues, redemptions & conversions;
+        # with rebuild=False, leave the waterfall stale until next needed for valuation
+        self._waterfall_deferrals += 1
+        try:
+            yield self
+        finally:
+            self._waterfall_deferrals -= 1
+            if rebuild and self._waterfall_pending and not self._waterfall_deferrals:
+                self.waterfall()
+
+    def show(self, ownerships=False, records=False):
+        # records=True gives a NumPy record array, without the DataFrame construction, for programmatic callers
         if ownerships:
-            df = DataFrame(columns=['Owner', 'Security', 'Quantity'])
-            i = 0
-            for owner, holdings in self.ownerships.items():
-                for security_label, quantity in holdings.items():
-                    df.loc[i] = owner, security_label, quantity
-                    i += 1
-            df.Quantity = df.Quantity.astype(float)
+            ledger = self.ownership_ledger()
+            return data_frame_or_records(
+                [('Owner', array(ledger.owners, dtype=object)[ledger.holding_owner_indices]),
+                 ('Security', array(ledger.security_labels, dtype=object)[ledger.holding_security_indices]),
+                 ('Quantity', ledger.holding_quantities)],
+                records=records)
         else:
-            df = DataFrame(columns=['Liquidation Order (LIFO)', 'Outstanding', 'Conversion Ratio'])
+            security_labels = []
+            liquidation_orders = []
             for i in range(len(self)):
-                security_labels = self[i]
-                for security_label in security_labels:
-                    n, security = self[security_label]
-                    optional_conversion_ratio = self.optional_conversion_ratios.get(security_label)
-                    df.loc[security_label] = i, n, optional_conversion_ratio
-            df['Liquidation Order (LIFO)'] = df['Liquidation Order (LIFO)'].astype(int)
-        return df
+                security_labels += self[i]
+                liquidation_orders += len(self[i]) * [i]
+            return data_frame_or_records(
+                [('Liquidation Order (LIFO)', array(liquidation_orders, dtype=int)),
+                 ('Outstanding', array([self[security_label].n for security_label in security_labels], dtype=float)),
+                 ('Conversion Ratio',
+                  array([self.optional_conversion_ratios.get(security_label)
+                         for security_label in security_labels], dtype=object))],
+                index=('Security', security_labels), records=records)
 
     def __repr__(self):
         return str(self.show())
@@ -122,47 +323,64 @@ class CapitalStructure:
 
         for security, optional_common_share_conversion_ratio in securities_and_optional_common_share_conversion_ratios:
 
-            capital_structure.outstanding[security.label] = n_security_factory(n=0, security=security)
+            capital_structure._derived = {}
+            capital_structure._own('outstanding')[security.label] = n_security_factory(n=0, security=security)
+            capital_structure._owned.add(('outstanding', security.label))
 
+            lifo_liquidation_order = capital_structure._own('lifo_liquidation_order')
             if (liquidation_order is None) or liquidation_order >= len(self):
-                capital_structure.lifo_liquidation_order.append([security.label])
+                lifo_liquidation_order.append([security.label])
             elif insert:
-                capital_structure.lifo_liquidation_order.insert(liquidation_order, [security.label])
-            else:
-                capital_structure.lifo_liquidation_order[liquidation_order].append(security.label)
+                lifo_liquidation_order.insert(liquidation_order, [security.label])
+            else:   # replace rather than append to the inner list, which may be shared with copies
+                lifo_liquidation_order[liquidation_order] = \
+                    lifo_liquidation_order[liquidation_order] + [security.label]
 
             if optional_common_share_conversion_ratio is not None:
-                capital_structure.optional_conversion_ratios[security.label] = optional_common_share_conversion_ratio
+                capital_structure._own('optional_conversion_ratios')[security.label] = \
+                    optional_common_share_conversion_ratio
 
         if not inplace:
             return capital_structure
 
     def waterfall(self):
-        v = Symbol('enterprise_val')
-        for lifo_liquidation_order in reversed(range(len(self))):
-            security_labels = self[lifo_liquidation_order]
-            if lifo_liquidation_order:
-                total_claim_val_this_round = \
-                    reduce(
-                        lambda x, y: x + y,
-                        map(lambda x: x.n * x.security.claim_val_expr,
-                            map(lambda x: self[x],
-                                security_labels)))
-                claimable = Min(total_claim_val_this_round, v)
-                for security_label in security_labels:
-                    n, security = self[security_label]
-                    security.val_expr = \
-                        Piecewise(
-                            ((claimable / total_claim_val_this_round) * security.claim_val_expr,
-                             total_claim_val_this_round > 0),
-                            (claimable,
-                             True))
-                    security.val = sympy_theanify(security.val_expr)
-                v -= claimable
-            else:
-                n, common_share = self[security_labels[0]]
-                common_share.val_expr = v / n
-                common_share.val = sympy_theanify(common_share.val_expr)
+        self._waterfall_pending = False
+        METRICS.increment('waterfall_rebuilds')
+        with METRICS.timer('waterfall'):
+            v = Symbol('enterprise_val')
+            for lifo_liquidation_order in reversed(range(len(self))):
+                security_labels = self[lifo_liquidation_order]
+                if lifo_liquidation_order:
+                    total_claim_val_this_round = \
+                        reduce(
+                            lambda x, y: x + y,
+                            map(lambda x: x.n * x.security.claim_val_expr,
+                                map(lambda x: self[x],
+                                    security_labels)))
+                    claimable = Min(total_claim_val_this_round, v)
+                    for security_label in security_labels:
+                        n, security = self._own_security(security_label)
+                        security.val_expr = \
+                            Piecewise(
+                                ((claimable / total_claim_val_this_round) * security.claim_val_expr,
+                                 total_claim_val_this_round > 0),
+                                (claimable,
+                                 True))
+                        security.val = theanify(security.val_expr)
+                    v -= claimable
+                else:
+                    n, common_share = self._own_security(security_labels[0])
+                    common_share.val_expr = v / n
+                    common_share.val = theanify(common_share.val_expr)
+
+    def graph_stats(self):
+        # expression-graph sizes of every Security's Claim Value & waterfall Value, e.g. for check_graph_stats
+        if self._waterfall_pending and not self._waterfall_deferrals:
+            self.waterfall()
+        return graph_stats_data_frame(
+            {security_label: [security.claim_val_expr, security.val_expr]
+             for security_label, (n, security) in self.outstanding.items()},
+            item_labels={security_label: ['claim_val', 'val'] for security_label in self.outstanding})
 
     def issue(self, owner='', securities=None, inplace=True, deep=True):
         if inplace:
@@ -175,18 +393,10 @@ class CapitalStructure:
             security_labels_and_quantities = parse_security_info_sets(securities)
 
             for security_label, quantity in security_labels_and_quantities.items():
+                capital_structure._own_security(security_label).n += quantity
+                capital_structure._add_holding(owner, security_label, quantity)
 
-                capital_structure[security_label].n += quantity
-
-                if owner in capital_structure.ownerships:
-                    if security_label in capital_structure.ownerships[owner]:
-                        capital_structure.ownerships[owner][security_label] += quantity
-                    else:
-                        capital_structure.ownerships[owner][security_label] = quantity
-                else:
-                    capital_structure.ownerships[owner] = {security_label: quantity}
-
-            capital_structure.waterfall()
+            capital_structure._refresh()
 
         if not inplace:
             return capital_structure
@@ -198,27 +408,14 @@ class CapitalStructure:
             capital_structure = self.copy(deep=deep)
 
         if securities is None:
-            security_labels_and_quantities = capital_structure.ownerships[from_owner]
+            security_labels_and_quantities = capital_structure.ownerships[from_owner].copy()
         else:
             security_labels_and_quantities = parse_security_info_sets(securities)
 
         for security_label, quantity in security_labels_and_quantities.items():
-
             transferred_quantity = min(capital_structure.ownerships[from_owner][security_label], quantity)
-
-            capital_structure.ownerships[from_owner][security_label] -= transferred_quantity
-            if allclose(capital_structure.ownerships[from_owner][security_label], 0.):
-                del capital_structure.ownerships[from_owner][security_label]
-            if not capital_structure.ownerships[from_owner]:
-                del capital_structure.ownerships[from_owner]
-
-            if to_owner in capital_structure.ownerships:
-                if security_label in capital_structure.ownerships[to_owner]:
-                    capital_structure.ownerships[to_owner][security_label] += transferred_quantity
-                else:
-                    capital_structure.ownerships[to_owner][security_label] = transferred_quantity
-            else:
-                capital_structure.ownerships[to_owner] = {security_label: transferred_quantity}
+            capital_structure._add_holding(from_owner, security_label, -transferred_quantity)
+            capital_structure._add_holding(to_owner, security_label, transferred_quantity)
 
         if not inplace:
             return capital_structure
@@ -238,16 +435,13 @@ class CapitalStructure:
 
             for owner, holdings_to_redeem in owners_holdings_to_redeem.items():
                 for security_label, quantity in holdings_to_redeem.items():
-                    capital_structure[security_label].n -= quantity
-                    if allclose(capital_structure[security_label].n, 0.):
-                        capital_structure[security_label].n = 0.
-                    capital_structure.ownerships[owner][security_label] -= quantity
-                    if allclose(capital_structure.ownerships[owner][security_label], 0.):
-                        del capital_structure.ownerships[owner][security_label]
-                    if not capital_structure.ownerships[owner]:
-                        del capital_structure.ownerships[owner]
+                    n_security = capital_structure._own_security(security_label)
+                    n_security.n -= quantity
+                    if allclose(n_security.n, 0.):
+                        n_security.n = 0.
+                    capital_structure._add_holding(owner, security_label, -quantity)
 
-            capital_structure.waterfall()
+            capital_structure._refresh()
 
         if not inplace:
             return capital_structure
@@ -265,29 +459,359 @@ class CapitalStructure:
                     owners=owners,
                     securities=securities)
 
-            for owner, holdings_to_convert in owners_holdings_to_convert.items():
-                for security_label, quantity in holdings_to_convert.items():
-                    if security_label in capital_structure.optional_conversion_ratios:
-                        conversion_ratio = capital_structure.optional_conversion_ratios[security_label]
-                        capital_structure.redeem(
-                            owners=owner,
-                            securities={security_label: quantity})
-                        capital_structure.issue(
-                            owner=owner,
-                            securities={capital_structure.common_share_label: quantity * conversion_ratio})
-
-            capital_structure.waterfall()
+            with capital_structure.deferred_waterfall():
+                for owner, holdings_to_convert in owners_holdings_to_convert.items():
+                    for security_label, quantity in holdings_to_convert.items():
+                        if security_label in capital_structure.optional_conversion_ratios:
+                            conversion_ratio = capital_structure.optional_conversion_ratios[security_label]
+                            capital_structure.redeem(
+                                owners=owner,
+                                securities={security_label: quantity})
+                            capital_structure.issue(
+                                owner=owner,
+                                securities={capital_structure.common_share_label: quantity * conversion_ratio})
+                capital_structure._refresh()
 
         if not inplace:
             return capital_structure
 
-    def conversion_scenarios(self, conversions_tried={}, conversions_to_try=None):
+    def claim_vals(self, **kwargs):
+        claim_vals = {}
+        for security_label, (n, security) in self.outstanding.items():
+            if isinstance(security.claim_val_expr, Expr):
+                claim_vals[security_label] = \
+                    float64(security.claim_val(**{symbol.name: kwargs[symbol.name]
+                                                  for symbol in security.claim_val_expr.free_symbols}))
+            else:
+                claim_vals[security_label] = float64(security.claim_val_expr)
+        return claim_vals
+
+    def security_vals(self, enterprise_val=0., **kwargs):
+        # numerical, vectorized counterpart of the symbolic waterfall: per-unit Security values at an array of
+        # Enterprise Values, given per-unit Claim Values that do not depend on Enterprise Value
+        claim_vals = self.claim_vals(**kwargs)
+        v = array(enterprise_val, dtype=float)
+        security_vals = {}
+        for lifo_liquidation_order in reversed(range(1, len(self))):
+            security_labels = self[lifo_liquidation_order]
+            total_claim_val_this_round = \
+                sum(self[security_label].n * claim_vals[security_label] for security_label in security_labels)
+            claimable = minimum(total_claim_val_this_round, v)
+            for security_label in security_labels:
+                if total_claim_val_this_round > 0:
+                    security_vals[security_label] = \
+                        (claimable / total_claim_val_this_round) * claim_vals[security_label]
+                else:
+                    security_vals[security_label] = claimable
+            v = v - claimable
+        security_vals[self.common_share_label] = v / self[self.common_share_label].n
+        return security_vals
+
+    def enterprise_val_dependent_claims(self):
+        # labels of Securities whose Claim Values depend on Enterprise Value, which rule out conversion_breakpoints
+        return [security_label for security_label, (n, security) in self.outstanding.items()
+                if isinstance(security.claim_val_expr, Expr) and
+                ('enterprise_val' in {symbol.name for symbol in security.claim_val_expr.free_symbols})]
+
+    def claim_breakpoints(self, **kwargs):
+        # Enterprise Values at which the waterfall moves from one liquidation tier to the next
+        claim_vals = self.claim_vals(**kwargs)
+        breakpoints = []
+        cumulative_claim_val = 0.
+        for lifo_liquidation_order in reversed(range(1, len(self))):
+            cumulative_claim_val += \
+                sum(self[security_label].n * claim_vals[security_label]
+                    for security_label in self[lifo_liquidation_order])
+            breakpoints.append(cumulative_claim_val)
+        return breakpoints
+
+    def conversion_breakpoints(self, pareto_equil_conversions=True, **kwargs):
+        # pareto_equil_conversions=False tabulates the values with no conversions, like val's default
+        try:
+            key = 'conversion_breakpoints', pareto_equil_conversions, frozenset(kwargs.items())
+        except TypeError:
+            key = None
+        if key in self._derived:
+            METRICS.increment('conversion_breakpoints_cache_hits')
+            return self._derived[key]
+        METRICS.increment('conversion_breakpoints_cache_misses')
+
+        if self._waterfall_pending and not self._waterfall_deferrals:
+            self.waterfall()
+
+        for security_label in self.enterprise_val_dependent_claims():
+            raise ValueError('Security "%s" has a Claim Value depending on Enterprise Value' % security_label)
+
+        if pareto_equil_conversions:
+            # the numerical waterfall below does not need the Conversion Scenarios' symbolic waterfalls to be rebuilt
+            conversion_scenario_capital_structures = self.conversion_scenarios(waterfall=False)
+            conversion_scenarios = list(conversion_scenario_capital_structures)
+            capital_structures = [conversion_scenario_capital_structures[conversion_scenario]
+                                  for conversion_scenario in conversion_scenarios]
+        else:
+            conversion_scenarios = \
+                [frozendict({owner: frozendict(conversions)
+                             for owner, conversions in self.no_conversion_scenario().items()})]
+            capital_structures = [self.copy()]
+        security_labels = list(self.outstanding)
+        owners = self.ownership_ledger().owners
+
+        # within each interval between liquidation-tier breakpoints, every Conversion Scenario's values are linear
+        claim_breakpoints = \
+            unique(sum((capital_structure.claim_breakpoints(**kwargs) for capital_structure in capital_structures),
+                       [0.]))
+        scale = max(abs(claim_breakpoints).max(), 1.)
+        edges = [claim_breakpoints[0] - scale] + list(claim_breakpoints) + [claim_breakpoints[-1] + scale]
+        x0 = array([(2 * edges[i] + edges[i + 1]) / 3 for i in range(len(edges) - 1)])
+        x1 = array([(edges[i] + 2 * edges[i + 1]) / 3 for i in range(len(edges) - 1)])
+
+        def linear_coefs(vals0, vals1):
+            slopes = (vals1 - vals0) / (x1 - x0)[:, None]
+            return vals0 - slopes * x0[:, None], slopes
+
+        security_val_coefs = []
+        ownership_val_coefs = []
+        for capital_structure in capital_structures:
+            security_vals0 = capital_structure.security_vals(enterprise_val=x0, **kwargs)
+            security_vals1 = capital_structure.security_vals(enterprise_val=x1, **kwargs)
+            security_val_coefs.append(
+                linear_coefs(array([security_vals0[security_label] for security_label in security_labels]).T,
+                             array([security_vals1[security_label] for security_label in security_labels]).T))
+            ledger = capital_structure.ownership_ledger()
+            owner_indices = [ledger.owner_indices[owner] for owner in owners]
+            ownership_val_coefs.append(
+                linear_coefs(
+                    ledger.ownership_vals([security_vals0[security_label]
+                                           for security_label in ledger.security_labels])[owner_indices].T,
+                    ledger.ownership_vals([security_vals1[security_label]
+                                           for security_label in ledger.security_labels])[owner_indices].T))
+
+        # conversion decisions can only change where an Owner's values in two Pareto-alternative scenarios cross
+        breakpoints = set(claim_breakpoints)
+        lower_edges = array(edges[:-1])
+        upper_edges = array(edges[1:])
+        lower_edges[0] = -float('inf')
+        upper_edges[-1] = float('inf')
+        owner_indices = {owner: j for j, owner in enumerate(owners)}
+        for s, conversion_scenario in enumerate(conversion_scenarios):
+            for owner in conversion_scenario:
+                j = owner_indices[owner]
+                for a, alternative_conversion_scenario in enumerate(conversion_scenarios):
+                    if (a != s) and pareto_alternative(conversion_scenario, alternative_conversion_scenario, owner):
+                        intercepts, slopes = ownership_val_coefs[s]
+                        alternative_intercepts, alternative_slopes = ownership_val_coefs[a]
+                        slope_diffs = slopes[:, j] - alternative_slopes[:, j]
+                        nonzero_slope_diffs = ~isclose(slope_diffs, 0.)
+                        crossings = \
+                            (alternative_intercepts[nonzero_slope_diffs, j] - intercepts[nonzero_slope_diffs, j]) / \
+                            slope_diffs[nonzero_slope_diffs]
+                        breakpoints.update(
+                            crossings[(lower_edges[nonzero_slope_diffs] < crossings) &
+                                      (crossings < upper_edges[nonzero_slope_diffs])])
+        breakpoints = array(sorted(breakpoints))
+        breakpoints = breakpoints[~isclose(breakpoints, [-float('inf')] + list(breakpoints[:-1]))]
+
+        # pick the Pareto-equilibrium Conversion Scenario in each refined interval
+        edges = [breakpoints[0] - scale] + list(breakpoints) + [breakpoints[-1] + scale]
+        midpoints = array([(edges[i] + edges[i + 1]) / 2 for i in range(len(edges) - 1)])
+        claim_intervals = searchsorted(claim_breakpoints, midpoints, side='right')
+        conversion_scenario_indices = zeros(len(midpoints), dtype=int)
+        security_val_intercepts = zeros((len(midpoints), len(security_labels)))
+        security_val_slopes = zeros((len(midpoints), len(security_labels)))
+        ownership_val_intercepts = zeros((len(midpoints), len(owners)))
+        ownership_val_slopes = zeros((len(midpoints), len(owners)))
+        for i, (midpoint, k) in enumerate(zip(midpoints, claim_intervals)):
+            conversion_scenario_ownership_vals = \
+                {conversion_scenario: dict(zip(owners,
+                                               ownership_val_coefs[s][0][k] + ownership_val_coefs[s][1][k] * midpoint))
+                 for s, conversion_scenario in enumerate(conversion_scenarios)}
+            conversion_scenario = \
+                pareto_equil_conversion_scenario(conversion_scenarios, conversion_scenario_ownership_vals)
+            if conversion_scenario is None:
+                conversion_scenario_indices[i] = -1
+                security_val_intercepts[i] = security_val_slopes[i] = nan
+                ownership_val_intercepts[i] = ownership_val_slopes[i] = nan
+            else:
+                s = conversion_scenarios.index(conversion_scenario)
+                conversion_scenario_indices[i] = s
+                security_val_intercepts[i] = security_val_coefs[s][0][k]
+                security_val_slopes[i] = security_val_coefs[s][1][k]
+                ownership_val_intercepts[i] = ownership_val_coefs[s][0][k]
+                ownership_val_slopes[i] = ownership_val_coefs[s][1][k]
+
+        conversion_breakpoints = \
+            ConversionBreakpoints(
+                breakpoints=breakpoints,
+                conversion_scenarios=conversion_scenarios,
+                capital_structures=capital_structures,
+                conversion_scenario_indices=conversion_scenario_indices,
+                security_labels=security_labels,
+                security_val_intercepts=security_val_intercepts,
+                security_val_slopes=security_val_slopes,
+                owners=owners,
+                ownership_val_intercepts=ownership_val_intercepts,
+                ownership_val_slopes=ownership_val_slopes)
+        if key is not None:
+            self._derived[key] = conversion_breakpoints
+        return conversion_breakpoints
+
+    def as_converted_security_val_coefs(self, conversion_breakpoints):
+        # piecewise-linear coefficients of per-unit values of the Securities currently outstanding, counting each
+        # converted unit at its Conversion Ratio times the Common Share value in the equilibrium Conversion Scenario
+        common_share_index = conversion_breakpoints.security_labels.index(self.common_share_label)
+        intercepts = conversion_breakpoints.security_val_intercepts.copy()
+        slopes = conversion_breakpoints.security_val_slopes.copy()
+        for j, security_label in enumerate(conversion_breakpoints.security_labels):
+            n = self[security_label].n
+            if (security_label in self.optional_conversion_ratios) and n:
+                conversion_ratio = self.optional_conversion_ratios[security_label]
+                unconverted_fractions = \
+                    array([capital_structure[security_label].n / n
+                           for capital_structure in conversion_breakpoints.capital_structures]
+                          )[conversion_breakpoints.conversion_scenario_indices]
+                for coefs in intercepts, slopes:
+                    coefs[:, j] = \
+                        unconverted_fractions * coefs[:, j] + \
+                        (1 - unconverted_fractions) * conversion_ratio * coefs[:, common_share_index]
+        return intercepts, slopes
+
+    def opm_allocation(self, enterprise_val=0., volatility=.01, term=1., risk_free_rate=0., **kwargs):
+        # Option-Pricing-Method allocation: present per-unit values of the Securities currently outstanding, and
+        # Ownership values, given a lognormal Enterprise Value at exit after the given term and Pareto-equilibrium
+        # conversions at exit; enterprise_val, volatility, term & risk_free_rate may be arrays, e.g. vol x term grids
+        from .Options import piecewise_linear_payoff_vals   # imports SciPy, hence deferred to first use
+        conversion_breakpoints = self.conversion_breakpoints(**kwargs)
+        security_val_intercepts, security_val_slopes = self.as_converted_security_val_coefs(conversion_breakpoints)
+        security_vals = \
+            piecewise_linear_payoff_vals(
+                conversion_breakpoints.breakpoints, security_val_intercepts, security_val_slopes,
+                underlying_val=enterprise_val, volatility=volatility, term=term, risk_free_rate=risk_free_rate)
+        ownership_vals = \
+            piecewise_linear_payoff_vals(
+                conversion_breakpoints.breakpoints,
+                conversion_breakpoints.ownership_val_intercepts,
+                conversion_breakpoints.ownership_val_slopes,
+                underlying_val=enterprise_val, volatility=volatility, term=term, risk_free_rate=risk_free_rate)
+        return dict(
+            security_vals={security_label: security_vals[..., j]
+                           for j, security_label in enumerate(conversion_breakpoints.security_labels)},
+            ownership_vals={owner: ownership_vals[..., j]
+                            for j, owner in enumerate(conversion_breakpoints.owners)})
+
+    def opm_backsolve(self, security_label, security_val, volatility=.01, term=1., risk_free_rate=0.,
+                      tolerance=1e-9, max_nb_iterations=200, **kwargs):
+        # Enterprise Values at which the OPM per-unit value of a Security equals a given (e.g. transaction) value,
+        # solved by vectorized bisection over whole arrays of security_val, volatility, term & risk_free_rate
+        from .Options import piecewise_linear_payoff_vals   # imports SciPy, hence deferred to first use
+        conversion_breakpoints = self.conversion_breakpoints(**kwargs)
+        j = conversion_breakpoints.security_labels.index(security_label)
+        security_val_intercepts, security_val_slopes = self.as_converted_security_val_coefs(conversion_breakpoints)
+
+        def opm_security_val(enterprise_val):
+            return piecewise_linear_payoff_vals(
+                conversion_breakpoints.breakpoints, security_val_intercepts[:, [j]], security_val_slopes[:, [j]],
+                underlying_val=enterprise_val, volatility=volatility, term=term, risk_free_rate=risk_free_rate)[..., 0]
+
+        security_val = array(security_val, dtype=float)
+        shape = broadcast(security_val, array(volatility), array(term), array(risk_free_rate)).shape
+        lower = zeros(shape)
+        upper = full(shape, max(abs(conversion_breakpoints.breakpoints).max(), 1.))
+        for _ in range(max_nb_iterations):
+            too_low = opm_security_val(upper) < security_val
+            if not too_low.any():
+                break
+            upper = where(too_low, 2 * upper, upper)
+        for _ in range(max_nb_iterations):
+            enterprise_val = (lower + upper) / 2
+            too_low = opm_security_val(enterprise_val) < security_val
+            lower = where(too_low, enterprise_val, lower)
+            upper = where(too_low, upper, enterprise_val)
+            if (upper - lower <= tolerance * maximum(upper, 1.)).all():
+                break
+        return (lower + upper) / 2
+
+    def simulate_exits(self, nb_paths=10 ** 6, enterprise_val=0., volatility=.01, years_to_exit=1., risk_free_rate=0.,
+                       discount_rate=None, enterprise_vals=None, chunk_size=10 ** 5, quantiles=(.05, .25, .5, .75, .95),
+                       reservoir_size=10 ** 5, random_state=None, callback=None, result_store=None,
+                       result_store_start=0, result_store_nb_rows=None, **kwargs):
+        # Monte Carlo exit simulation, in chunks of paths so that memory stays constant however many paths, of the
+        # payoff distributions of per-unit Securities (as converted) & of Owners, with Pareto-equilibrium conversions:
+        # - exit Enterprise Values are either lognormal, grown at risk_free_rate from enterprise_val over years_to_exit
+        #   (a number, or a function of (number of paths, RandomState) sampling years to exit), or user-supplied as
+        #   enterprise_vals: an array, or an iterable of chunks, each an array or a pair (array, years to exit);
+        # - payoffs are discounted at discount_rate (by default risk_free_rate) over years to exit;
+        # - callback, if given, is called with the running ExitSimulation after every chunk;
+        # - result_store, if given, keeps every path: a ResultStore, written from row result_store_start on, any of
+        #   whose columns "enterprise_vals", "discount_factors", "security_vals" & "ownership_vals" being filled;
+        #   or the path of a new ResultStore with all of them, one row per path, of result_store_nb_rows rows, which
+        #   must be given if enterprise_vals is an iterable of chunks, whose number of paths is unknown in advance
+        if discount_rate is None:
+            discount_rate = risk_free_rate
+        random_state = RandomState(random_state)
+        exit_simulation = \
+            ExitSimulation(self, quantiles=quantiles, reservoir_size=reservoir_size, random_state=random_state,
+                           **kwargs)
+        nb_labels = len(exit_simulation.conversion_breakpoints.security_labels) + \
+            len(exit_simulation.conversion_breakpoints.owners)
+        chunk_size = max(min(chunk_size, 10 ** 7 // nb_labels), 1)
+        if isinstance(result_store, str):
+            if result_store_nb_rows is None:
+                if enterprise_vals is None:
+                    result_store_nb_rows = nb_paths
+                elif hasattr(enterprise_vals, 'shape'):
+                    result_store_nb_rows = len(enterprise_vals)
+                else:
+                    raise ValueError('result_store_nb_rows must be given to create a Result Store '
+                                     'for an iterable of chunks of Enterprise Values')
+            result_store = \
+                ResultStore.create(
+                    result_store, nb_rows=result_store_nb_rows, columns=exit_simulation.result_store_columns())
+
+        def chunk_years_to_exit(n):
+            if callable(years_to_exit):
+                return array(years_to_exit(n, random_state), dtype=float)
+            else:
+                return full(n, years_to_exit, dtype=float)
+
+        def chunks():
+            if enterprise_vals is None:
+                for i in range(0, nb_paths, chunk_size):
+                    n = min(chunk_size, nb_paths - i)
+                    t = chunk_years_to_exit(n)
+                    yield enterprise_val * exp((risk_free_rate - volatility ** 2 / 2) * t +
+                                               volatility * sqrt(t) * random_state.standard_normal(n)), t
+            elif hasattr(enterprise_vals, 'shape'):
+                for i in range(0, len(enterprise_vals), chunk_size):
+                    chunk = enterprise_vals[i:(i + chunk_size)]
+                    yield chunk, chunk_years_to_exit(len(chunk))
+            else:
+                for chunk in enterprise_vals:
+                    if isinstance(chunk, tuple):
+                        yield chunk
+                    else:
+                        yield chunk, chunk_years_to_exit(len(chunk))
+
+        for exit_enterprise_vals, t in chunks():
+            paths = \
+                exit_simulation.update(exit_enterprise_vals,
+                                       discount_factors=exp(-discount_rate * array(t, dtype=float)))
+            if result_store is not None:
+                result_store.write(result_store_start, paths)
+                result_store_start += len(paths['enterprise_vals'])
+            if callback is not None:
+                callback(exit_simulation)
+
+        if result_store is not None:
+            result_store.flush()
+
+        return exit_simulation.summary()
 
-        convertibles = set(self.optional_conversion_ratios)
-        conversion_possibilities = set()
-        for owner, holdings in self.ownerships.items():
-            for security_label in set(holdings) & convertibles:
-                conversion_possibilities.add((owner, security_label))
+    def conversion_scenarios(self, conversions_tried={}, conversions_to_try=None, waterfall=True):
+
+        conversion_possibilities = \
+            {(owner, security_label)
+             for security_label in self.optional_conversion_ratios
+             for owner in self.holders.get(security_label, ())}
 
         if conversions_to_try is None:
             conversions_to_try = conversion_possibilities
@@ -305,21 +829,24 @@ class CapitalStructure:
                 conversions_tried_0[owner] = {security_label: False}
             d = self.conversion_scenarios(
                 conversions_tried=conversions_tried_0,
-                conversions_to_try=conversions_to_try.copy())
+                conversions_to_try=conversions_to_try.copy(),
+                waterfall=waterfall)
 
             conversions_tried_1 = conversions_tried.copy()
             if owner in conversions_tried_1:
                 conversions_tried_1[owner][security_label] = True
             else:
                 conversions_tried_1[owner] = {security_label: True}
-            d.update(
-                self.convert_to_common(
+            capital_structure = self.copy()
+            with capital_structure.deferred_waterfall(rebuild=waterfall):
+                capital_structure.convert_to_common(
                     owners=owner,
-                    securities=security_label,
-                    inplace=False)
-                .conversion_scenarios(
+                    securities=security_label)
+            d.update(
+                capital_structure.conversion_scenarios(
                     conversions_tried=conversions_tried_1,
-                    conversions_to_try=conversions_to_try.copy()))
+                    conversions_to_try=conversions_to_try.copy(),
+                    waterfall=waterfall))
 
             return d
 
@@ -328,75 +855,103 @@ class CapitalStructure:
             return {frozendict({owners: frozendict(conversions) for owners, conversions in conversions_tried.items()}):
                     self.copy()}
 
+    def no_conversion_scenario(self):
+        conversion_scenario = {}
+        for security_label in self.optional_conversion_ratios:
+            for owner in self.holders.get(security_label, ()):
+                if owner in conversion_scenario:
+                    conversion_scenario[owner][security_label] = False
+                else:
+                    conversion_scenario[owner] = {security_label: False}
+        return conversion_scenario
+
     def val(self, pareto_equil_conversions=False, **kwargs):
 
-        if self.optional_conversion_ratios and pareto_equil_conversions:
+        METRICS.increment('capital_structure_val_calls', pareto_equil_conversions=pareto_equil_conversions)
 
-            conversion_scenario_capital_structures = self.conversion_scenarios()
-            conversion_scenarios = conversion_scenario_capital_structures.keys()
+        key = self.result_cache_key('val', pareto_equil_conversions=pareto_equil_conversions, **kwargs)
+        if key is None:
+            return self._val(pareto_equil_conversions=pareto_equil_conversions, **kwargs)
+        val_results = self.result_cache.get(key)
+        if val_results is None:
+            val_results = self._val(pareto_equil_conversions=pareto_equil_conversions, **kwargs)
+            if val_results is None:
+                return
+            self.result_cache.put(key, val_results)
+        return dict(
+            conversion_scenario=val_results['conversion_scenario'],
+            capital_structure=val_results['capital_structure'].copy(),
+            security_vals=val_results['security_vals'].copy(),
+            ownership_vals=val_results['ownership_vals'].copy())
 
-            conversion_scenario_val_results = \
-                {conversion_scenario: capital_structure.val(pareto_equil_conversions=False, **kwargs)
-                 for conversion_scenario, capital_structure in conversion_scenario_capital_structures.items()}
+    def _val(self, pareto_equil_conversions=False, **kwargs):
 
-            conversion_scenario_ownership_vals = \
-                {conversion_scenario: val_results['ownership_vals']
-                 for conversion_scenario, val_results in conversion_scenario_val_results.items()}
+        if self._waterfall_pending and not self._waterfall_deferrals:
+            self.waterfall()
 
-            for conversion_scenario, ownership_vals in conversion_scenario_ownership_vals.items():
+        if self.optional_conversion_ratios and pareto_equil_conversions:
 
-                pareto = True
+            if ('enterprise_val' in kwargs) and ndim(kwargs['enterprise_val']):
+                raise ValueError('one Enterprise Value at a time: for arrays of Enterprise Values, '
+                                 'use conversion_breakpoints(...)(enterprise_vals)')
+
+            if ('enterprise_val' in kwargs) and not self.enterprise_val_dependent_claims():
+                kwargs = kwargs.copy()
+                enterprise_val = kwargs.pop('enterprise_val')
+                conversion_breakpoints = self.conversion_breakpoints(**kwargs)
+                s = conversion_breakpoints.conversion_scenario_indices[
+                    conversion_breakpoints.intervals(enterprise_val)]
+                if s >= 0:
+                    # a copy of the tabulated Conversion Scenario, which callers may modify without corrupting the
+                    # cached table, with its symbolic waterfall, which tabulation skips, rebuilt
+                    capital_structure = conversion_breakpoints.capital_structures[s].copy()
+                    if capital_structure._waterfall_pending:
+                        capital_structure.waterfall()
+                    val_results = conversion_breakpoints(enterprise_val)
+                    return dict(
+                        conversion_scenario=conversion_breakpoints.conversion_scenarios[s],
+                        capital_structure=capital_structure,
+                        security_vals={security_label: float64(security_val)
+                                       for security_label, security_val in val_results['security_vals'].items()},
+                        ownership_vals={owner: float64(ownership_val)
+                                        for owner, ownership_val in val_results['ownership_vals'].items()})
 
-                for owner, conversions in conversion_scenario.items():
+            else:
 
-                    for alternative_conversion_scenario in conversion_scenarios:
+                conversion_scenario_capital_structures = self.conversion_scenarios()
+                conversion_scenarios = list(conversion_scenario_capital_structures)
 
-                        pareto_alternative = True
+                conversion_scenario_val_results = \
+                    {conversion_scenario: capital_structure.val(pareto_equil_conversions=False, **kwargs)
+                     for conversion_scenario, capital_structure in conversion_scenario_capital_structures.items()}
 
-                        for another_owner, another_owner_conversions in alternative_conversion_scenario.items():
-                            if another_owner != owner:
-                                pareto_alternative &= \
-                                    (conversion_scenario[another_owner] ==
-                                     alternative_conversion_scenario[another_owner])
-                                if not pareto_alternative:
-                                    break
+                conversion_scenario = \
+                    pareto_equil_conversion_scenario(
+                        conversion_scenarios,
+                        {conversion_scenario: val_results['ownership_vals']
+                         for conversion_scenario, val_results in conversion_scenario_val_results.items()})
 
-                        if pareto_alternative:
-                            pareto &= \
-                                (ownership_vals[owner] >=
-                                 conversion_scenario_ownership_vals[alternative_conversion_scenario][owner])
-                        else:
-                            continue
-
-                if pareto:
+                if conversion_scenario is not None:
                     return dict(
                         conversion_scenario=conversion_scenario,
                         capital_structure=conversion_scenario_capital_structures[conversion_scenario],
                         security_vals=conversion_scenario_val_results[conversion_scenario]['security_vals'],
-                        ownership_vals=ownership_vals)
+                        ownership_vals=conversion_scenario_val_results[conversion_scenario]['ownership_vals'])
 
         else:
 
-            convertibles = set(self.optional_conversion_ratios)
-            conversion_scenario = {}
-            for owner, holdings in self.ownerships.items():
-                for security_label in set(holdings) & convertibles:
-                    if owner in conversion_scenario:
-                        conversion_scenario[owner][security_label] = False
-                    else:
-                        conversion_scenario[owner] = {security_label: False}
+            conversion_scenario = self.no_conversion_scenario()
 
             security_vals = \
                 {security_label: float64(self[security_label].security.val(**kwargs))
                  for security_label in self.outstanding}
 
-            ownership_vals = {}
-            for owner, holdings in self.ownerships.items():
-                ownership_vals[owner] = \
-                    reduce(
-                        lambda x, y: x + y,
-                        map(lambda (security_label, quantity): quantity * security_vals[security_label],
-                            holdings.items()))
+            ledger = self.ownership_ledger()
+            ownership_vals = \
+                dict(zip(
+                    ledger.owners,
+                    ledger.ownership_vals(
+                        [security_vals[security_label] for security_label in ledger.security_labels])))
 
             return dict(
                 conversion_scenario=conversion_scenario,
@@ -404,30 +959,59 @@ class CapitalStructure:
                 security_vals=security_vals,
                 ownership_vals=ownership_vals)
 
-    def __call__(self, pareto_equil_conversions=False, ownerships=False, **kwargs):
+    def __call__(self, pareto_equil_conversions=False, ownerships=False, records=False, **kwargs):
+        # records=True gives a NumPy record array, without the TOTAL row, for programmatic callers
+        key = self.result_cache_key(
+            '__call__', pareto_equil_conversions=pareto_equil_conversions, ownerships=ownerships, records=records,
+            **kwargs)
+        if key is None:
+            return self._table(pareto_equil_conversions=pareto_equil_conversions, ownerships=ownerships,
+                               records=records, **kwargs)
+        table = self.result_cache.get(key)
+        if table is None:
+            table = self._table(pareto_equil_conversions=pareto_equil_conversions, ownerships=ownerships,
+                                records=records, **kwargs)
+            self.result_cache.put(key, table)
+        return table.copy()
+
+    def _table(self, pareto_equil_conversions=False, ownerships=False, records=False, **kwargs):
         val_results = self.val(pareto_equil_conversions=pareto_equil_conversions, **kwargs)
         capital_structure = val_results['capital_structure']
         security_vals = val_results['security_vals']
         if ownerships:
-            df = DataFrame(columns=['Owner', 'Security', 'Val', 'Share'])
+            ledger = capital_structure.ownership_ledger()
             common_share_val = capital_structure[self.common_share_label].n * security_vals[self.common_share_label]
-            i = 0
-            for owner, holdings in capital_structure.ownerships.items():
-                for security_label, quantity in holdings.items():
-                    security_val = quantity * security_vals[security_label]
-                    if security_label == self.common_share_label:
-                        share_in_common = security_val / common_share_val
-                    else:
-                        share_in_common = nan
-                    df.loc[i] = owner, security_label, security_val, share_in_common
-                    i += 1
-            df.loc['TOTAL'] = 2 * ('',) + (df.Val.sum(), df.Share.sum())
+            vals = ledger.holding_vals([security_vals[security_label] for security_label in ledger.security_labels])
+            shares_in_common = \
+                where(ledger.holding_security_indices == ledger.security_indices[self.common_share_label],
+                      vals / common_share_val,
+                      nan)
+            owners = array(ledger.owners, dtype=object)[ledger.holding_owner_indices]
+            security_labels = array(ledger.security_labels, dtype=object)[ledger.holding_security_indices]
+            if records:
+                return data_frame_or_records(
+                    [('Owner', owners), ('Security', security_labels), ('Val', vals), ('Share', shares_in_common)],
+                    records=True)
+            return data_frame_or_records(
+                [('Owner', owners.tolist() + ['']),
+                 ('Security', security_labels.tolist() + ['']),
+                 ('Val', vals.tolist() + [vals.sum()]),
+                 ('Share', shares_in_common.tolist() + [nansum(shares_in_common)])],
+                index=(None, list(range(len(ledger))) + ['TOTAL']))
         else:
-            df = capital_structure.show()
-            df['Val / Unit'] = [security_vals[security_label] for security_label in df.index]
-            df['Val'] = df.Outstanding * df['Val / Unit']
-            df.loc['TOTAL'] = 4 * [''] + [df.Val.sum()]
-        return df
+            security_view = capital_structure.show(records=True)
+            vals_per_unit = array([security_vals[security_label] for security_label in security_view.Security],
+                                  dtype=float)
+            vals = security_view.Outstanding * vals_per_unit
+            if records:
+                return data_frame_or_records(
+                    [(name, security_view[name]) for name in security_view.dtype.names] +
+                    [('Val / Unit', vals_per_unit), ('Val', vals)],
+                    records=True)
+            return data_frame_or_records(
+                [(name, security_view[name].tolist() + ['']) for name in security_view.dtype.names[1:]] +
+                [('Val / Unit', vals_per_unit.tolist() + ['']), ('Val', vals.tolist() + [vals.sum()])],
+                index=(None, security_view.Security.tolist() + ['TOTAL']))
 
     def parse_owners_securities_holdings(self, owners=None, securities=None):
 
@@ -441,13 +1025,11 @@ class CapitalStructure:
                     securities = securities,
 
                 for security_label in securities:
-                    for owner, holdings in self.ownerships.items():
-                        if security_label in holdings:
-                            quantity = holdings[security_label]
-                            if owner in d:
-                                d[owner][security_label] = quantity
-                            else:
-                                d[owner] = {security_label: quantity}
+                    for owner, quantity in self.holders.get(security_label, {}).items():
+                        if owner in d:
+                            d[owner][security_label] = quantity
+                        else:
+                            d[owner] = {security_label: quantity}
 
             elif isinstance(owners, (list, tuple)):
 
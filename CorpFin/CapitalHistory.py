@@ -0,0 +1,134 @@
+from __future__ import absolute_import, division, print_function
+from bisect import bisect_right
+from datetime import date, datetime
+from json import loads
+from namedlist import namedlist
+from .Capital import CapitalStructure
+from .Security import Security
+
+
+capital_event_factory = namedlist('CapitalEvent', ['date', 'action', 'kwargs'])
+
+CAPITAL_EVENT_ACTIONS = 'create_securities', 'issue', 'transfer', 'redeem', 'convert_to_common'
+
+
+def parse_date(d):
+    if isinstance(d, datetime):
+        return d.date()
+    elif isinstance(d, date):
+        return d
+    else:
+        return datetime.strptime(str(d)[:10], '%Y-%m-%d').date()
+
+
+def native_strs(obj):   # JSON gives Unicode strings on Python 2, whereas Security labels are checked against "str"
+    if isinstance(obj, dict):
+        return {native_strs(k): native_strs(v) for k, v in obj.items()}
+    elif isinstance(obj, list):
+        return [native_strs(item) for item in obj]
+    elif isinstance(obj, type(u'')) and not isinstance(obj, str):
+        return obj.encode('utf-8')
+    else:
+        return obj
+
+
+def parse_capital_event(capital_event):
+    if isinstance(capital_event, dict):
+        kwargs = native_strs(capital_event)
+        d = kwargs.pop('date')
+        action = kwargs.pop('action')
+    else:
+        d, action, kwargs = capital_event
+    if action not in CAPITAL_EVENT_ACTIONS:
+        raise ValueError('unknown Capital Event action "%s"' % action)
+    return capital_event_factory(date=parse_date(d), action=action, kwargs=kwargs)
+
+
+def load_capital_events(path):
+    # one JSON object per line, e.g.:
+    # {"date": "2015-06-30", "action": "create_securities", "label": "Series A", "claim_val": 1.5,
+    #  "conversion_ratio": 1}
+    # {"date": "2015-06-30", "action": "issue", "owner": "VC Fund I", "securities": {"Series A": 1000000}}
+    with open(path) as f:
+        return [parse_capital_event(loads(line)) for line in f if line.strip()]
+
+
+def apply_capital_event(capital_structure, capital_event):
+    kwargs = capital_event.kwargs
+    if capital_event.action == 'create_securities':
+        # a fresh Security for every replay, since Capital Structures update their Securities' values in place
+        security = Security(label=kwargs['label'], claim_val=kwargs.get('claim_val', 0.))
+        conversion_ratio = kwargs.get('conversion_ratio')
+        if conversion_ratio is None:
+            securities = security
+        else:
+            securities = (security, conversion_ratio),
+        if capital_structure is None:
+            return CapitalStructure(securities)
+        capital_structure.create_securities(
+            securities,
+            liquidation_order=kwargs.get('liquidation_order'),
+            insert=kwargs.get('insert', False))
+    elif capital_structure is None:
+        raise ValueError('Capital Event "%s" on %s precedes any Capital Structure: the first Capital Event must be '
+                         '"create_securities", unless an inception Capital Structure is given'
+                         % (capital_event.action, capital_event.date))
+    else:
+        getattr(capital_structure, capital_event.action)(**kwargs)
+    return capital_structure
+
+
+class CapitalHistory:
+    def __init__(self, capital_structure=None, capital_events=(), snapshot_interval=100):
+        # capital_structure: Capital Structure at inception, or None if the first Capital Event creates the Common Share
+        self.capital_structure = capital_structure
+        self.capital_events = []
+        self.dates = []
+        self.snapshot_interval = snapshot_interval
+        self.snapshots = {}   # number of Capital Events applied -> copy-on-write Capital Structure snapshot
+        self.record(*capital_events)
+
+    def __len__(self):
+        return len(self.capital_events)
+
+    def record(self, *capital_events):
+        for capital_event in capital_events:
+            capital_event = parse_capital_event(capital_event)
+            i = bisect_right(self.dates, capital_event.date)
+            self.capital_events.insert(i, capital_event)
+            self.dates.insert(i, capital_event.date)
+            for nb_capital_events in list(self.snapshots):
+                if nb_capital_events > i:
+                    del self.snapshots[nb_capital_events]
+
+    def as_of(self, d=None):
+        if d is None:
+            nb_capital_events = len(self)
+        else:
+            nb_capital_events = bisect_right(self.dates, parse_date(d))
+
+        # replay from the nearest snapshot at or before the requested date
+        snapshot_nbs_capital_events = [i for i in self.snapshots if i <= nb_capital_events]
+        if snapshot_nbs_capital_events:
+            i = max(snapshot_nbs_capital_events)
+            capital_structure = self.snapshots[i].copy()
+        else:
+            i = 0
+            if self.capital_structure is None:
+                capital_structure = None
+            else:
+                capital_structure = self.capital_structure.copy()
+
+        if (capital_structure is None) and (i < nb_capital_events):
+            capital_structure = apply_capital_event(None, self.capital_events[i])
+            i += 1
+
+        if capital_structure is not None:
+            # apply Capital Events in bulk, rebuilding the waterfall once at the end
+            with capital_structure.deferred_waterfall():
+                for i in range(i, nb_capital_events):
+                    apply_capital_event(capital_structure, self.capital_events[i])
+                    if not ((i + 1) % self.snapshot_interval):
+                        self.snapshots[i + 1] = capital_structure.copy()
+
+        return capital_structure
@@ -0,0 +1,153 @@
+from __future__ import absolute_import, division, print_function
+from numpy import ascontiguousarray, asarray, broadcast_arrays, broadcast_to
+from sympy import Expr, Number, Pow, Symbol, srepr
+from .Caching import LRUCache
+from .Instrumentation import METRICS
+
+
+# process-wide cache: canonical structures of expressions, with constants lifted into parameters -> compiled functions
+COMPILED_FUNCTIONS = LRUCache(max_size=10 ** 4)
+
+UNLIFTED_CONSTANTS = 0, 1, -1
+
+
+def constant_param(i):
+    return Symbol('_constant_%i' % i)
+
+
+def input_param(i):
+    return Symbol('_input_%i' % i)
+
+
+def symbol_sort_key(symbol):
+    # by name, but with years, i.e. numerical suffixes such as that of "Revenue___2021", compared as numbers, so that
+    # a model's Inputs keep their order when rebased, e.g. "Revenue___9" before "Revenue___10"
+    prefix, separator, year = symbol.name.rpartition('___')
+    if separator and year.isdigit():
+        return prefix, int(year)
+    else:
+        return symbol.name, -1
+
+
+def lift_constants(exprs):
+    # replace numerical constants by parameter Symbols, so that expressions differing only in constants share one
+    # template; 0, 1, -1 & integer exponents are kept, since they shape the compiled graph itself
+    # sub-expressions shared within & across the expressions, e.g. by a Capital Structure's waterfall, are lifted once
+    params = {}
+    param_vals = []
+    lifted = {}
+
+    def lift(expr):
+        if expr in lifted:
+            return lifted[expr]
+        if isinstance(expr, Number):
+            if (expr in UNLIFTED_CONSTANTS) or not (expr.is_Float or expr.is_Rational):
+                lifted_expr = expr
+            else:
+                param_val = float(expr)
+                if param_val not in params:
+                    params[param_val] = constant_param(len(param_vals))
+                    param_vals.append(param_val)
+                lifted_expr = params[param_val]
+        elif isinstance(expr, Pow) and expr.exp.is_Integer:
+            lifted_expr = Pow(lift(expr.base), expr.exp)
+        elif expr.args:
+            lifted_expr = expr.func(*[lift(arg) for arg in expr.args])
+        else:
+            lifted_expr = expr
+        lifted[expr] = lifted_expr
+        return lifted_expr
+
+    return [lift(expr) for expr in exprs], param_vals
+
+
+def expr_dag(exprs):
+    # hashable form of the expressions as one DAG, each distinct sub-expression appearing once, however often shared:
+    # nodes in post-order, each an atom's srepr or a (function, indices of argument nodes) pair, & the root indices;
+    # unlike the srepr of the expressions, whose size is that of their trees, it grows with their distinct nodes only
+    node_indices = {}
+    nodes = []
+
+    def visit(expr):
+        i = node_indices.get(expr)
+        if i is None:
+            node = (expr.func, tuple(visit(arg) for arg in expr.args)) if expr.args else srepr(expr)
+            i = node_indices[expr] = len(nodes)
+            nodes.append(node)
+        return i
+
+    roots = tuple(visit(expr) for expr in exprs)
+    return tuple(nodes), roots
+
+
+def compile_exprs(exprs, vectorized=False):
+    # one function of the expressions' free Symbols, sorted by name & year, followed by their lifted constants,
+    # reused for all expressions of the same structure, whatever their Symbols' names, e.g. a Valuation Model's
+    # expressions whose input names carry years, shared by the same model rebased to another year;
+    # vectorized: the free Symbols' inputs are 1-dimensional arrays, e.g. of scenarios
+    templates, param_vals = lift_constants(exprs)
+    symbols = sorted(set().union(*[expr.free_symbols for expr in exprs]), key=symbol_sort_key)
+    input_params = [input_param(i) for i in range(len(symbols))]
+    templates = [template.xreplace(dict(zip(symbols, input_params))) for template in templates]
+    key = vectorized, expr_dag(templates)
+    function = COMPILED_FUNCTIONS.get(key)
+    if function is None:
+        from sympy.printing.theanocode import theano_function   # imports Theano, hence deferred to first compile
+        METRICS.increment('compile_cache_misses')
+        with METRICS.timer('expr_compile', nb_exprs=len(exprs), vectorized=vectorized):
+            function = \
+                theano_function(
+                    input_params + [constant_param(i) for i in range(len(param_vals))],
+                    templates,
+                    broadcastables={symbol: (False,) for symbol in input_params} if vectorized else None)
+        COMPILED_FUNCTIONS.put(key, function)
+    else:
+        METRICS.increment('compile_cache_hits')
+    return [symbol.name for symbol in symbols], param_vals, function
+
+
+class CompiledExprs:   # numerical evaluation of SymPy expressions, compiled (or fetched from the cache) on first call
+    def __init__(self, *exprs):
+        self.exprs = exprs
+        self.symbol_names = self.param_vals = self.function = self.vectorized_function = None
+
+    def compile(self, vectorized=False):
+        if vectorized:
+            if self.vectorized_function is None:
+                self.symbol_names, self.param_vals, self.vectorized_function = \
+                    compile_exprs(self.exprs, vectorized=True)
+        elif self.function is None:
+            self.symbol_names, self.param_vals, self.function = compile_exprs(self.exprs)
+        return self
+
+    def __call__(self, **kwargs):
+        self.compile()
+        return self.function(*([kwargs[symbol_name] for symbol_name in self.symbol_names] + self.param_vals))
+
+    def vals(self, **kwargs):
+        # vectorized evaluation: inputs may be arrays of any shapes broadcasting together, each output having the
+        # broadcast shape; all scenarios go through the compiled function in one call;
+        # contiguous float64 inputs of the broadcast shape, e.g. scenario table columns, are passed on uncopied
+        self.compile(vectorized=True)
+        inputs = [asarray(kwargs[symbol_name], dtype=float) for symbol_name in self.symbol_names]
+        if len({x.shape for x in inputs}) > 1:
+            inputs = broadcast_arrays(*inputs)
+        shape = inputs[0].shape if inputs else ()
+        size = inputs[0].size if inputs else 1
+        outputs = self.vectorized_function(*([ascontiguousarray(x).reshape(size) for x in inputs] + self.param_vals))
+        if len(self.exprs) == 1:
+            outputs = outputs,
+        # outputs not depending on any input, e.g. constant ones, come out as scalars
+        outputs = [broadcast_to(asarray(output, dtype=float), (size,)).reshape(shape) for output in outputs]
+        if len(self.exprs) == 1:
+            return outputs[0]
+        else:
+            return outputs
+
+
+def theanify(sympy_expr):
+    # drop-in for HelpyFuncs' sympy_theanify, sharing compiled functions across expressions of the same structure
+    if isinstance(sympy_expr, Expr):
+        return CompiledExprs(sympy_expr)
+    else:
+        return lambda **kwargs: sympy_expr
@@ -0,0 +1,88 @@
+from __future__ import absolute_import, division, print_function
+from sympy import Basic
+
+try:
+    from collections.abc import Mapping
+except ImportError:   # Python 2
+    from collections import Mapping
+
+
+GRAPH_STAT_NAMES = 'nb_nodes', 'nb_tree_nodes', 'depth', 'shared_ratio', 'nb_free_symbols'
+
+
+def expr_graph_stats(expr):
+    # size & shape of a SymPy expression's graph:
+    # - nb_nodes: unique sub-expressions, i.e. nodes of the expression as a DAG;
+    # - nb_tree_nodes: nodes of the expression written out as a tree, i.e. counting repeated sub-expressions each time;
+    # - depth: longest path from the root to a leaf, in nodes;
+    # - shared_ratio: share of tree nodes saved by sharing, i.e. 1 - nb_nodes / nb_tree_nodes;
+    # - nb_free_symbols
+    if not isinstance(expr, Basic):
+        return dict(nb_nodes=0, nb_tree_nodes=0, depth=0, shared_ratio=0., nb_free_symbols=0)
+
+    # iterative post-order traversal, memoizing (tree size, depth) per unique sub-expression
+    tree_sizes_and_depths = {}
+    stack = [expr]
+    while stack:
+        node = stack[-1]
+        if node in tree_sizes_and_depths:
+            stack.pop()
+            continue
+        args_to_visit = [arg for arg in node.args if arg not in tree_sizes_and_depths]
+        if args_to_visit:
+            stack.extend(args_to_visit)
+        else:
+            stack.pop()
+            tree_sizes_and_depths[node] = \
+                1 + sum(tree_sizes_and_depths[arg][0] for arg in node.args), \
+                1 + max([tree_sizes_and_depths[arg][1] for arg in node.args] + [0])
+
+    nb_nodes = len(tree_sizes_and_depths)
+    nb_tree_nodes, depth = tree_sizes_and_depths[expr]
+    return dict(
+        nb_nodes=nb_nodes,
+        nb_tree_nodes=nb_tree_nodes,
+        depth=depth,
+        shared_ratio=1. - nb_nodes / nb_tree_nodes,
+        nb_free_symbols=len(expr.free_symbols))
+
+
+def graph_stats_data_frame(exprs, item_labels=None):
+    # one row per expression: exprs is a dict name -> expression, or list of expressions (e.g. by year);
+    # item_labels: dict name -> labels of the items of a list of expressions (by default their indices)
+    from pandas import DataFrame
+    rows = []
+    index = []
+    for name in sorted(exprs):
+        expr = exprs[name]
+        if isinstance(expr, (list, tuple)):
+            labels = item_labels[name] if item_labels and (name in item_labels) else list(range(len(expr)))
+            for label, item_expr in zip(labels, expr):
+                index.append((name, label))
+                rows.append(expr_graph_stats(item_expr))
+        else:
+            index.append((name, ''))
+            rows.append(expr_graph_stats(expr))
+    df = DataFrame(rows, columns=GRAPH_STAT_NAMES)
+    df.index = index
+    return df
+
+
+def check_graph_stats(graph_stats, max_nb_nodes=None, baseline=None, max_growth=.1, stat='nb_nodes'):
+    # raise AssertionError if any expression's graph is larger than max_nb_nodes, or has grown by more than max_growth
+    # relative to a baseline (e.g. of a previous release): a data frame from graph_stats_data_frame, or a dict
+    # of the same index -> value of the checked stat
+    failures = []
+    if max_nb_nodes is not None:
+        for index, nb_nodes in graph_stats['nb_nodes'].items():
+            if nb_nodes > max_nb_nodes:
+                failures.append('%s: %i nodes > %i' % (index, nb_nodes, max_nb_nodes))
+    if baseline is not None:
+        if not isinstance(baseline, Mapping):
+            baseline = dict(baseline[stat].items())
+        for index, val in graph_stats[stat].items():
+            if (index in baseline) and (val > (1 + max_growth) * baseline[index]):
+                failures.append(
+                    '%s: %s = %s > (1 + %s) x baseline %s' % (index, stat, val, max_growth, baseline[index]))
+    if failures:
+        raise AssertionError('expression graphs too large:\n' + '\n'.join(failures))
@@ -0,0 +1,114 @@
+from __future__ import absolute_import, division, print_function
+import logging
+import os
+from contextlib import contextmanager
+from threading import Lock
+from timeit import default_timer
+
+
+class MetricsRegistry:   # counters & timers, keyed by name & labels, silent unless callbacks are added
+    def __init__(self, prefix='corpfin'):
+        self.prefix = prefix
+        self.enabled = True
+        self.counters = {}   # (name, sorted label items) -> count
+        self.timers = {}   # (name, sorted label items) -> [count, total seconds, max seconds]
+        self.callbacks = []   # functions of (kind, name, value, labels), called on every record
+        self.lock = Lock()
+
+    def add_callback(self, callback):
+        self.callbacks.append(callback)
+        return callback
+
+    def remove_callback(self, callback):
+        self.callbacks.remove(callback)
+
+    def increment(self, name, value=1, **labels):
+        if self.enabled:
+            key = name, tuple(sorted(labels.items()))
+            with self.lock:
+                self.counters[key] = self.counters.get(key, 0) + value
+            for callback in self.callbacks:
+                callback('counter', name, value, labels)
+
+    def observe(self, name, seconds, **labels):
+        if self.enabled:
+            key = name, tuple(sorted(labels.items()))
+            with self.lock:
+                timer = self.timers.setdefault(key, [0, 0., 0.])
+                timer[0] += 1
+                timer[1] += seconds
+                timer[2] = max(timer[2], seconds)
+            for callback in self.callbacks:
+                callback('timer', name, seconds, labels)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        tic = default_timer()
+        try:
+            yield
+        finally:
+            self.observe(name, default_timer() - tic, **labels)
+
+    def reset(self):
+        with self.lock:
+            self.counters.clear()
+            self.timers.clear()
+
+    def snapshot(self):
+        with self.lock:
+            return dict(
+                counters=[dict(name=name, labels=dict(labels), value=value)
+                          for (name, labels), value in sorted(self.counters.items())],
+                timers=[dict(name=name, labels=dict(labels), count=count, total_seconds=total, max_seconds=maximum)
+                        for (name, labels), (count, total, maximum) in sorted(self.timers.items())])
+
+    def prometheus_text(self):
+        # Prometheus text exposition format: counters as "_total", timers as summaries' "_seconds_count" / "_sum"
+        def labels_str(labels):
+            if labels:
+                return '{%s}' % ','.join('%s="%s"' % (k, str(v).replace('\\', '\\\\').replace('"', '\\"'))
+                                         for k, v in labels)
+            else:
+                return ''
+
+        with self.lock:
+            counters = sorted(self.counters.items())
+            timers = sorted(self.timers.items())
+        lines = []
+        typed_names = set()
+        for (name, labels), value in counters:
+            metric_name = '%s_%s_total' % (self.prefix, name)
+            if metric_name not in typed_names:
+                lines.append('# TYPE %s counter' % metric_name)
+                typed_names.add(metric_name)
+            lines.append('%s%s %s' % (metric_name, labels_str(labels), value))
+        for (name, labels), (count, total, maximum) in timers:
+            metric_name = '%s_%s_seconds' % (self.prefix, name)
+            if metric_name not in typed_names:
+                lines.append('# TYPE %s summary' % metric_name)
+                typed_names.add(metric_name)
+            lines.append('%s_count%s %i' % (metric_name, labels_str(labels), count))
+            lines.append('%s_sum%s %r' % (metric_name, labels_str(labels), total))
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, path):
+        # e.g. to a file collected by node_exporter's textfile collector; written whole, then renamed into place
+        temp_path = path + '.tmp'
+        with open(temp_path, 'w') as f:
+            f.write(self.prometheus_text())
+        os.rename(temp_path, path)
+
+
+def logging_callback(logger=None, level=logging.DEBUG):
+    # callback logging every record, e.g. METRICS.add_callback(logging_callback())
+    if logger is None:
+        logger = logging.getLogger('CorpFin')
+
+    def callback(kind, name, value, labels):
+        logger.log(level, '%s %s %s %s', kind, name, value, labels)
+
+    return callback
+
+
+# process-wide registry used by ValModel, CapitalStructure, Portfolio & the compile cache
+METRICS = MetricsRegistry()
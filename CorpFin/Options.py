@@ -0,0 +1,48 @@
+from __future__ import absolute_import, division, print_function
+from numpy import array, errstate, exp, log, searchsorted, sqrt
+from scipy.special import ndtr
+
+
+def black_scholes_d1_d2(underlying_val=1., strike=1., volatility=.01, term=1., risk_free_rate=0.):
+    with errstate(divide='ignore', invalid='ignore'):
+        vol_sqrt_term = volatility * sqrt(term)
+        d1 = (log(underlying_val / strike) + (risk_free_rate + volatility ** 2 / 2) * term) / vol_sqrt_term
+    return d1, d1 - vol_sqrt_term
+
+
+def black_scholes_call_val(underlying_val=1., strike=1., volatility=.01, term=1., risk_free_rate=0.):
+    d1, d2 = black_scholes_d1_d2(underlying_val, strike, volatility, term, risk_free_rate)
+    return underlying_val * ndtr(d1) - strike * exp(-risk_free_rate * term) * ndtr(d2)
+
+
+def black_scholes_digital_call_val(underlying_val=1., strike=1., volatility=.01, term=1., risk_free_rate=0.):
+    d1, d2 = black_scholes_d1_d2(underlying_val, strike, volatility, term, risk_free_rate)
+    return exp(-risk_free_rate * term) * ndtr(d2)
+
+
+def piecewise_linear_payoff_vals(
+        breakpoints, intercepts, slopes,
+        underlying_val=1., volatility=.01, term=1., risk_free_rate=0.):
+    # present values, under lognormal Black-Scholes dynamics, of payoffs that are piecewise-linear in the underlying's
+    # value at term, i.e. intercepts[i] + slopes[i] * V between breakpoints[i - 1] & breakpoints[i];
+    # intercepts & slopes have one row per interval & one column per payoff, and all other inputs broadcast,
+    # giving an array of shape broadcast shape x payoffs;
+    # each payoff is its value at V = 0, plus the underlying times its initial slope, plus a call spread at every
+    # positive breakpoint where its slope changes, plus a digital call at every positive breakpoint where it jumps
+    underlying_val = array(underlying_val, dtype=float)[..., None]
+    volatility = array(volatility, dtype=float)[..., None]
+    term = array(term, dtype=float)[..., None]
+    risk_free_rate = array(risk_free_rate, dtype=float)[..., None]
+
+    i0 = searchsorted(breakpoints, 0., side='right')
+    strikes = breakpoints[i0:]
+    slope_changes = slopes[i0 + 1:] - slopes[i0:-1]
+    jumps = (intercepts[i0 + 1:] + slopes[i0 + 1:] * strikes[:, None]) - \
+        (intercepts[i0:-1] + slopes[i0:-1] * strikes[:, None])
+
+    discount_factor = exp(-risk_free_rate * term)
+    call_vals = black_scholes_call_val(underlying_val, strikes, volatility, term, risk_free_rate)
+    digital_call_vals = black_scholes_digital_call_val(underlying_val, strikes, volatility, term, risk_free_rate)
+
+    return discount_factor * intercepts[i0] + underlying_val * slopes[i0] + \
+        call_vals.dot(slope_changes) + digital_call_vals.dot(jumps)
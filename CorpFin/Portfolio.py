@@ -1,15 +1,142 @@
+from collections import OrderedDict
 from namedlist import namedlist
-from pandas import DataFrame
+from numpy import array, broadcast, broadcast_to, zeros
+from sympy import Expr
+from .Instrumentation import METRICS
 from .Security import Security
 
 
 def val(asset, **kwargs):
-    if isinstance(asset, (Security, Portfolio)):
+    # keyword inputs may be arrays (e.g. of scenarios), broadcasting together
+    if isinstance(asset, Portfolio):
         return asset.val(**kwargs)
+    elif isinstance(asset, (Security, Stake)):
+        return asset.vals(**kwargs)
     else:
         return asset
 
 
+class Stake:   # position in a Security of a Capital Structure, by label, re-resolved whenever valued
+    def __init__(self, capital_structure, security_label, enterprise_val='enterprise_val',
+                 pareto_equil_conversions=False):
+        # enterprise_val: name of the keyword input giving the company's Enterprise Value
+        self.capital_structure = capital_structure
+        self.security_label = security_label
+        self.enterprise_val = enterprise_val
+        self.pareto_equil_conversions = pareto_equil_conversions
+
+    def capital_structure_key(self):
+        # Stakes with equal keys share one evaluation of their Capital Structure's waterfall
+        return id(self.capital_structure), self.enterprise_val, self.pareto_equil_conversions
+
+    def key(self):
+        return self.capital_structure_key() + (self.security_label,)
+
+    def claim_kwargs(self, **kwargs):
+        claim_symbol_names = \
+            {symbol.name
+             for n, security in self.capital_structure.outstanding.values()
+             if isinstance(security.claim_val_expr, Expr)
+             for symbol in security.claim_val_expr.free_symbols}
+        return {k: v for k, v in kwargs.items() if k in claim_symbol_names}
+
+    def piecewise_linear(self):
+        # per-unit values are piecewise-linear in Enterprise Value, & tabulated by conversion breakpoints, unless
+        # Claim Values depend on Enterprise Value
+        return not self.capital_structure.enterprise_val_dependent_claims()
+
+    def waterfall_security(self, security_label):
+        # Security with val_expr from the Capital Structure's current waterfall, for Claim Values depending on
+        # Enterprise Value, whose values only the waterfall's compiled expressions give
+        if self.pareto_equil_conversions:
+            raise ValueError('Pareto-equilibrium conversions of Stake in "%s" need Claim Values not depending on '
+                             'Enterprise Value, unlike those of %s'
+                             % (self.security_label,
+                                ', '.join('"%s"' % label
+                                          for label in self.capital_structure.enterprise_val_dependent_claims())))
+        if self.capital_structure._waterfall_pending and not self.capital_structure._waterfall_deferrals:
+            self.capital_structure.waterfall()
+        return self.capital_structure[security_label].security
+
+    def waterfall_kwargs(self, **kwargs):
+        kwargs = dict(kwargs)
+        kwargs['enterprise_val'] = kwargs[self.enterprise_val]
+        return kwargs
+
+    def capital_structure_val_coefs(self, **kwargs):
+        # Conversion breakpoints & piecewise-linear coefficients of per-unit as-converted values of all Securities of
+        # the Capital Structure, as currently outstanding; cached by the Capital Structure until it changes
+        conversion_breakpoints = \
+            self.capital_structure.conversion_breakpoints(
+                pareto_equil_conversions=self.pareto_equil_conversions, **self.claim_kwargs(**kwargs))
+        return conversion_breakpoints, \
+            self.capital_structure.as_converted_security_val_coefs(conversion_breakpoints)
+
+    def capital_structure_vals(self, **kwargs):
+        # per-unit values of all Securities of the Capital Structure, from one vectorized waterfall evaluation
+        if not self.piecewise_linear():
+            waterfall_kwargs = self.waterfall_kwargs(**kwargs)
+            return {security_label: self.waterfall_security(security_label).vals(**waterfall_kwargs)
+                    for security_label in self.capital_structure.outstanding}
+        enterprise_val = array(kwargs[self.enterprise_val], dtype=float)
+        conversion_breakpoints, (intercepts, slopes) = self.capital_structure_val_coefs(**kwargs)
+        i = conversion_breakpoints.intervals(enterprise_val)
+        security_vals = intercepts[i] + slopes[i] * enterprise_val[..., None]
+        return {security_label: security_vals[..., j]
+                for j, security_label in enumerate(conversion_breakpoints.security_labels)}
+
+    def vals(self, **kwargs):
+        return self.capital_structure_vals(**kwargs)[self.security_label]
+
+    def val(self, **kwargs):
+        return self.vals(**kwargs)
+
+    def sensitivities(self, second_order=True, **kwargs):
+        # per-unit values being piecewise-linear in Enterprise Value, deltas are the slopes & gammas are 0,
+        # except at breakpoints; otherwise, those of the current waterfall's expressions
+        if not self.piecewise_linear():
+            sensitivities = \
+                self.waterfall_security(self.security_label).sensitivities(
+                    second_order=second_order, **self.waterfall_kwargs(**kwargs))
+
+            def key(symbol_name):
+                return self.enterprise_val if symbol_name == 'enterprise_val' else symbol_name
+
+            sensitivities['deltas'] = {key(k): v for k, v in sensitivities['deltas'].items()}
+            sensitivities['gammas'] = {(key(k0), key(k1)): v for (k0, k1), v in sensitivities['gammas'].items()}
+            return sensitivities
+        enterprise_val = array(kwargs[self.enterprise_val], dtype=float)
+        conversion_breakpoints, (intercepts, slopes) = self.capital_structure_val_coefs(**kwargs)
+        i = conversion_breakpoints.intervals(enterprise_val)
+        j = conversion_breakpoints.security_labels.index(self.security_label)
+        sensitivities = \
+            dict(val=intercepts[i, j] + slopes[i, j] * enterprise_val,
+                 deltas={self.enterprise_val: slopes[i, j]},
+                 gammas={})
+        if second_order:
+            sensitivities['gammas'][(self.enterprise_val, self.enterprise_val)] = zeros(enterprise_val.shape)
+        return sensitivities
+
+    def summary(self, val):
+        return 'Stake in "%s": Val = %.3g' % (self.security_label, val)
+
+
+def asset_vals(assets, **kwargs):
+    # values of Securities & Stakes, evaluating each Capital Structure's waterfall once for all Stakes in it
+    vals = [None] * len(assets)
+    capital_structure_stake_indices = OrderedDict()
+    for i, asset in enumerate(assets):
+        if isinstance(asset, Stake):
+            capital_structure_stake_indices.setdefault(asset.capital_structure_key(), []).append(i)
+        else:
+            vals[i] = asset.vals(**kwargs)
+    for stake_indices in capital_structure_stake_indices.values():
+        capital_structure_vals = assets[stake_indices[0]].capital_structure_vals(**kwargs)
+        for i in stake_indices:
+            vals[i] = capital_structure_vals[assets[i].security_label]
+    return vals
+
+
 class Portfolio:
     def __init__(self, label, *n_assets):
         self.label = label
@@ -18,28 +145,149 @@ class Portfolio:
             [n_asset(n=x[0], asset=x[1]) if isinstance(x, (list, tuple))
              else n_asset(n=1, asset=x)
              for x in n_assets]
+        self._flattened = None
+
+    def structure_token(self, memo=None):
+        # identifies the whole tree's assets & quantities, so that the flattened tree is re-derived iff they change;
+        # memo: tokens of the sub-Portfolios already visited, so that shared sub-Portfolios are visited once
+        if memo is None:
+            memo = {}
+        if id(self) not in memo:
+            memo[id(self)] = \
+                tuple((n, id(asset), asset.structure_token(memo)) if isinstance(asset, Portfolio)
+                      else ((n, id(asset)) if isinstance(asset, Security)
+                            else ((n, asset.key()) if isinstance(asset, Stake) else (n, asset)))
+                      for n, asset in self.c)
+        return memo[id(self)]
+
+    def flat_holdings(self, memo):
+        # id(Security) or Stake key -> [Security or Stake, aggregate quantity], and aggregate other assets
+        if id(self) not in memo:
+            holdings = OrderedDict()
+            constant = 0.
+            for n, asset in self.c:
+                if isinstance(asset, Portfolio):
+                    asset_holdings, asset_constant = asset.flat_holdings(memo)
+                    for security_id, (security, quantity) in asset_holdings.items():
+                        if security_id in holdings:
+                            holdings[security_id][1] += n * quantity
+                        else:
+                            holdings[security_id] = [security, n * quantity]
+                    constant += n * asset_constant
+                elif isinstance(asset, (Security, Stake)):
+                    asset_key = asset.key() if isinstance(asset, Stake) else id(asset)
+                    if asset_key in holdings:
+                        holdings[asset_key][1] += n
+                    else:
+                        holdings[asset_key] = [asset, n]
+                else:
+                    constant += n * asset
+            memo[id(self)] = holdings, constant
+        return memo[id(self)]
+
+    def flatten(self):
+        # unique Securities & Stakes, their aggregate quantities (multiplied down the tree) & aggregate other assets,
+        # cached until the tree changes; Stakes are re-resolved against their Capital Structures whenever valued
+        structure_token = self.structure_token()
+        if (self._flattened is None) or (self._flattened[0] != structure_token):
+            METRICS.increment('portfolio_flatten_cache_misses')
+            holdings, constant = self.flat_holdings({})
+            self._flattened = \
+                structure_token, \
+                [security for security, quantity in holdings.values()], \
+                array([quantity for security, quantity in holdings.values()], dtype=float), \
+                constant
+        else:
+            METRICS.increment('portfolio_flatten_cache_hits')
+        return self._flattened[1:]
+
+    def contribution_vals(self, **kwargs):
+        # unique Securities' & Stakes' contributions to the Portfolio's value, i.e. aggregate quantities x values,
+        # as an array of shape Securities x broadcast shape of keyword inputs, which may be arrays (e.g. of scenarios);
+        # every Security's compiled function, and every Capital Structure's waterfall, is evaluated once for all
+        # scenarios
+        securities, quantities, constant = self.flatten()
+        shape = broadcast(*([array(v) for v in kwargs.values()] + [array(0.)])).shape
+        security_vals = \
+            array([broadcast_to(v, shape) for v in asset_vals(securities, **kwargs)]).reshape(
+                (len(securities),) + shape)
+        return dict(
+            securities=securities,
+            contribution_vals=quantities.reshape((-1,) + len(shape) * (1,)) * security_vals,
+            constant=constant)
 
     def val(self, **kwargs):
-        return reduce(lambda x, y: x + y, map(lambda x: x.n * val(x.asset, **kwargs), self.c))
+        # keyword inputs may be arrays (e.g. of scenarios), broadcasting together, giving an array of values
+        METRICS.increment('portfolio_val_calls')
+        contribution_vals = self.contribution_vals(**kwargs)
+        return contribution_vals['contribution_vals'].sum(axis=0) + contribution_vals['constant']
+
+    def sensitivities(self, second_order=True, **kwargs):
+        # val, first derivatives (deltas) & second derivatives (gammas) w.r.t. every input of the unique Securities' &
+        # Stakes' vals, as their quantity-weighted sums; keyword inputs may be arrays (e.g. of scenarios),
+        # broadcasting together
+        securities, quantities, constant = self.flatten()
+        shape = broadcast(*([array(v) for v in kwargs.values()] + [array(0.)])).shape
+        portfolio_sensitivities = dict(val=constant, deltas={}, gammas={})
+        for security, quantity in zip(securities, quantities):
+            security_sensitivities = security.sensitivities(second_order=second_order, **kwargs)
+            portfolio_sensitivities['val'] = portfolio_sensitivities['val'] + quantity * security_sensitivities['val']
+            for order in 'deltas', 'gammas':
+                for sensitivity_key, sensitivity_vals in security_sensitivities[order].items():
+                    portfolio_sensitivities[order][sensitivity_key] = \
+                        portfolio_sensitivities[order].get(sensitivity_key, 0.) + quantity * sensitivity_vals
+        return dict(
+            val=broadcast_to(portfolio_sensitivities['val'], shape),
+            deltas={sensitivity_key: broadcast_to(sensitivity_vals, shape)
+                    for sensitivity_key, sensitivity_vals in portfolio_sensitivities['deltas'].items()},
+            gammas={sensitivity_key: broadcast_to(sensitivity_vals, shape)
+                    for sensitivity_key, sensitivity_vals in portfolio_sensitivities['gammas'].items()})
 
     def __call__(self, **kwargs):
-        df = DataFrame(columns=['n', 'asset', 'val'])
-        df.loc[''] = ['', 'TOTAL', 0.]
+        # every unique Security's value & Claim Value are evaluated once, however many rows or sub-Portfolios it
+        # appears in, and every Capital Structure's waterfall once for all Stakes in it
+        securities, quantities, constant = self.flatten()
+        security_vals = \
+            {(security.key() if isinstance(security, Stake) else id(security)): float(v)
+             for security, v in zip(securities, asset_vals(securities, **kwargs))}
+
+        def security_val(security):
+            return security_vals[security.key() if isinstance(security, Stake) else id(security)]
+
+        claim_vals = {}   # id(Security) -> Claim Value, likewise evaluated once per unique Security
+
+        def claim_val(security):
+            if id(security) not in claim_vals:
+                claim_vals[id(security)] = security.claim_val(**kwargs)
+            return claim_vals[id(security)]
 
-        for i in range(len(self.c)):
-            n, asset = self.c[i]
-            v = val(asset, **kwargs)
+        ns = []
+        asset_strs = []
+        vals = []
+        for n, asset in self.c:
             if isinstance(asset, Portfolio):
+                securities, quantities, constant = asset.flatten()
+                v = array([security_val(security) for security in securities], dtype=float).dot(quantities) + constant
                 if asset.label:
                     s = ' "%s"' % asset.label
                 else:
                     s = ''
                 asset_str = 'Portfolio' + s + ': Val = %.3g' % v
             elif isinstance(asset, Security):
-                asset_str = asset(**kwargs)
+                v = security_val(asset)
+                asset_str = asset.summary(claim_val(asset), v)
+            elif isinstance(asset, Stake):
+                v = security_val(asset)
+                asset_str = asset.summary(v)
             else:
+                v = asset
                 asset_str = str(asset)
-            df.loc[i] = [n, asset_str, n * v]
+            ns.append(n)
+            asset_strs.append(asset_str)
+            vals.append(n * v)
 
-        df.loc['', 'val'] = df.val.sum()
-        return df
+        from pandas import DataFrame
+        return DataFrame(
+            dict(n=[''] + ns, asset=['TOTAL'] + asset_strs, val=[sum(vals, 0.)] + vals),
+            index=[''] + list(range(len(self.c))),
+            columns=['n', 'asset', 'val'])
@@ -0,0 +1,110 @@
+from __future__ import absolute_import, division, print_function
+import json
+import os
+from numpy import arange, dtype as numpy_dtype, load
+from numpy.lib.format import open_memmap
+
+
+MANIFEST_FILE_NAME = 'manifest.json'
+
+
+class ResultStore:   # directory of memory-mapped .npy result columns, one row per scenario / path, & a JSON manifest
+    def __init__(self, path, mode='r'):
+        # open an existing store: mode 'r' to read, or 'r+' to write rows, e.g. by a worker filling its own slice;
+        # columns are memory-mapped on first access, so opening a store loads nothing
+        self.path = path
+        self.mode = mode
+        with open(os.path.join(path, MANIFEST_FILE_NAME)) as f:
+            manifest = json.load(f)
+        self.nb_rows = manifest['nb_rows']
+        self.column_names = [column['name'] for column in manifest['columns']]
+        self.column_infos = {column['name']: column for column in manifest['columns']}
+        self.attrs = manifest.get('attrs', {})
+        self.arrays = {}
+
+    @classmethod
+    def create(cls, path, nb_rows, columns, dtype='float64', attrs=None):
+        # columns: names of 1-dimensional columns, or (name, labels) pairs for 2-dimensional ones, e.g.
+        # ('ownership_vals', owners), with one column of the 2nd dimension per label;
+        # files are allocated sparse, i.e. unwritten rows take no disk space & read as zeros
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        column_infos = []
+        for i, column in enumerate(columns):
+            name, labels = column if isinstance(column, tuple) else (column, None)
+            shape = (nb_rows,) if labels is None else (nb_rows, len(labels))
+            file_name = '%i.npy' % i   # not named after columns, which may hold any characters
+            open_memmap(os.path.join(path, file_name), mode='w+', dtype=numpy_dtype(dtype), shape=shape).flush()
+            column_infos.append(dict(
+                name=name, file=file_name, dtype=numpy_dtype(dtype).str, shape=shape,
+                labels=None if labels is None else [str(label) for label in labels]))
+        # written whole, then renamed into place, so that readers never see a partial manifest
+        temp_manifest_path = os.path.join(path, MANIFEST_FILE_NAME + '.tmp')
+        with open(temp_manifest_path, 'w') as f:
+            json.dump(dict(nb_rows=nb_rows, columns=column_infos, attrs=attrs or {}), f, indent=1)
+        os.rename(temp_manifest_path, os.path.join(path, MANIFEST_FILE_NAME))
+        return cls(path, mode='r+')
+
+    def __contains__(self, name):
+        return name in self.column_infos
+
+    def __iter__(self):
+        return iter(self.column_names)
+
+    def __len__(self):
+        return self.nb_rows
+
+    def __getitem__(self, name):
+        # memory-mapped column: slicing it reads only the sliced rows from disk
+        if name not in self.arrays:
+            self.arrays[name] = load(os.path.join(self.path, self.column_infos[name]['file']), mmap_mode=self.mode)
+        return self.arrays[name]
+
+    def labels(self, name):
+        return self.column_infos[name]['labels']
+
+    def write(self, start, columns):
+        # write rows [start, start + number of rows) of the given columns, a dict or DataFrame of name -> rows;
+        # concurrent writers, e.g. worker processes each opening the store with mode 'r+', may write disjoint rows
+        for name in columns:
+            if name in self.column_infos:
+                rows = columns[name]
+                rows = getattr(rows, 'values', rows)
+                self[name][start:(start + len(rows))] = rows
+
+    def flush(self):
+        for array in self.arrays.values():
+            if hasattr(array, 'flush'):
+                array.flush()
+
+    def close(self):
+        self.flush()
+        self.arrays = {}
+
+    def __getstate__(self):
+        # pickled, e.g. to worker processes, without memory maps, which each process re-opens
+        state = self.__dict__.copy()
+        state['arrays'] = {}
+        return state
+
+    def data_frame(self, columns=None, rows=slice(None)):
+        # load the given rows of the given columns (by default all) into memory, 2-dimensional columns being expanded
+        # into one DataFrame column per label, e.g. "ownership_vals___Founder"
+        from pandas import DataFrame
+        if columns is None:
+            columns = self.column_names
+        data = {}
+        data_frame_columns = []
+        for name in columns:
+            array = self[name][rows]
+            labels = self.labels(name)
+            if labels is None:
+                data[name] = array
+                data_frame_columns.append(name)
+            else:
+                for j, label in enumerate(labels):
+                    column_name = '%s___%s' % (name, label)
+                    data[column_name] = array[:, j]
+                    data_frame_columns.append(column_name)
+        index = range(*rows.indices(self.nb_rows)) if isinstance(rows, slice) else arange(self.nb_rows)[rows]
+        return DataFrame(data, index=index, columns=data_frame_columns)
@@ -1,4 +1,6 @@
-from HelpyFuncs.SymPy import sympy_theanify
+from numpy import array
+from sympy import Expr, Piecewise
+from .Compilation import CompiledExprs, theanify
 
 
 class Security:
@@ -6,17 +8,70 @@ class Security:
         self.label = label
 
         self.claim_val_expr = claim_val
-        self.claim_val = sympy_theanify(claim_val)
+        self.claim_val = theanify(claim_val)
 
         self.val_expr = val
-        self.val = sympy_theanify(val)
+        self.val = theanify(val)
 
-    def __call__(self, **kwargs):
+        self._sensitivity_functions = {}
+
+    def vals(self, **kwargs):
+        # vectorized val: keyword inputs may be arrays (e.g. of scenarios), broadcasting together
+        if isinstance(self.val, CompiledExprs):
+            return self.val.vals(**kwargs)
+        else:
+            return array(self.val(**kwargs), dtype=float)
+
+    def sensitivity_function(self, second_order=True):
+        # one compiled function of val & its exact derivatives w.r.t. every free Symbol of val_expr, in the order
+        # of sensitivity_keys, re-derived whenever val_expr is replaced (e.g. by a Capital Structure's waterfall)
+        val_expr, sensitivity_keys, compiled_exprs = self._sensitivity_functions.get(second_order, (None, None, None))
+        if val_expr is not self.val_expr:
+            # Min / Max, which have no derivatives Theano can compile, rewritten as Piecewise ones
+            expr = self.val_expr.rewrite(Piecewise)
+            symbols = sorted(expr.free_symbols, key=lambda symbol: symbol.name)
+            sensitivity_keys = [None] + [symbol.name for symbol in symbols]
+            exprs = [expr] + [expr.diff(symbol) for symbol in symbols]
+            if second_order:
+                for i, symbol in enumerate(symbols):
+                    for another_symbol in symbols[i:]:
+                        sensitivity_keys.append((symbol.name, another_symbol.name))
+                        exprs.append(exprs[1 + i].diff(another_symbol))
+            compiled_exprs = CompiledExprs(*exprs)
+            self._sensitivity_functions[second_order] = self.val_expr, sensitivity_keys, compiled_exprs
+        return sensitivity_keys, compiled_exprs
+
+    def sensitivities(self, second_order=True, **kwargs):
+        # val, first derivatives (deltas) & second derivatives (gammas, keyed by both orders of pairs of Symbol names)
+        # w.r.t. every input of val, all from one call of one compiled function;
+        # keyword inputs may be arrays (e.g. of scenarios), broadcasting together
+        sensitivities = dict(val=None, deltas={}, gammas={})
+        if isinstance(self.val_expr, Expr):
+            sensitivity_keys, compiled_exprs = self.sensitivity_function(second_order=second_order)
+            vals = compiled_exprs.vals(**kwargs)
+            if len(sensitivity_keys) == 1:   # val_expr without free Symbols, hence derivatives: val only
+                vals = [vals]
+            for sensitivity_key, sensitivity_vals in zip(sensitivity_keys, vals):
+                if sensitivity_key is None:
+                    sensitivities['val'] = sensitivity_vals
+                elif isinstance(sensitivity_key, tuple):
+                    sensitivities['gammas'][sensitivity_key] = sensitivities['gammas'][sensitivity_key[::-1]] = \
+                        sensitivity_vals
+                else:
+                    sensitivities['deltas'][sensitivity_key] = sensitivity_vals
+        else:
+            sensitivities['val'] = array(self.val_expr, dtype=float)
+        return sensitivities
+
+    def summary(self, claim_val, val):
         if self.label:
             s = ' "%s"' % self.label
         else:
             s = ''
-        return 'Security' + s + ': Claim Val = %.3g, Val = %.3g' % (self.claim_val(**kwargs), self.val(**kwargs))
+        return 'Security' + s + ': Claim Val = %.3g, Val = %.3g' % (claim_val, val)
+
+    def __call__(self, **kwargs):
+        return self.summary(self.claim_val(**kwargs), self.val(**kwargs))
 
 
 DOLLAR = Security(label='$', claim_val=1., val=1.)
@@ -0,0 +1,453 @@
+from __future__ import absolute_import, division, print_function
+import json
+import pickle
+import sys
+from argparse import ArgumentParser
+from collections import OrderedDict
+from importlib import import_module
+from multiprocessing import Pool, cpu_count
+from threading import BoundedSemaphore, Event, Lock, Thread
+from timeit import default_timer
+from traceback import format_exc
+from numpy import array, broadcast_to, generic, ndarray
+from .Capital import CapitalStructure
+from .Instrumentation import METRICS, MetricsRegistry
+from .Portfolio import Portfolio, Stake
+from .Security import Security
+from .Valuation import ValModel
+
+try:
+    from collections.abc import Mapping
+except ImportError:   # Python 2
+    from collections import Mapping
+
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from Queue import Empty, Full, Queue
+    from SocketServer import ThreadingMixIn
+except ImportError:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from queue import Empty, Full, Queue
+    from socketserver import ThreadingMixIn
+
+
+# error of requests pending when their service is closed
+SERVICE_CLOSED = 'service closed'
+
+
+# models warm in this process: model name -> ValModel, Capital Structure, Portfolio, Security or other callable
+WORKER_MODELS = {}
+
+
+def model_factory(model_factory_or_spec):
+    # a function building a model, or its "package.module:function" spec, e.g. for worker processes to import
+    if callable(model_factory_or_spec):
+        return model_factory_or_spec
+    module_name, function_name = model_factory_or_spec.split(':')
+    return getattr(import_module(module_name), function_name)
+
+
+def init_worker(model_factories):
+    # build (& hence compile) every model once per process, ahead of requests
+    for model_name, model_factory_or_spec in model_factories.items():
+        WORKER_MODELS[model_name] = model_factory(model_factory_or_spec)()
+
+
+def json_ready(obj):
+    if isinstance(obj, Mapping):
+        return {str(k): json_ready(v) for k, v in obj.items()}
+    elif isinstance(obj, (list, tuple)):
+        return [json_ready(item) for item in obj]
+    elif isinstance(obj, ndarray):
+        return json_ready(obj.tolist())
+    elif isinstance(obj, generic):
+        return obj.item()
+    else:
+        return obj
+
+
+def evaluate(model, kwargs):
+    if isinstance(model, ValModel):
+        results = model(**kwargs)
+        results.pop('data_frame', None)
+        return json_ready(results)
+    elif isinstance(model, CapitalStructure):
+        val_results = model.val(**kwargs)
+        if val_results is None:
+            return None
+        return json_ready(dict(
+            conversion_scenario=val_results['conversion_scenario'],
+            security_vals=val_results['security_vals'],
+            ownership_vals=val_results['ownership_vals']))
+    elif isinstance(model, (Portfolio, Security, Stake)):
+        return json_ready(model.val(**kwargs))
+    else:
+        return json_ready(model(**kwargs))
+
+
+def batch_key(model, kwargs):
+    # requests with equal keys are evaluated together, with their scenario inputs stacked into arrays;
+    # None for requests to evaluate on their own
+    if isinstance(model, CapitalStructure):
+        # stack Enterprise Values, sharing one breakpoint table per combination of other inputs
+        if 'enterprise_val' not in kwargs:
+            return None
+        key = tuple(sorted((k, v) for k, v in kwargs.items() if k != 'enterprise_val'))
+    elif isinstance(model, (Portfolio, Security, Stake)):
+        # stack every input
+        key = tuple(sorted(kwargs))
+    elif isinstance(model, ValModel):
+        # stack inputs as rows of one scenario table, whose missing values take defaults, per selection of Outputs
+        if ('append_to_results_data_frame' in kwargs) or ('scenarios' in kwargs):
+            return None
+        outputs = kwargs.get('outputs')
+        key = 'outputs', (tuple(outputs) if isinstance(outputs, list) else outputs)
+    else:
+        return None
+    try:
+        hash(key)
+    except TypeError:
+        return None
+    return key
+
+
+def evaluate_group(model, kwargs_list):
+    # one vectorized evaluation of requests sharing a batch key
+    if isinstance(model, CapitalStructure):
+        kwargs = dict(kwargs_list[0])
+        kwargs.pop('enterprise_val')
+        pareto_equil_conversions = kwargs.pop('pareto_equil_conversions', False)
+        conversion_breakpoints = \
+            model.conversion_breakpoints(pareto_equil_conversions=pareto_equil_conversions, **kwargs)
+        val_results = conversion_breakpoints([request_kwargs['enterprise_val'] for request_kwargs in kwargs_list])
+        return [None if val_results['conversion_scenario_indices'][i] < 0
+                else json_ready(dict(
+                    conversion_scenario=conversion_breakpoints.conversion_scenarios[
+                        val_results['conversion_scenario_indices'][i]],
+                    security_vals={security_label: security_vals[i]
+                                   for security_label, security_vals in val_results['security_vals'].items()},
+                    ownership_vals={owner: ownership_vals[i]
+                                    for owner, ownership_vals in val_results['ownership_vals'].items()}))
+                for i in range(len(kwargs_list))]
+    elif isinstance(model, ValModel):
+        from pandas import DataFrame
+        outputs = kwargs_list[0].get('outputs')
+        if outputs:
+            outputs = [output for output in outputs if output in model.output_attrs]
+            if not outputs:
+                return len(kwargs_list) * [{}]
+        scenarios = DataFrame([model.scenario_inputs(**request_kwargs) for request_kwargs in kwargs_list], dtype=float)
+        return json_ready(model.scenario_results(model.scenario_vals(scenarios, outputs=outputs), outputs=outputs))
+    else:
+        vals = model.val(**{k: array([request_kwargs[k] for request_kwargs in kwargs_list], dtype=float)
+                            for k in kwargs_list[0]})
+        return json_ready(broadcast_to(vals, (len(kwargs_list),)))
+
+
+def evaluate_batch(model_name, kwargs_list):
+    # (error message or None, result) per request; never raises, so that every request gets its answer
+    try:
+        model = WORKER_MODELS[model_name]
+    except KeyError:
+        return len(kwargs_list) * [('model "%s" not loaded' % model_name, None)]
+    results = [None] * len(kwargs_list)
+    groups = OrderedDict()
+    for i, kwargs in enumerate(kwargs_list):
+        try:
+            key = batch_key(model, kwargs)
+        except Exception:
+            key = None
+        groups.setdefault((i,) if key is None else key, []).append(i)
+    for indices in groups.values():
+        if len(indices) > 1:
+            try:
+                for i, result in zip(indices, evaluate_group(model, [kwargs_list[i] for i in indices])):
+                    results[i] = None, result
+                continue
+            except Exception:
+                # e.g. Claim Values depending on Enterprise Value: fall back to one request at a time
+                pass
+        for i in indices:
+            try:
+                results[i] = None, evaluate(model, kwargs_list[i])
+            except Exception:
+                results[i] = format_exc().strip().split('\n')[-1], None
+    return results
+
+
+def evaluate_pickled_batch(model_name, kwargs_list):
+    # evaluate_batch's results, pickled in the worker process, where results failing to pickle become their requests'
+    # errors, so that every batch comes back, even through Python 2's pools, which have no error callbacks
+    results = evaluate_batch(model_name, kwargs_list)
+    try:
+        return pickle.dumps(results, pickle.HIGHEST_PROTOCOL)
+    except Exception:
+        pass
+    for i, result in enumerate(results):
+        try:
+            pickle.dumps(result, pickle.HIGHEST_PROTOCOL)
+        except Exception:
+            results[i] = format_exc().strip().split('\n')[-1], None
+    return pickle.dumps(results, pickle.HIGHEST_PROTOCOL)
+
+
+class PendingRequest:   # a request's inputs & eventual result, set by the dispatcher thread
+    def __init__(self, kwargs):
+        self.kwargs = kwargs
+        self.error = self.result = None
+        self.done = Event()
+        self.tic = default_timer()
+
+    def fail(self, error):
+        self.error = error
+        self.done.set()
+
+
+class ValuationService:   # warm models, micro-batched requests, process-pool evaluation & backpressure
+    def __init__(self, model_factories, nb_processes=None, max_batch_size=64, max_batch_delay=.002,
+                 max_queue_size=1024, max_nb_batches_in_flight=None, request_timeout=60.):
+        # model_factories: dict model name -> function building the model, or its "package.module:function" spec;
+        # nb_processes: size of the process pool (by default the number of CPUs), or 0 to evaluate in this process;
+        # requests are queued per model, and coalesced into batches of up to max_batch_size requests, arriving
+        # within max_batch_delay seconds of each batch's first one;
+        # requests beyond max_queue_size queued ones per model are rejected rather than queued without bound
+        self.model_names = sorted(model_factories)
+        self.max_batch_size = max_batch_size
+        self.max_batch_delay = max_batch_delay
+        self.request_timeout = request_timeout
+        self.metrics = MetricsRegistry(prefix='corpfin_service')
+
+        if nb_processes == 0:
+            init_worker(model_factories)
+            self.pool = None
+            max_nb_batches_in_flight = 1
+        else:
+            if nb_processes is None:
+                nb_processes = cpu_count()
+            self.pool = Pool(nb_processes, initializer=init_worker, initargs=(model_factories,))
+            if max_nb_batches_in_flight is None:
+                max_nb_batches_in_flight = 2 * nb_processes
+        self.batches_in_flight = BoundedSemaphore(max_nb_batches_in_flight)
+
+        self.closing = Event()
+        self.lock = Lock()
+        # batches dispatched & not yet completed: token -> (batch, function completing it), for close to fail them
+        self.in_flight = {}
+        self.queues = {model_name: Queue(maxsize=max_queue_size) for model_name in self.model_names}
+        self.dispatchers = []
+        for model_name in self.model_names:
+            dispatcher = Thread(target=self.dispatch, args=(model_name,), name='dispatcher-%s' % model_name)
+            dispatcher.daemon = True
+            dispatcher.start()
+            self.dispatchers.append(dispatcher)
+
+    def submit(self, model_name, kwargs):
+        # raises KeyError for unknown models, and Queue.Full when the model's queue is full
+        queue = self.queues[model_name]
+        pending_request = PendingRequest(kwargs)
+        with self.lock:
+            if self.closing.is_set():
+                pending_request.fail(SERVICE_CLOSED)
+                return pending_request
+            try:
+                queue.put_nowait(pending_request)
+            except Full:
+                self.metrics.increment('rejected_requests', model=model_name)
+                raise
+        return pending_request
+
+    def val(self, model_name, **kwargs):
+        pending_request = self.submit(model_name, kwargs)
+        if not pending_request.done.wait(self.request_timeout):
+            raise RuntimeError('request timed out after %ss' % self.request_timeout)
+        if pending_request.error is not None:
+            raise ValueError(pending_request.error)
+        return pending_request.result
+
+    def dispatch(self, model_name):
+        queue = self.queues[model_name]
+        while True:
+            batch = [queue.get()]
+            if batch[0] is None:
+                return
+            deadline = default_timer() + self.max_batch_delay
+            while len(batch) < self.max_batch_size:
+                remaining_time = deadline - default_timer()
+                if remaining_time <= 0:
+                    break
+                try:
+                    pending_request = queue.get(timeout=remaining_time)
+                except Empty:
+                    break
+                if pending_request is None:   # closing: this batch is the last
+                    break
+                batch.append(pending_request)
+
+            self.batches_in_flight.acquire()
+            tic = default_timer()
+            token = object()
+
+            def complete(results, batch=batch, tic=tic, token=token):
+                with self.lock:
+                    if self.in_flight.pop(token, None) is None:   # already failed by close
+                        return
+                toc = default_timer()
+                self.batches_in_flight.release()
+                self.metrics.observe('batch', toc - tic, model=model_name)
+                for pending_request, (error, result) in zip(batch, results):
+                    pending_request.error = error
+                    pending_request.result = result
+                    self.metrics.observe('request', toc - pending_request.tic, model=model_name)
+                    if error is not None:
+                        self.metrics.increment('failed_requests', model=model_name)
+                    pending_request.done.set()
+
+            def complete_pickled(pickled_results, complete=complete):
+                complete(pickle.loads(pickled_results))
+
+            def fail(exception, batch=batch, complete=complete):
+                # evaluate_pickled_batch itself never raises, but e.g. its inputs may fail to reach the worker
+                complete(len(batch) * [('%s: %s' % (type(exception).__name__, exception), None)])
+
+            with self.lock:
+                closed = self.closing.is_set()
+                if not closed:
+                    self.in_flight[token] = batch, complete
+            if closed:
+                self.batches_in_flight.release()
+                for pending_request in batch:
+                    pending_request.fail(SERVICE_CLOSED)
+                return
+
+            self.metrics.increment('batches', model=model_name)
+            self.metrics.increment('batched_requests', len(batch), model=model_name)
+            kwargs_list = [pending_request.kwargs for pending_request in batch]
+            try:
+                if self.pool is None:
+                    complete(evaluate_batch(model_name, kwargs_list))
+                elif sys.version_info[0] >= 3:
+                    self.pool.apply_async(
+                        evaluate_pickled_batch, (model_name, kwargs_list),
+                        callback=complete_pickled, error_callback=fail)
+                else:   # Python 2's pools have no error callbacks
+                    self.pool.apply_async(evaluate_pickled_batch, (model_name, kwargs_list), callback=complete_pickled)
+            except Exception as exception:   # e.g. the pool terminated by close meanwhile
+                fail(exception)
+
+    def prometheus_text(self):
+        # service metrics, and this process's CorpFin metrics (worker processes keep their own)
+        return self.metrics.prometheus_text() + METRICS.prometheus_text()
+
+    def close(self):
+        # never blocks: pending requests, queued or in flight, fail with SERVICE_CLOSED, dispatchers waiting for
+        # requests are woken by None, & busy ones stop after their batch
+        with self.lock:
+            self.closing.set()
+            batches_in_flight = list(self.in_flight.values())
+        for batch, complete in batches_in_flight:
+            complete(len(batch) * [(SERVICE_CLOSED, None)])
+        for queue in self.queues.values():
+            while True:
+                try:
+                    pending_request = queue.get_nowait()
+                except Empty:
+                    break
+                if pending_request is not None:
+                    pending_request.fail(SERVICE_CLOSED)
+            queue.put_nowait(None)
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+
+
+class ValuationRequestHandler(BaseHTTPRequestHandler):
+    # GET /health; GET /metrics (Prometheus text); POST /models/<model name> with a JSON object of inputs
+
+    def send(self, code, body, content_type='application/json', headers=()):
+        body = body.encode('utf-8') if not isinstance(body, bytes) else body
+        self.send_response(code)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for header in headers:
+            self.send_header(*header)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        service = self.server.service
+        if self.path == '/health':
+            self.send(200, json.dumps(dict(models=service.model_names)))
+        elif self.path == '/metrics':
+            self.send(200, service.prometheus_text(), content_type='text/plain; version=0.0.4')
+        else:
+            self.send(404, json.dumps(dict(error='not found')))
+
+    def do_POST(self):
+        service = self.server.service
+        prefix = '/models/'
+        if not self.path.startswith(prefix):
+            self.send(404, json.dumps(dict(error='not found')))
+            return
+        model_name = self.path[len(prefix):]
+        try:
+            kwargs = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))).decode('utf-8') or '{}')
+            kwargs = {str(k): v for k, v in kwargs.items()}
+        except Exception:
+            self.send(400, json.dumps(dict(error='request body must be a JSON object of inputs')))
+            return
+        try:
+            pending_request = service.submit(model_name, kwargs)
+        except KeyError:
+            self.send(404, json.dumps(dict(error='unknown model "%s"' % model_name)))
+            return
+        except Full:
+            self.send(503, json.dumps(dict(error='overloaded')), headers=[('Retry-After', '1')])
+            return
+        if not pending_request.done.wait(service.request_timeout):
+            self.send(504, json.dumps(dict(error='timed out')))
+        elif pending_request.error is not None:
+            self.send(422, json.dumps(dict(error=pending_request.error)))
+        else:
+            self.send(200, json.dumps(dict(result=pending_request.result)))
+
+    def log_message(self, format, *args):   # silent, like the rest of the package; see metrics instead
+        pass
+
+
+class ValuationHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, service, host='127.0.0.1', port=8000):
+        HTTPServer.__init__(self, (host, port), ValuationRequestHandler)
+        self.service = service
+
+
+def main(args=None):
+    # e.g.: python -m CorpFin.Service --port 8000 my_cap_table=my_package.my_models:build_cap_table
+    arg_parser = ArgumentParser(description='CorpFin local valuation service')
+    arg_parser.add_argument('models', nargs='+', help='model_name=package.module:function building the model')
+    arg_parser.add_argument('--host', default='127.0.0.1')
+    arg_parser.add_argument('--port', type=int, default=8000)
+    arg_parser.add_argument('--processes', type=int, default=None, help='0 to evaluate in the server process')
+    arg_parser.add_argument('--max-batch-size', type=int, default=64)
+    arg_parser.add_argument('--max-batch-delay', type=float, default=.002)
+    arg_parser.add_argument('--max-queue-size', type=int, default=1024)
+    args = arg_parser.parse_args(args)
+
+    service = \
+        ValuationService(
+            dict(model.split('=', 1) for model in args.models),
+            nb_processes=args.processes,
+            max_batch_size=args.max_batch_size,
+            max_batch_delay=args.max_batch_delay,
+            max_queue_size=args.max_queue_size)
+    server = ValuationHTTPServer(service, host=args.host, port=args.port)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        service.close()
+
+
+if __name__ == '__main__':
+    main()
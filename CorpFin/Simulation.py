@@ -0,0 +1,117 @@
+from __future__ import absolute_import, division, print_function
+from numpy import argpartition, array, broadcast_to, column_stack, concatenate, empty, percentile, sqrt, zeros
+from numpy.random import RandomState
+
+
+class StreamingMoments:   # running means & variances of columns, merged chunk by chunk (Chan et al.)
+    def __init__(self, nb_columns):
+        self.n = 0
+        self.means = zeros(nb_columns)
+        self.m2s = zeros(nb_columns)
+
+    def update(self, chunk):
+        n = len(chunk)
+        if n:
+            chunk_means = chunk.mean(axis=0)
+            chunk_m2s = ((chunk - chunk_means) ** 2).sum(axis=0)
+            deltas = chunk_means - self.means
+            total_n = self.n + n
+            self.means = self.means + deltas * n / total_n
+            self.m2s = self.m2s + chunk_m2s + deltas ** 2 * self.n * n / total_n
+            self.n = total_n
+
+    def stds(self):
+        if self.n > 1:
+            return sqrt(self.m2s / (self.n - 1))
+        else:
+            return zeros(len(self.means))
+
+
+class PathReservoir:   # fixed-size uniform random sample of the rows streamed through it
+    def __init__(self, size=10 ** 5, random_state=None):
+        self.size = size
+        self.random_state = random_state if isinstance(random_state, RandomState) else RandomState(random_state)
+        self.keys = empty(0)
+        self.rows = None
+
+    def update(self, rows):
+        keys = concatenate([self.keys, self.random_state.uniform(size=len(rows))])
+        if self.rows is not None:
+            rows = concatenate([self.rows, rows])
+        if len(keys) > self.size:
+            kept = argpartition(keys, self.size)[:self.size]
+            keys = keys[kept]
+            rows = rows[kept]
+        self.keys = keys
+        self.rows = rows
+
+
+class ExitSimulation:   # streaming per-unit Security & per-Owner payoff distributions of a Capital Structure at exit
+    def __init__(self, capital_structure, quantiles=(.05, .25, .5, .75, .95), reservoir_size=10 ** 5,
+                 random_state=None, **kwargs):
+        self.conversion_breakpoints = capital_structure.conversion_breakpoints(**kwargs)
+        self.security_val_intercepts, self.security_val_slopes = \
+            capital_structure.as_converted_security_val_coefs(self.conversion_breakpoints)
+        self.quantiles = quantiles
+        self.security_val_moments = StreamingMoments(len(self.conversion_breakpoints.security_labels))
+        self.ownership_val_moments = StreamingMoments(len(self.conversion_breakpoints.owners))
+        # keep only sampled (Enterprise Value, Discount Factor) paths, from which payoffs are cheap to re-derive,
+        # so that memory does not grow with the numbers of paths or of Owners
+        self.reservoir = PathReservoir(size=reservoir_size, random_state=random_state)
+
+    def payoffs(self, enterprise_vals, discount_factors, intercepts, slopes):
+        i = self.conversion_breakpoints.intervals(enterprise_vals)
+        return (intercepts[i] + slopes[i] * enterprise_vals[:, None]) * discount_factors[:, None]
+
+    def update(self, enterprise_vals, discount_factors=1.):
+        # returns the chunk's paths, e.g. for a ResultStore
+        enterprise_vals = array(enterprise_vals, dtype=float).ravel()
+        discount_factors = broadcast_to(array(discount_factors, dtype=float), enterprise_vals.shape)
+        security_vals = \
+            self.payoffs(enterprise_vals, discount_factors, self.security_val_intercepts, self.security_val_slopes)
+        self.security_val_moments.update(security_vals)
+        ownership_vals = \
+            self.payoffs(enterprise_vals, discount_factors,
+                         self.conversion_breakpoints.ownership_val_intercepts,
+                         self.conversion_breakpoints.ownership_val_slopes)
+        self.ownership_val_moments.update(ownership_vals)
+        self.reservoir.update(column_stack([enterprise_vals, discount_factors]))
+        return dict(enterprise_vals=enterprise_vals, discount_factors=discount_factors,
+                    security_vals=security_vals, ownership_vals=ownership_vals)
+
+    def result_store_columns(self):
+        # columns of paths, for ResultStore.create
+        return ['enterprise_vals', 'discount_factors',
+                ('security_vals', self.conversion_breakpoints.security_labels),
+                ('ownership_vals', self.conversion_breakpoints.owners)]
+
+    def summary(self, max_block_size=10 ** 7):
+        from pandas import DataFrame
+
+        def distribution(labels, moments, intercepts, slopes):
+            df = DataFrame(index=labels)
+            df['Mean'] = moments.means
+            df['StdDev'] = moments.stds()
+            if (self.reservoir.rows is not None) and len(labels):
+                enterprise_vals, discount_factors = self.reservoir.rows.T
+                block_size = max(max_block_size // len(enterprise_vals), 1)
+                quantiles = \
+                    concatenate(
+                        [percentile(self.payoffs(enterprise_vals, discount_factors,
+                                                 intercepts[:, j:(j + block_size)], slopes[:, j:(j + block_size)]),
+                                    100 * array(self.quantiles), axis=0).reshape((len(self.quantiles), -1))
+                         for j in range(0, len(labels), block_size)],
+                        axis=1)
+                for k, q in enumerate(self.quantiles):
+                    df[q] = quantiles[k]
+            return df
+
+        return dict(
+            nb_paths=self.security_val_moments.n,
+            security_vals=distribution(
+                self.conversion_breakpoints.security_labels, self.security_val_moments,
+                self.security_val_intercepts, self.security_val_slopes),
+            ownership_vals=distribution(
+                self.conversion_breakpoints.owners, self.ownership_val_moments,
+                self.conversion_breakpoints.ownership_val_intercepts,
+                self.conversion_breakpoints.ownership_val_slopes))
@@ -1,10 +1,12 @@
 from __future__ import absolute_import, division, print_function
-from datetime import datetime
-from numpy import nan, isnan
-from pandas import DataFrame
+from numpy import \
+    arange, asarray, broadcast, broadcast_to, divide, einsum, empty, exp, full, log1p, multiply, nan, isnan, subtract, \
+    where
 from sympy import Eq, Expr, Max, Min, Piecewise, Symbol, symbols
-from sympy.printing.theanocode import theano_function
-from HelpyFuncs.SymPy import sympy_eval_by_theano
+from .Caching import canonical_hash
+from .Compilation import CompiledExprs, theanify
+from .ExprGraphs import graph_stats_data_frame
+from .Instrumentation import METRICS
 
 
 def terminal_value(
@@ -27,8 +29,68 @@ def net_present_value(
          for i in range(len(cash_flows))])
 
 
+# NumPy counterparts of the above, for numerical pipelines over arrays of scenarios, writing into out if given
+
+def period_times(nb_periods=1, mid_year=False, stub_period=1.):
+    # times in years of the cash flows of periods 0, 1, ..., nb_periods - 1, period 0 being at time 0:
+    # - stub_period: length in years of period 1, e.g. .5 when valuing mid-way through a fiscal year,
+    #   subsequent periods lasting 1 year;
+    # - mid_year: cash flows at the middle rather than the end of periods 1, 2, ...
+    times = arange(nb_periods, dtype=float) + (stub_period - 1.)
+    if nb_periods:
+        times[0] = 0.
+    if mid_year and (nb_periods > 1):
+        times[1] = stub_period / 2
+        times[2:] -= .5
+    return times
+
+
+def discount_factors(discount_rates=0., nb_periods=1, mid_year=False, stub_period=1., out=None):
+    # 1 / (1 + r) ** t per discount rate r (of any shape) & period time t, i.e. of shape rates' shape x nb_periods;
+    # computed once, e.g. to be passed to net_present_values for many cash-flow matrices
+    discount_rates = asarray(discount_rates, dtype=float)
+    return exp(multiply.outer(-log1p(discount_rates), period_times(nb_periods, mid_year, stub_period)), out=out)
+
+
+def net_present_values(cash_flows, discount_rates=0., mid_year=False, stub_period=1.,
+                       precomputed_discount_factors=None, out=None):
+    # NPVs of cash flows, e.g. a Scenarios x Periods matrix, at discount rates of shape broadcasting with all but the
+    # last dimension of cash_flows; discount factors are computed once per rate, unless given precomputed
+    cash_flows = asarray(cash_flows, dtype=float)
+    if precomputed_discount_factors is None:
+        precomputed_discount_factors = \
+            discount_factors(discount_rates, cash_flows.shape[-1], mid_year=mid_year, stub_period=stub_period)
+    if out is None:   # some NumPy versions' einsum rejects out=None
+        return einsum('...i,...i->...', cash_flows, precomputed_discount_factors)
+    else:
+        return einsum('...i,...i->...', cash_flows, precomputed_discount_factors, out=out)
+
+
+def present_values(amounts, discount_rates=0., nb_periods=0., out=None):
+    amounts, discount_rates, nb_periods = \
+        asarray(amounts, dtype=float), asarray(discount_rates, dtype=float), asarray(nb_periods, dtype=float)
+    if out is None:
+        out = empty(broadcast(amounts, discount_rates, nb_periods).shape)
+    # computed in place in out, without temporaries of its size
+    log1p(discount_rates, out=out)
+    multiply(out, -nb_periods, out=out)
+    exp(out, out=out)
+    return multiply(amounts, out, out=out)
+
+
+def terminal_values(terminal_cash_flows, long_term_discount_rates=.01, long_term_growth_rates=0., out=None):
+    terminal_cash_flows, long_term_discount_rates, long_term_growth_rates = \
+        asarray(terminal_cash_flows, dtype=float), asarray(long_term_discount_rates, dtype=float), \
+        asarray(long_term_growth_rates, dtype=float)
+    if out is None:
+        out = empty(broadcast(terminal_cash_flows, long_term_discount_rates, long_term_growth_rates).shape)
+    subtract(long_term_discount_rates, long_term_growth_rates, out=out)
+    divide(1. + long_term_growth_rates, out, out=out)
+    return multiply(terminal_cash_flows, out, out=out)
+
+
 class ValModel:   # base class for UnlevValModel & LevValModel below
-    def __init__(self, venture_name='', year_0=0, nb_pro_forma_years_excl_0=1, compile=True):
+    def __init__(self, venture_name='', year_0=0, nb_pro_forma_years_excl_0=1, compile=True, variable_horizon=False):
 
         # set Venture Name and corresponding variable prefixes
         self.venture_name = venture_name
@@ -45,10 +107,27 @@ class ValModel:   # base class for UnlevValModel & LevValModel below
         self.index_range = range(self.nb_pro_forma_years_incl_0)
         self.index_range_from_1 = range(1, self.nb_pro_forma_years_incl_0)
 
+        # with variable_horizon, the model is a maximum-horizon template, shortened by a "Horizon" Input: the number of
+        # pro forma years excl. 0, at most nb_pro_forma_years_excl_0, 0 meaning the maximum; years beyond the Horizon
+        # are masked, and Terminal Values are taken at the Horizon, so that any shorter horizon needs no recompiling
+        self.variable_horizon = variable_horizon
+        if variable_horizon:
+            self.Horizon___input = Symbol(self.venture_name_prefix + 'Horizon')
+            self.horizon = \
+                Piecewise(
+                    (nb_pro_forma_years_excl_0,
+                     Eq(self.Horizon___input, 0.)),
+                    (self.Horizon___input,
+                     True))
+        else:
+            self.horizon = nb_pro_forma_years_excl_0
+
         # list all Input & Output attributes & symbols, and set model structure
         self.input_attrs = []
         self.output_attrs = []
         self.set_model_structure()
+        if variable_horizon:
+            self.input_attrs.append('Horizon')
 
         # gather all Input symbols and set their default values
         self.input_symbols = []
@@ -68,43 +147,235 @@ class ValModel:   # base class for UnlevValModel & LevValModel below
                 self.input_symbols.append(a)
                 self.input_defaults[a.name] = 0.
 
-        # compile Outputs if so required
+        # opt-in ResultCache of __call__ results, keyed by this model's token & a hash of the inputs
+        self.result_cache = None
+        self.model_token = object()
+
+        # keep Outputs' expressions, e.g. for graph_stats & scenario_vals, before they are compiled away;
+        # vectorized compilations for scenario_vals are made on first use
+        self.output_exprs = {output: getattr(self, output) for output in self.output_attrs}
+        self.vectorized_outputs = {}
+
+        # compile Outputs if so required, through the compile cache, whose functions are keyed by expression structure
+        # regardless of Input names, and hence shared by models rebased to other years
         self.compile = compile
         if compile:
+            model = type(self).__name__
+            with METRICS.timer('valmodel_compile', model=model):
+                for output in self.output_attrs:
+                    a = getattr(self, output)
+                    with METRICS.timer('valmodel_output_compile', model=model, output=output):
+                        if isinstance(a, (list, tuple)):
+                            if (not isinstance(a[0], Expr)) and isnan(a[0]):
+                                setattr(
+                                    self, output,
+                                    [nan] + [self.compile_expr(a[i]) for i in self.index_range_from_1])
+                            else:
+                                setattr(
+                                    self, output,
+                                    [self.compile_expr(a[i]) for i in self.index_range])
+                        else:
+                            setattr(self, output, self.compile_expr(a))
+
+    @staticmethod
+    def compile_expr(expr):
+        compiled_expr = theanify(expr)
+        if isinstance(compiled_expr, CompiledExprs):
+            compiled_expr.compile()
+        return compiled_expr
 
-            def format_time_delta(time_delta):
-                time_delta_str = str(time_delta)
-                return time_delta_str[:time_delta_str.index('.')]
+    def set_model_structure(self):
+        pass
 
-            print('Compiling:')
-            tic_0 = datetime.now()
-            for output in self.output_attrs:
-                print('    %s... ' % output, end='')
-                a = getattr(self, output)
-                tic = datetime.now()
+    def at_horizon(self, exprs):
+        # a per-year expression's value in the Horizon year
+        if self.variable_horizon:
+            return Piecewise(
+                *([(exprs[i], Eq(self.Horizon___input, i)) for i in self.index_range_from_1[:-1]] +
+                  [(exprs[-1], True)]))
+        else:
+            return exprs[-1]
+
+    def by_horizon(self, i, at_horizon_expr, before_horizon_expr):
+        # year i's expression: at_horizon_expr in the Horizon year, before_horizon_expr before it
+        if i == self.nb_pro_forma_years_excl_0:
+            return at_horizon_expr
+        elif self.variable_horizon and i:
+            return Piecewise(
+                (at_horizon_expr,
+                 Eq(self.Horizon___input, i)),
+                (before_horizon_expr,
+                 True))
+        else:
+            return before_horizon_expr
+
+    def within_horizon(self, i, expr):
+        # year i's expression, 0 beyond the Horizon, which is at least 1
+        if self.variable_horizon and (i > 1):
+            return Piecewise(
+                (expr,
+                 self.horizon >= i),
+                (0.,
+                 True))
+        else:
+            return expr
+
+    def horizon_val(self, inputs):
+        # number of pro forma years excl. 0 of a call's inputs
+        if self.variable_horizon:
+            horizon = inputs[self.Horizon___input.name]
+            if horizon not in range(self.nb_pro_forma_years_incl_0):
+                raise ValueError('Horizon must be a whole number of years from 0 (i.e. maximum) to %i'
+                                 % self.nb_pro_forma_years_excl_0)
+            return int(horizon) or self.nb_pro_forma_years_excl_0
+        else:
+            return self.nb_pro_forma_years_excl_0
+
+    def graph_stats(self):
+        # expression-graph sizes of every Output & year, e.g. for check_graph_stats
+        return graph_stats_data_frame(
+            self.output_exprs,
+            item_labels={output: [self.year_0 + i for i in self.index_range] for output in self.output_attrs})
+
+    def scenario_input_columns(self, scenarios):
+        # columns of a scenario table (pandas DataFrame, or Arrow Table) named after Input symbols, as float arrays
+        # (views of float64 columns, not copies); missing columns, and missing values within columns, take defaults
+        if hasattr(scenarios, 'to_pandas'):
+            scenarios = scenarios.to_pandas()
+        columns = {}
+        for input_symbol in self.input_symbols:
+            name = input_symbol.name
+            default = self.input_defaults[name]
+            if name in scenarios:
+                column = asarray(scenarios[name].values, dtype=float)
+                nan_rows = isnan(column)
+                columns[name] = where(nan_rows, default, column) if nan_rows.any() else column
+            else:
+                columns[name] = default
+        return scenarios.index, columns
+
+    def scenario_result_items(self, output):
+        # (result name, year index, expression or number) of an Output: one per year, e.g. "EBIT___2021", unless a
+        # scalar Output, whose year index is None
+        a = self.output_exprs[output]
+        if isinstance(a, (list, tuple)):
+            return [('%s___%d' % (output, self.year_0 + i), i, a[i])
+                    for i in self.index_range if isinstance(a[i], Expr) or not isnan(a[i])]
+        else:
+            return [(output, None, a)]
+
+    def scenario_result_names(self, outputs=None):
+        # columns of scenario_vals' results, e.g. for ResultStore.create
+        return [result_name
+                for output in (outputs or self.output_attrs)
+                for result_name, _, _ in self.scenario_result_items(output)]
+
+    def scenario_vals(self, scenarios, outputs=None, result_store=None, start=0):
+        # Outputs of all scenarios of a table with one row per scenario & one column per Input symbol, e.g.
+        # "Revenue___2021" or "CorpTaxRate", evaluated in one vectorized call per Output;
+        # results table: same rows, one column per scalar Output, and per year of others, e.g. "EBIT___2021";
+        # or, if a ResultStore is given, results written into its rows from start on, e.g. by one of many workers
+        # each evaluating its own chunk of a sweep too large for memory;
+        # with variable_horizon, each scenario's years beyond its Horizon are masked
+        from pandas import DataFrame
+        if not outputs:
+            outputs = self.output_attrs
+        index, columns = self.scenario_input_columns(scenarios)
+        nb_scenarios = len(index)
+        if self.variable_horizon:
+            horizons = columns[self.Horizon___input.name]
+            horizons = where(horizons == 0, self.nb_pro_forma_years_excl_0, horizons)
+        result_names = []
+        result_columns = {}
+        for output in outputs:
+            items = self.scenario_result_items(output)
+            exprs = [x for _, _, x in items if isinstance(x, Expr)]
+            if exprs:
+                if output not in self.vectorized_outputs:
+                    with METRICS.timer('valmodel_output_compile', model=type(self).__name__, output=output,
+                                       vectorized=True):
+                        self.vectorized_outputs[output] = CompiledExprs(*exprs).compile(vectorized=True)
+                compiled_output = self.vectorized_outputs[output]
+                vals = compiled_output.vals(
+                    **{symbol_name: columns[symbol_name] for symbol_name in compiled_output.symbol_names})
+                if len(exprs) == 1:
+                    vals = [vals]
+            else:
+                vals = []
+            vals = iter(vals)
+            for result_name, i, x in items:
+                if isinstance(x, Expr):
+                    result_columns[result_name] = broadcast_to(next(vals), (nb_scenarios,))
+                else:
+                    result_columns[result_name] = full(nb_scenarios, float(x))
+                if self.variable_horizon and i:
+                    result_columns[result_name] = where(horizons < i, nan, result_columns[result_name])
+                result_names.append(result_name)
+            if result_store is not None:
+                # written Output by Output, so that only one Output's results are in memory at a time
+                result_store.write(start, result_columns)
+                result_columns = {}
+        if result_store is not None:
+            return result_store
+        return DataFrame(result_columns, index=index, columns=result_names)
+
+    def scenario_inputs(self, **kwargs):
+        # a scenario table row of __call__'s inputs, e.g. Revenue=[...] & CorpTaxRate=.2: Input symbol name -> value,
+        # NaN standing for the default
+        inputs = {}
+        for k, v in kwargs.items():
+            attr = '%s___input' % k
+            if hasattr(self, attr):
+                a = getattr(self, attr)
                 if isinstance(a, (list, tuple)):
-                    if (not isinstance(a[0], Expr)) and isnan(a[0]):
-                        setattr(
-                            self, output,
-                            [nan] + [theano_function(self.input_symbols, [a[i]]) for i in self.index_range_from_1])
-                    else:
-                        setattr(
-                            self, output,
-                            [theano_function(self.input_symbols, [a[i]]) for i in self.index_range])
+                    for i in range(len(v)):
+                        if isinstance(a[i], Symbol):
+                            inputs[a[i].name] = v[i]
                 else:
-                    setattr(self, output, theano_function(self.input_symbols, [a]))
-                toc = datetime.now()
-                print('done after %s (%s so far)' % (format_time_delta(toc - tic), format_time_delta(toc - tic_0)))
-            print('done after %s' % format_time_delta(toc - tic_0))
-
-    def set_model_structure(self):
-        pass
+                    inputs[a.name] = v
+        return inputs
+
+    def scenario_results(self, results, outputs=None):
+        # __call__'s results, without data frames, of each row of a scenario_vals results table:
+        # Output -> value, or list of values per year, NaN for years without results
+        outputs = [output for output in (outputs or self.output_attrs) if output in self.output_attrs]
+        result_columns = {result_name: results[result_name].values for result_name in results.columns}
+        rows = [{} for _ in range(len(results))]
+        for output in outputs:
+            if isinstance(self.output_exprs[output], (list, tuple)):
+                year_columns = [result_columns.get('%s___%d' % (output, self.year_0 + i)) for i in self.index_range]
+                for j, row in enumerate(rows):
+                    row[output] = [nan if column is None else float(column[j]) for column in year_columns]
+            else:
+                for j, row in enumerate(rows):
+                    row[output] = float(result_columns[output][j])
+        return rows
 
-    def __call__(self, outputs=None, append_to_results_data_frame=None, **kwargs):
+    def __call__(self, outputs=None, append_to_results_data_frame=None, scenarios=None, **kwargs):
 
         if not outputs:
             outputs = self.output_attrs
 
+        if scenarios is not None:
+            return self.scenario_vals(scenarios, outputs=outputs)
+
+        if (self.result_cache is not None) and (append_to_results_data_frame is None):
+            digest = canonical_hash((outputs, kwargs))
+            if digest is not None:
+                key = self.model_token, digest
+                results = self.result_cache.get(key)
+                if results is None:
+                    results = self.calc_results(outputs=outputs, **kwargs)
+                    self.result_cache.put(key, results)
+                return {output: (result.copy() if output == 'data_frame' else
+                                 list(result) if isinstance(result, list) else result)
+                        for output, result in results.items()}
+
+        return self.calc_results(outputs=outputs, append_to_results_data_frame=append_to_results_data_frame, **kwargs)
+
+    def calc_results(self, outputs, append_to_results_data_frame=None, **kwargs):
+        from pandas import DataFrame
+
         inputs = self.input_defaults.copy()
         for k, v in kwargs.items():
             attr = '%s___input' % k
@@ -125,25 +396,32 @@ class ValModel:   # base class for UnlevValModel & LevValModel below
             elif (not isinstance(x, Expr)) and isnan(x):
                 return nan
             else:
+                from HelpyFuncs.SymPy import sympy_eval_by_theano   # imports Theano, hence deferred to uncompiled use
                 return float(sympy_eval_by_theano(sympy_expr=x, symbols=self.input_symbols, **inputs))
 
+        horizon = self.horizon_val(inputs)
+        horizon_year = self.year_0 + horizon
+
         results = {}
         if isinstance(append_to_results_data_frame, DataFrame):
             df = append_to_results_data_frame
         else:
             df = DataFrame(index=['Year 0'] + range(self.year_0 + 1, self.final_pro_forma_year + 1))
-        print('Calculating:')
+        model = type(self).__name__
+        METRICS.increment('valmodel_calls', model=model)
         for output in outputs:
             if output in self.output_attrs:
-                print('    %s' % output)
-                result = calc(getattr(self, output))
+                with METRICS.timer('valmodel_output_eval', model=model, output=output):
+                    result = calc(getattr(self, output))
+                if isinstance(result, list) and (horizon < self.nb_pro_forma_years_excl_0):
+                    result = result[:(horizon + 1)] + (self.nb_pro_forma_years_excl_0 - horizon) * [nan]
                 results[output] = result
                 if isinstance(result, (list, tuple)):
                     df[output] = result
                 else:
                     df[output] = ''
                     if output in ('StabilizedDiscountRate', 'TV', 'TV_RevenueMultiple', 'TV_EBITMultiple', 'ITS_TV'):
-                        df.loc[self.final_pro_forma_year, output] = result
+                        df.loc[horizon_year, output] = result
                     else:
                         df.loc['Year 0', output] = result
             else:
@@ -154,24 +432,39 @@ class ValModel:   # base class for UnlevValModel & LevValModel below
                         df.ix[range(len(v)), output] = v
                     elif output in \
                             ('StabilizedBeta', 'StabilizedDiscountRate', 'LongTermGrowthRate', 'TV_RevenueMultiple'):
-                        df.loc[self.final_pro_forma_year, output] = v
+                        df.loc[horizon_year, output] = v
                     else:
                         df.loc['Year 0', output] = v
-        print('done!')
         results['data_frame'] = df
 
         return results
 
 
 class UnlevValModel(ValModel):
-    def __init__(self, venture_name='', year_0=0, nb_pro_forma_years_excl_0=1, val_all_years=False, compile=True):
+    def __init__(self, venture_name='', year_0=0, nb_pro_forma_years_excl_0=1, val_all_years=False, compile=True,
+                 variable_horizon=False):
         self.val_all_years = val_all_years
         ValModel.__init__(
             self,
             venture_name=venture_name,
             year_0=year_0,
             nb_pro_forma_years_excl_0=nb_pro_forma_years_excl_0,
-            compile=compile)
+            compile=compile,
+            variable_horizon=variable_horizon)
+
+    def rebase(self, year_0):
+        # the same model for another Year 0, e.g. rolled forward a year: its expressions differ from this model's only
+        # in their Input names, so its compiled functions come from the compile cache rather than being recompiled
+        unlev_val_model = \
+            type(self)(
+                venture_name=self.venture_name,
+                year_0=year_0,
+                nb_pro_forma_years_excl_0=self.nb_pro_forma_years_excl_0,
+                val_all_years=self.val_all_years,
+                compile=self.compile,
+                variable_horizon=self.variable_horizon)
+        unlev_val_model.result_cache = self.result_cache
+        return unlev_val_model
 
     def set_model_structure(self):
 
@@ -594,32 +887,36 @@ class UnlevValModel(ValModel):
                 self.venture_name_prefix +
                 'LongTermGrowthRate')
 
-        # model Terminal Value
+        # model Terminal Value, at the Horizon
         self.TV_RevenueMultiple___input = \
             Symbol(
                 self.venture_name_prefix +
                 'TV_RevenueMultiple')
 
+        horizon_FCF = self.at_horizon(self.FCF)
+        horizon_Revenue = self.at_horizon(self.Revenue)
+        horizon_EBIT = self.at_horizon(self.EBIT)
+
         self.TV = \
             Piecewise(
                 (terminal_value(
-                    terminal_cash_flow=self.FCF[-1],
+                    terminal_cash_flow=horizon_FCF,
                     long_term_discount_rate=self.StabilizedDiscountRate,
                     long_term_growth_rate=self.LongTermGrowthRate___input),
                  Eq(self.TV_RevenueMultiple___input, 0.)),
-                (self.TV_RevenueMultiple___input * self.Revenue[-1],
+                (self.TV_RevenueMultiple___input * horizon_Revenue,
                  True))
 
         self.TV_RevenueMultiple = \
-            self.TV / self.Revenue[-1]
+            self.TV / horizon_Revenue
 
         self.TV_EBITMultiple = \
             Piecewise(
-                (self.TV / self.EBIT[-1], self.EBIT[-1] > 0),
+                (self.TV / horizon_EBIT, horizon_EBIT > 0),
                 (0., True))
 
         # model Unlevered Valuation
-        FCF = [0.] + self.FCF[1:]
+        FCF = [0.] + [self.within_horizon(i, self.FCF[i]) for i in self.index_range_from_1]
 
         if self.val_all_years:
 
@@ -633,7 +930,7 @@ class UnlevValModel(ValModel):
                 [present_value(
                     amount=self.TV,
                     discount_rate=self.ProFormaPeriodDiscountRate,
-                    nb_periods=self.nb_pro_forma_years_excl_0 - i)
+                    nb_periods=self.horizon - i)
                  for i in self.index_range]
 
             self.Unlev_Val = \
@@ -651,7 +948,7 @@ class UnlevValModel(ValModel):
                 present_value(
                     amount=self.TV,
                     discount_rate=self.StabilizedDiscountRate,
-                    nb_periods=self.nb_pro_forma_years_excl_0)
+                    nb_periods=self.horizon)
 
             self.Unlev_Val = self.Val_of_FCF + self.Val_of_TV
 
@@ -699,7 +996,13 @@ class LevValModel(ValModel):
             venture_name=unlev_val_model.venture_name,
             year_0=unlev_val_model.year_0,
             nb_pro_forma_years_excl_0=unlev_val_model.nb_pro_forma_years_excl_0,
-            compile=unlev_val_model.compile)
+            compile=unlev_val_model.compile,
+            variable_horizon=unlev_val_model.variable_horizon)
+
+    def rebase(self, year_0):
+        lev_val_model = type(self)(self.unlev_val_model.rebase(year_0))
+        lev_val_model.result_cache = self.result_cache
+        return lev_val_model
 
     def set_model_structure(self):
 
@@ -745,7 +1048,8 @@ class LevValModel(ValModel):
                  True))
 
         self.DERatios = \
-            self.nb_pro_forma_years_excl_0 * [pro_forma_period_d_e_ratio] + [self.DERatio___input]
+            [self.by_horizon(i, self.DERatio___input, pro_forma_period_d_e_ratio)
+             for i in self.index_range]
 
         # model Debt
         self.Debt___input = \
@@ -783,7 +1087,8 @@ class LevValModel(ValModel):
                  True))
 
         self.InterestRates = \
-            self.nb_pro_forma_years_excl_0 * [pro_forma_period_interest_rate] + [self.InterestRate___input]
+            [self.by_horizon(i, self.InterestRate___input, pro_forma_period_interest_rate)
+             for i in self.index_range]
 
         self.InterestRates___input = \
             symbols(
@@ -854,15 +1159,15 @@ class LevValModel(ValModel):
                 (self.DebtDiscountRate,
                  True))
 
-        # model Terminal Value of Interest Tax Shield
+        # model Terminal Value of Interest Tax Shield, at the Horizon
         self.ITS_TV = \
             terminal_value(
-                terminal_cash_flow=self.ITS[-1],
+                terminal_cash_flow=self.at_horizon(self.ITS),
                 long_term_discount_rate=self.StabilizedITSDiscountRate,
                 long_term_growth_rate=0.)
 
         # model Valuation of Interest Tax Shield, and Levered Valuation
-        ITS = [0.] + self.ITS[1:]
+        ITS = [0.] + [self.within_horizon(i, self.ITS[i]) for i in self.index_range_from_1]
 
         if self.unlev_val_model.val_all_years:
 
@@ -876,7 +1181,7 @@ class LevValModel(ValModel):
                 [present_value(
                     amount=self.ITS_TV,
                     discount_rate=self.StabilizedITSDiscountRate,
-                    nb_periods=self.nb_pro_forma_years_excl_0 - i)
+                    nb_periods=self.horizon - i)
                  for i in self.index_range]
 
             self.Val_of_ITS_incl_TV = \
@@ -898,7 +1203,7 @@ class LevValModel(ValModel):
                 present_value(
                     amount=self.ITS_TV,
                     discount_rate=self.StabilizedITSDiscountRate,
-                    nb_periods=self.nb_pro_forma_years_excl_0)
+                    nb_periods=self.horizon)
 
             self.Val_of_ITS_incl_TV = self.Val_of_ITS + self.Val_of_ITS_TV
 
@@ -0,0 +1,59 @@
+from __future__ import absolute_import, division, print_function
+import sys
+from importlib import import_module
+from types import ModuleType
+
+
+# public API: name -> module defining it, imported only on first access of the name, so that "import CorpFin" is cheap
+# and e.g. CLI jobs & worker processes pay only for the modules they use;
+# SymPy is imported with the modelling modules, pandas on first DataFrame view, and Theano on first compilation;
+# Book, Portfolio & Security, named like their modules, which they would shadow, are not in it: import them with e.g.
+# "from CorpFin.Security import Security"
+PUBLIC_API = dict(
+    LRUCache='Caching',
+    ResultCache='Caching',
+    CapitalStructure='Capital',
+    CapitalHistory='CapitalHistory',
+    METRICS='Instrumentation',
+    MetricsRegistry='Instrumentation',
+    black_scholes_call_val='Options',
+    black_scholes_digital_call_val='Options',
+    Stake='Portfolio',
+    ResultStore='ResultStore',
+    DOLLAR='Security',
+    ValuationService='Service',
+    ValModel='Valuation',
+    UnlevValModel='Valuation',
+    LevValModel='Valuation',
+    net_present_value='Valuation',
+    present_value='Valuation',
+    terminal_value='Valuation')
+
+__all__ = sorted(PUBLIC_API)
+
+# submodules, also imported on first access as attributes of this package, e.g. "CorpFin.Portfolio.val"
+SUBMODULES = \
+    'Book', 'Caching', 'Capital', 'CapitalHistory', 'Compilation', 'ExprGraphs', 'Instrumentation', 'Options', \
+    'Portfolio', 'ResultStore', 'Security', 'Service', 'Simulation', 'Valuation'
+
+
+class LazyModule(ModuleType):   # this package, importing its public API's modules on first attribute access
+    def __getattr__(self, name):
+        if name in PUBLIC_API:
+            value = getattr(import_module('.%s' % PUBLIC_API[name], __name__), name)
+            setattr(self, name, value)
+            return value
+        elif name in SUBMODULES:
+            return import_module('.%s' % name, __name__)   # which the import system sets as this package's attribute
+        raise AttributeError("module '%s' has no attribute '%s'" % (__name__, name))
+
+    def __dir__(self):
+        return sorted(set(self.__dict__) | set(PUBLIC_API) | set(SUBMODULES))
+
+
+# swap this module for a LazyModule with the same contents, keeping the original alive, since Python 2 clears the
+# globals of modules once collected
+_lazy_module = LazyModule(__name__)
+_lazy_module.__dict__.update(sys.modules[__name__].__dict__)
+_lazy_module._original_module = sys.modules[__name__]
+sys.modules[__name__] = _lazy_module
@@ -0,0 +1,80 @@
+from __future__ import absolute_import, division, print_function
+from CorpFin.Capital import CapitalStructure
+from CorpFin.Security import Security
+from .harness import benchmark_factory
+
+
+def capital_structure(nb_holders=10, nb_convertibles=1, nb_holders_per_convertible=2):
+    # Common Share held by nb_holders Owners, under nb_convertibles tiers of Convertible Preferred Shares, each held by
+    # nb_holders_per_convertible Investors, under senior Debt
+    capital_structure = \
+        CapitalStructure(
+            Security('Common'),
+            *([((Security('Pref%d' % i, claim_val=1. + i), 1.),) for i in range(nb_convertibles)] +
+              [Security('Debt', claim_val=1.)]))
+    for i in range(nb_holders):
+        capital_structure.issue('Holder%d' % i, {'Common': 100.})
+    for i in range(nb_convertibles):
+        for j in range(nb_holders_per_convertible):
+            capital_structure.issue('Investor%d_%d' % (i, j), {'Pref%d' % i: 50.})
+    capital_structure.issue('Bank', {'Debt': 100.})
+    return capital_structure
+
+
+def issued(capital_structure):
+    capital_structure = capital_structure.copy()
+    capital_structure.issue('NewHolder', {'Common': 1.})
+    return capital_structure
+
+
+def converted(capital_structure):
+    capital_structure = capital_structure.copy()
+    capital_structure.convert_to_common(owners='Investor0_0', securities='Pref0')
+    return capital_structure
+
+
+def benchmarks(quick=False):
+    nbs_holders = (10, 100) if quick else (10, 100, 1000)
+    # Conversion Scenarios number 2 ^ (convertibles x holders per convertible)
+    nbs_convertibles = (1, 2) if quick else (1, 2, 3)
+
+    for nb_holders in nbs_holders:
+        for nb_convertibles in nbs_convertibles:
+            params = dict(nb_holders=nb_holders, nb_convertibles=nb_convertibles)
+
+            yield benchmark_factory(
+                name='CapitalStructure.build',
+                params=params,
+                run=lambda params=params: capital_structure(**params),
+                nb_repeats=3)
+
+            yield benchmark_factory(
+                name='CapitalStructure.waterfall',
+                params=params,
+                setup=lambda params=params: capital_structure(**params),
+                run=lambda capital_structure: capital_structure.waterfall())
+
+            yield benchmark_factory(
+                name='CapitalStructure.issue',
+                params=params,
+                setup=lambda params=params: capital_structure(**params),
+                run=issued)
+
+            yield benchmark_factory(
+                name='CapitalStructure.convert_to_common',
+                params=params,
+                setup=lambda params=params: capital_structure(**params),
+                run=converted)
+
+            yield benchmark_factory(
+                name='CapitalStructure.val',
+                params=params,
+                setup=lambda params=params: capital_structure(**params),
+                run=lambda capital_structure: capital_structure.val(enterprise_val=1000.))
+
+            yield benchmark_factory(
+                name='CapitalStructure.val.pareto_equil_conversions',
+                params=params,
+                setup=lambda params=params: capital_structure(**params),
+                run=lambda capital_structure:
+                    capital_structure.val(pareto_equil_conversions=True, enterprise_val=1000.))
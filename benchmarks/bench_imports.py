@@ -0,0 +1,32 @@
+from __future__ import absolute_import, division, print_function
+import os
+import sys
+from subprocess import check_call
+from .harness import benchmark_factory
+
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# every import, from a fresh interpreter, i.e. as paid by a CLI job or worker process at startup;
+# "pass" measures interpreter startup alone, to subtract from the others
+STATEMENTS = \
+    'pass', \
+    'import CorpFin', \
+    'from CorpFin import CapitalStructure', \
+    'import CorpFin.Capital', \
+    'import CorpFin.Portfolio', \
+    'import CorpFin.Valuation', \
+    'import CorpFin.Service'
+
+
+def run_in_fresh_interpreter(statement):
+    check_call([sys.executable, '-c', statement], cwd=REPO_DIR)
+
+
+def benchmarks(quick=False):
+    for statement in STATEMENTS:
+        yield benchmark_factory(
+            name='import',
+            params=dict(statement=statement),
+            run=lambda statement=statement: run_in_fresh_interpreter(statement),
+            nb_repeats=3 if quick else 5)
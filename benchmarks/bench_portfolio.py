@@ -0,0 +1,51 @@
+from __future__ import absolute_import, division, print_function
+from numpy import linspace
+from sympy import Symbol
+from CorpFin.Portfolio import Portfolio
+from CorpFin.Security import Security
+from .harness import benchmark_factory
+
+
+def portfolio(depth=3, nb_branches=4, nb_securities=100):
+    # tree of sub-Portfolios, nb_branches per level, whose leaves hold Securities from one shared pool
+    x = Symbol('x')
+    securities = [Security('Security%d' % i, val=(1. + i) * x + i) for i in range(nb_securities)]
+    nb_leaves = [0]
+
+    def sub_portfolio(level):
+        if level < depth:
+            return Portfolio('Level%d' % level, *[(2., sub_portfolio(level + 1)) for i in range(nb_branches)])
+        else:
+            nb_leaves[0] += 1
+            return Portfolio(
+                'Leaf%d' % nb_leaves[0],
+                *[(1., securities[(nb_leaves[0] * 7 + i) % nb_securities]) for i in range(nb_branches)])
+
+    return sub_portfolio(1)
+
+
+def benchmarks(quick=False):
+    depths = (2, 4) if quick else (2, 4, 6)
+    nbs_scenarios = (1000,) if quick else (1000, 100000)
+
+    for depth in depths:
+        params = dict(depth=depth)
+
+        yield benchmark_factory(
+            name='Portfolio.val',
+            params=params,
+            setup=lambda params=params: portfolio(**params),
+            run=lambda portfolio: portfolio.val(x=1.))
+
+        yield benchmark_factory(
+            name='Portfolio.__call__',
+            params=params,
+            setup=lambda params=params: portfolio(**params),
+            run=lambda portfolio: portfolio(x=1.))
+
+        for nb_scenarios in nbs_scenarios:
+            yield benchmark_factory(
+                name='Portfolio.val.batch',
+                params=dict(nb_scenarios=nb_scenarios, **params),
+                setup=lambda params=params: portfolio(**params),
+                run=lambda portfolio, nb_scenarios=nb_scenarios: portfolio.val(x=linspace(0., 1., nb_scenarios)))
@@ -0,0 +1,91 @@
+from __future__ import absolute_import, division, print_function
+from numpy.random import RandomState
+from CorpFin.Compilation import COMPILED_FUNCTIONS
+from CorpFin.Valuation import LevValModel, UnlevValModel, net_present_values
+from .harness import benchmark_factory
+
+
+def inputs(nb_pro_forma_years_excl_0, scenario=0):
+    return dict(
+        Revenue=[100. * (1. + .01 * scenario)] + nb_pro_forma_years_excl_0 * [0.],
+        RevenueGrowth=[float('nan')] + nb_pro_forma_years_excl_0 * [.1])
+
+
+def with_cleared_compile_cache(state=None):
+    # for compile benchmarks to time compilation, rather than look-ups of functions compiled by earlier benchmarks
+    COMPILED_FUNCTIONS.clear()
+    return state
+
+
+def unlev_val_model_and_scenarios(params, nb_scenarios):
+    # a model, & a table of the same scenarios as the inputs function's, one row per scenario
+    from pandas import DataFrame
+    unlev_val_model = UnlevValModel(**params)
+    scenarios = \
+        DataFrame(
+            [unlev_val_model.scenario_inputs(**inputs(unlev_val_model.nb_pro_forma_years_excl_0, scenario))
+             for scenario in range(nb_scenarios)],
+            dtype=float)
+    return unlev_val_model, scenarios
+
+
+def benchmarks(quick=False):
+    nbs_pro_forma_years_excl_0 = (1, 2) if quick else (1, 2, 4, 8)
+    nbs_scenarios = (10,) if quick else (10, 100)
+
+    for nb_pro_forma_years_excl_0 in nbs_pro_forma_years_excl_0:
+        for val_all_years in False, True:
+            params = dict(nb_pro_forma_years_excl_0=nb_pro_forma_years_excl_0, val_all_years=val_all_years)
+
+            yield benchmark_factory(
+                name='UnlevValModel.compile',
+                params=params,
+                setup=lambda params=params: with_cleared_compile_cache(params),
+                run=lambda params: UnlevValModel(**params),
+                nb_repeats=1)
+
+            yield benchmark_factory(
+                name='LevValModel.compile',
+                params=params,
+                setup=lambda params=params: with_cleared_compile_cache(UnlevValModel(**params)),
+                run=LevValModel,
+                nb_repeats=1)
+
+            # rolled forward a year: same structure, hence compiled functions from the compile cache
+            yield benchmark_factory(
+                name='UnlevValModel.rebase',
+                params=params,
+                setup=lambda params=params: UnlevValModel(**params),
+                run=lambda unlev_val_model: unlev_val_model.rebase(unlev_val_model.year_0 + 1),
+                nb_repeats=1)
+
+    for nb_pro_forma_years_excl_0 in nbs_pro_forma_years_excl_0[:2]:
+        params = dict(nb_pro_forma_years_excl_0=nb_pro_forma_years_excl_0)
+
+        yield benchmark_factory(
+            name='UnlevValModel.__call__',
+            params=params,
+            setup=lambda params=params: UnlevValModel(**params),
+            run=lambda unlev_val_model: unlev_val_model(**inputs(unlev_val_model.nb_pro_forma_years_excl_0)))
+
+        for nb_scenarios in nbs_scenarios:
+            # all scenarios in one call, through scenario_vals' vectorized compiled functions
+            yield benchmark_factory(
+                name='UnlevValModel.__call__.batch',
+                params=dict(nb_scenarios=nb_scenarios, **params),
+                setup=lambda params=params, nb_scenarios=nb_scenarios:
+                    unlev_val_model_and_scenarios(params, nb_scenarios),
+                run=lambda model_and_scenarios: model_and_scenarios[0](scenarios=model_and_scenarios[1]),
+                nb_repeats=3)
+
+    for nb_scenarios in ((10 ** 4,) if quick else (10 ** 4, 10 ** 6)):
+        params = dict(nb_scenarios=nb_scenarios, nb_periods=10)
+
+        yield benchmark_factory(
+            name='net_present_values',
+            params=params,
+            setup=lambda params=params:
+                (RandomState(0).normal(size=(params['nb_scenarios'], params['nb_periods'])),
+                 RandomState(1).uniform(.05, .2, size=params['nb_scenarios'])),
+            run=lambda cash_flows_and_discount_rates:
+                net_present_values(*cash_flows_and_discount_rates, mid_year=True))
@@ -0,0 +1,63 @@
+from __future__ import absolute_import, division, print_function
+import os
+import platform
+import sys
+from contextlib import contextmanager
+from subprocess import check_output
+from timeit import default_timer
+from namedlist import namedlist
+
+
+# setup: called once, its result passed to every run of run; run without setup takes no arguments
+benchmark_factory = namedlist('Benchmark', ['name', 'params', 'run', ('setup', None), ('nb_repeats', 5)])
+
+
+@contextmanager
+def quiet():   # silence any printing while timing
+    stdout = sys.stdout
+    with open(os.devnull, 'w') as devnull:
+        sys.stdout = devnull
+        try:
+            yield
+        finally:
+            sys.stdout = stdout
+
+
+def measure(benchmark):
+    with quiet():
+        state = benchmark.setup() if benchmark.setup else None
+    timings = []
+    for i in range(benchmark.nb_repeats):
+        with quiet():
+            tic = default_timer()
+            if benchmark.setup:
+                benchmark.run(state)
+            else:
+                benchmark.run()
+            toc = default_timer()
+        timings.append(toc - tic)
+    sorted_timings = sorted(timings)
+    return dict(
+        nb_repeats=benchmark.nb_repeats,
+        first=timings[0],   # cold, e.g. before compiled functions or breakpoint tables are cached
+        min=sorted_timings[0],
+        median=sorted_timings[len(timings) // 2],
+        mean=sum(timings) / len(timings))
+
+
+def environment():
+    d = dict(
+        python=platform.python_version(),
+        platform=platform.platform(),
+        machine=platform.machine())
+    for module_name in 'numpy', 'pandas', 'scipy', 'sympy', 'theano':
+        try:
+            d[module_name] = __import__(module_name).__version__
+        except Exception:
+            d[module_name] = None
+    try:
+        d['git_commit'] = \
+            check_output(['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except Exception:
+        d['git_commit'] = None
+    return d
@@ -0,0 +1,69 @@
+from __future__ import absolute_import, division, print_function
+import json
+import sys
+from argparse import ArgumentParser
+from traceback import format_exc
+from .harness import environment, measure
+from . import bench_capital, bench_imports, bench_portfolio, bench_valuation
+
+
+BENCHMARK_MODULES = bench_imports, bench_valuation, bench_capital, bench_portfolio
+
+
+def benchmark_key(result):
+    return result['name'], json.dumps(result['params'], sort_keys=True)
+
+
+def run(quick=False, name_filter=None):
+    results = []
+    for benchmark_module in BENCHMARK_MODULES:
+        for benchmark in benchmark_module.benchmarks(quick=quick):
+            if name_filter and (name_filter not in benchmark.name):
+                continue
+            result = dict(name=benchmark.name, params=benchmark.params)
+            try:
+                result['timings'] = measure(benchmark)
+            except Exception:
+                # record the failure, e.g. of a dependency version, and carry on with the rest of the suite
+                result['error'] = format_exc().strip().split('\n')[-1]
+            print('%-50s %-55s %s' % (
+                benchmark.name, json.dumps(benchmark.params, sort_keys=True),
+                '%.6fs' % result['timings']['median'] if 'timings' in result else 'ERROR: ' + result['error']),
+                file=sys.stderr)
+            results.append(result)
+    return dict(environment=environment(), quick=quick, results=results)
+
+
+def compare(results, baseline_results):
+    # ratios of median timings to those of a baseline run, for the benchmarks both runs completed
+    baseline_timings = {benchmark_key(result): result['timings']
+                        for result in baseline_results['results'] if 'timings' in result}
+    for result in results['results']:
+        key = benchmark_key(result)
+        if ('timings' in result) and (key in baseline_timings):
+            print('%-50s %-55s x%.2f' % (key + (result['timings']['median'] / baseline_timings[key]['median'],)))
+
+
+def main(args=None):
+    arg_parser = ArgumentParser(description='CorpFin benchmarks')
+    arg_parser.add_argument('--quick', action='store_true', help='smaller problem sizes')
+    arg_parser.add_argument('--filter', default=None, help='run only benchmarks whose names contain this')
+    arg_parser.add_argument('--output', default=None, help='JSON file to write results to (default: stdout)')
+    arg_parser.add_argument('--compare', default=None, help='JSON results of a baseline run to compare against')
+    args = arg_parser.parse_args(args)
+
+    results = run(quick=args.quick, name_filter=args.filter)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    else:
+        print(json.dumps(results, indent=2, sort_keys=True))
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+from __future__ import absolute_import, division, print_function
+import unittest
+from numpy import allclose, array, isnan, nan
+from CorpFin.Book import Book
+from CorpFin.Capital import CapitalStructure
+from CorpFin.Security import Security
+from test_capital import convertible_preferred_capital_structure
+
+
+def book():
+    # companies of 4, 2 & 1 Securities, with Owners in common
+    leveraged = CapitalStructure(Security('Common'), Security('Debt', claim_val=500.))
+    leveraged.issue('Founder0', {'Common': 300.})
+    leveraged.issue('Bank', {'Debt': 1.})
+    unleveraged = CapitalStructure(Security('Common'))
+    unleveraged.issue('Founder1', {'Common': 50.})
+    unleveraged.issue('InvestorB', {'Common': 150.})
+    return Book([('Convertible', convertible_preferred_capital_structure()),
+                 ('Leveraged', leveraged),
+                 ('Unleveraged', unleveraged)])
+
+
+class TestBook(unittest.TestCase):
+    enterprise_vals = array([[500., 2750., 8000., 20000.], [100., 400., 900., 5000.], [0., 10., 1000., 3000.]])
+
+    def test_val_matches_capital_structures(self):
+        b = book()
+        val_results = b.val(self.enterprise_vals, pareto_equil_conversions=True)
+        self.assertEqual(
+            val_results['ownership_vals'].shape, self.enterprise_vals.shape + (len(val_results['owners']),))
+        for k, company in enumerate(b):
+            for e, enterprise_val in enumerate(self.enterprise_vals[k]):
+                company_val_results = b[company].val(pareto_equil_conversions=True, enterprise_val=enterprise_val)
+                self.assertEqual(set(val_results['security_vals'][company]), set(company_val_results['security_vals']))
+                for security_label, security_val in company_val_results['security_vals'].items():
+                    self.assertAlmostEqual(val_results['security_vals'][company][security_label][e], security_val)
+                for j, owner in enumerate(val_results['owners']):
+                    self.assertAlmostEqual(
+                        val_results['ownership_vals'][k, e, j], company_val_results['ownership_vals'].get(owner, 0.))
+
+    def test_totals(self):
+        b = book()
+        enterprise_vals = self.enterprise_vals[:, 2]
+        df = b(enterprise_vals, pareto_equil_conversions=True)
+        self.assertEqual(list(df.index), ['Convertible', 'Leveraged', 'Unleveraged', 'TOTAL'])
+        self.assertTrue(allclose(df.loc['TOTAL'].values[:-1], df.values[:-1, :-1].sum(axis=0)))
+        self.assertTrue(allclose(df['Val'].values, list(enterprise_vals) + [enterprise_vals.sum()]))
+
+    def test_totals_propagate_missing_equilibrium(self):
+        # a company without Pareto-equilibrium Conversion Scenario at its Enterprise Value, as its table records it
+        b = book()
+        conversion_breakpoints = b['Leveraged'].conversion_breakpoints(pareto_equil_conversions=True)
+        conversion_breakpoints.ownership_val_intercepts[:] = nan
+        conversion_breakpoints.ownership_val_slopes[:] = nan
+        df = b(self.enterprise_vals[:, 2], pareto_equil_conversions=True)
+        self.assertTrue(isnan(df.loc['Leveraged', 'Val']))
+        self.assertTrue(isnan(df.loc['TOTAL', 'Val']))
+        self.assertTrue(isnan(df.loc['TOTAL', 'Founder0']))
+        self.assertFalse(isnan(df.loc['TOTAL', 'Founder1']))
+
+
+if __name__ == '__main__':
+    unittest.main()
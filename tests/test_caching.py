@@ -0,0 +1,101 @@
+from __future__ import absolute_import, division, print_function
+import unittest
+from collections import OrderedDict
+from numpy import arange, array, nan
+from CorpFin.Caching import LRUCache, ResultCache, canonical_hash
+from test_capital import convertible_preferred_capital_structure
+from test_package import run_in_fresh_interpreter
+
+
+MUTATIONS = dict(
+    issue=lambda capital_structure: capital_structure.issue('Founder2', {'Common': 500.}),
+    transfer=lambda capital_structure: capital_structure.transfer('Founder0', 'Founder2', {'Common': 100.}),
+    redeem=lambda capital_structure: capital_structure.redeem(owners='InvestorA1', securities='PrefA'),
+    convert=lambda capital_structure: capital_structure.convert_to_common(owners='InvestorB', securities='PrefB'))
+
+
+class TestCapitalStructureResultCache(unittest.TestCase):
+    def test_miss_after_mutation(self):
+        for mutation_name, mutate in sorted(MUTATIONS.items()):
+            capital_structure = convertible_preferred_capital_structure()
+            capital_structure.result_cache = result_cache = ResultCache()
+            val_results = capital_structure.val(enterprise_val=3000.)
+            self.assertEqual(capital_structure.val(enterprise_val=3000.)['ownership_vals'],
+                             val_results['ownership_vals'])
+            self.assertEqual((result_cache.nb_hits, result_cache.nb_misses), (1, 1))
+
+            # copies share results until either side is modified
+            capital_structure_copy = capital_structure.copy()
+            capital_structure_copy.val(enterprise_val=3000.)
+            self.assertEqual((result_cache.nb_hits, result_cache.nb_misses), (2, 1))
+
+            mutate(capital_structure)
+            reference_capital_structure = convertible_preferred_capital_structure()
+            mutate(reference_capital_structure)
+            reference_val_results = reference_capital_structure.val(enterprise_val=3000.)
+            mutated_val_results = capital_structure.val(enterprise_val=3000.)
+            self.assertEqual((result_cache.nb_hits, result_cache.nb_misses), (2, 2), mutation_name)
+            for owner, ownership_val in reference_val_results['ownership_vals'].items():
+                self.assertAlmostEqual(mutated_val_results['ownership_vals'][owner], ownership_val)
+
+            # the unmodified copy still hits the original's results
+            self.assertEqual(capital_structure_copy.val(enterprise_val=3000.)['ownership_vals'],
+                             val_results['ownership_vals'])
+            self.assertEqual((result_cache.nb_hits, result_cache.nb_misses), (3, 2), mutation_name)
+
+
+class TestLRUCache(unittest.TestCase):
+    def test_eviction_order(self):
+        cache = LRUCache(max_size=3)
+        for key in 'abc':
+            cache.put(key, key.upper())
+        self.assertEqual(cache.get('a'), 'A')   # b becomes the least recently used
+        cache.put('d', 'D')
+        self.assertEqual(list(cache.items), ['c', 'a', 'd'])
+        cache.put('c', 'C2')   # re-put items become the most recently used
+        cache.put('e', 'E')
+        self.assertEqual(list(cache.items), ['d', 'c', 'e'])
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('c'), 'C2')
+        self.assertEqual((cache.nb_hits, cache.nb_misses, cache.nb_evictions), (2, 1, 2))
+
+    def test_result_cache_memory_bound(self):
+        cache = ResultCache(max_size=10, max_nb_bytes=100)
+        for key in 'abc':
+            cache.put(key, key, nb_bytes=40)
+        self.assertEqual(list(cache.items), ['b', 'c'])
+        self.assertEqual(cache.nb_bytes, 80)
+        cache.put('d', 'd', nb_bytes=101)   # larger than the whole cache: not cached, nothing evicted
+        self.assertEqual(list(cache.items), ['b', 'c'])
+        cache.get('b')
+        cache.put('e', 'e', nb_bytes=30)
+        self.assertEqual(list(cache.items), ['b', 'e'])
+        self.assertEqual(cache.nb_bytes, 70)
+
+
+class TestCanonicalHash(unittest.TestCase):
+    def test_equal_inputs(self):
+        self.assertEqual(
+            canonical_hash(dict(a=1, b=[2., nan])), canonical_hash(OrderedDict([('b', (2, nan)), ('a', 1.)])))
+        self.assertEqual(canonical_hash({'x', 'y'}), canonical_hash(frozenset(['y', 'x'])))
+        self.assertEqual(canonical_hash(dict(v=arange(4.))), canonical_hash(dict(v=array([0., 1., 2., 3.]))))
+
+    def test_unequal_inputs(self):
+        self.assertNotEqual(canonical_hash(dict(a=1)), canonical_hash(dict(a=2)))
+        self.assertNotEqual(canonical_hash(dict(a=nan)), canonical_hash(dict(a='nan')))
+        self.assertNotEqual(canonical_hash(arange(4.)), canonical_hash(arange(4.).reshape((2, 2))))
+        self.assertNotEqual(canonical_hash(arange(4.)), canonical_hash(arange(4)))
+
+    def test_no_canonical_form(self):
+        self.assertIsNone(canonical_hash(dict(a=object())))
+
+    def test_stable_across_processes(self):
+        # e.g. for results cached by other processes, whose string hashes, and hence set orders, may differ
+        inputs = 'dict(a=1, b=[2., float("nan")], c={"x", "y", "z"}, d=dict(e=None, f=True))'
+        self.assertEqual(
+            run_in_fresh_interpreter('from CorpFin.Caching import canonical_hash\nprint(canonical_hash(%s))' % inputs),
+            canonical_hash(eval(inputs)))
+
+
+if __name__ == '__main__':
+    unittest.main()
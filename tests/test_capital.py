@@ -0,0 +1,248 @@
+from __future__ import absolute_import, division, print_function
+import unittest
+from numpy import allclose, array, exp, log, ones, sqrt
+from numpy.random import RandomState
+from sympy import Symbol
+from CorpFin.Capital import CapitalStructure, pareto_equil_conversion_scenario
+from CorpFin.Options import black_scholes_call_val
+from CorpFin.Security import Security
+
+
+def convertible_preferred_capital_structure(debt_claim_val=1000.):
+    # Common Share held by Founders, under 2 tiers of Convertible Preferred Shares held by Investors, under senior Debt
+    capital_structure = \
+        CapitalStructure(
+            Security('Common'),
+            ((Security('PrefA', claim_val=10.), 1.),),
+            ((Security('PrefB', claim_val=20.), 2.),),
+            Security('Debt', claim_val=debt_claim_val))
+    capital_structure.issue('Founder0', {'Common': 600.})
+    capital_structure.issue('Founder1', {'Common': 400.})
+    capital_structure.issue('InvestorA0', {'PrefA': 100.})
+    capital_structure.issue('InvestorA1', {'PrefA': 50.})
+    capital_structure.issue('InvestorB', {'PrefB': 100.})
+    capital_structure.issue('Bank', {'Debt': 1.})
+    return capital_structure
+
+
+def scenario_loop_val(capital_structure, **kwargs):
+    # reference Pareto-equilibrium valuation: every Conversion Scenario valued in full
+    conversion_scenario_capital_structures = capital_structure.conversion_scenarios()
+    conversion_scenarios = list(conversion_scenario_capital_structures)
+    conversion_scenario_val_results = \
+        {conversion_scenario: scenario_capital_structure.val(pareto_equil_conversions=False, **kwargs)
+         for conversion_scenario, scenario_capital_structure in conversion_scenario_capital_structures.items()}
+    conversion_scenario = \
+        pareto_equil_conversion_scenario(
+            conversion_scenarios,
+            {conversion_scenario: val_results['ownership_vals']
+             for conversion_scenario, val_results in conversion_scenario_val_results.items()})
+    return conversion_scenario, conversion_scenario_val_results[conversion_scenario]
+
+
+class TestCopyOnWrite(unittest.TestCase):
+    def snapshot(self, capital_structure):
+        val_results = capital_structure.val(enterprise_val=5000.)
+        return ({owner: dict(holdings) for owner, holdings in capital_structure.ownerships.items()},
+                {security_label: (n, security.val_expr)
+                 for security_label, (n, security) in capital_structure.outstanding.items()},
+                val_results['security_vals'], val_results['ownership_vals'])
+
+    def assertUnchangedByCopyMutation(self, mutate):
+        capital_structure = convertible_preferred_capital_structure()
+        snapshot = self.snapshot(capital_structure)
+        capital_structure_copy = capital_structure.copy()
+        mutate(capital_structure_copy)
+        self.assertNotEqual(self.snapshot(capital_structure_copy), snapshot)
+        self.assertEqual(self.snapshot(capital_structure), snapshot)
+
+    def test_issue(self):
+        self.assertUnchangedByCopyMutation(
+            lambda capital_structure: capital_structure.issue('Founder2', {'Common': 500.}))
+
+    def test_issue_existing_owner(self):
+        self.assertUnchangedByCopyMutation(
+            lambda capital_structure: capital_structure.issue('InvestorB', {'PrefB': 10.}))
+
+    def test_transfer(self):
+        self.assertUnchangedByCopyMutation(
+            lambda capital_structure: capital_structure.transfer('InvestorA0', 'InvestorB', {'PrefA': 40.}))
+
+    def test_waterfall(self):
+        def mutate(capital_structure):
+            capital_structure.create_securities(Security('Mezzanine', claim_val=500.), liquidation_order=1)
+            capital_structure.issue('Fund', {'Mezzanine': 1.})
+            capital_structure.waterfall()
+        self.assertUnchangedByCopyMutation(mutate)
+
+    def test_sensitivity_functions_not_shared(self):
+        capital_structure = convertible_preferred_capital_structure()
+        capital_structure.waterfall()
+        capital_structure['Common'].security.sensitivity_function()
+        capital_structure_copy = capital_structure.copy()
+        capital_structure_copy.issue('Founder2', {'Common': 500.})
+        capital_structure_copy.waterfall()
+        self.assertIsNot(capital_structure_copy['Common'].security._sensitivity_functions,
+                         capital_structure['Common'].security._sensitivity_functions)
+
+    def test_original_mutation_leaves_copy_unchanged(self):
+        capital_structure = convertible_preferred_capital_structure()
+        capital_structure_copy = capital_structure.copy()
+        snapshot = self.snapshot(capital_structure_copy)
+        capital_structure.issue('Founder2', {'Common': 500.})
+        capital_structure.transfer('Founder0', 'Founder1', {'Common': 100.})
+        self.assertEqual(self.snapshot(capital_structure_copy), snapshot)
+
+
+class TestParetoEquilConversions(unittest.TestCase):
+    # off the breakpoints, at which owners may be indifferent between Conversion Scenarios
+    enterprise_vals = 500., 1250., 1750., 2250., 2750., 3250., 3750., 4250., 8000., 20000.
+
+    def assertValResultsEqual(self, val_results, reference_val_results):
+        for vals in ('security_vals', 'ownership_vals'):
+            self.assertEqual(set(val_results[vals]), set(reference_val_results[vals]))
+            for label, val in reference_val_results[vals].items():
+                self.assertAlmostEqual(val_results[vals][label], val, places=6)
+
+    def test_conversion_breakpoints_match_scenario_loop(self):
+        capital_structure = convertible_preferred_capital_structure()
+        for enterprise_val in self.enterprise_vals:
+            conversion_scenario, reference_val_results = \
+                scenario_loop_val(capital_structure, enterprise_val=enterprise_val)
+            val_results = capital_structure.val(pareto_equil_conversions=True, enterprise_val=enterprise_val)
+            self.assertEqual(val_results['conversion_scenario'], conversion_scenario)
+            self.assertValResultsEqual(val_results, reference_val_results)
+
+    def test_returned_capital_structure_has_waterfall(self):
+        capital_structure = convertible_preferred_capital_structure()
+        val_results = capital_structure.val(pareto_equil_conversions=True, enterprise_val=20000.)
+        self.assertValResultsEqual(
+            val_results['capital_structure'].val(pareto_equil_conversions=False, enterprise_val=20000.),
+            val_results)
+
+    def test_returned_capital_structure_not_cached_one(self):
+        capital_structure = convertible_preferred_capital_structure()
+        val_results = capital_structure.val(pareto_equil_conversions=True, enterprise_val=20000.)
+        val_results['capital_structure'].issue('Founder2', {'Common': 5000.})
+        val_results['capital_structure'].transfer('InvestorB', 'Founder0', {'Common': 100.})
+        new_val_results = capital_structure.val(pareto_equil_conversions=True, enterprise_val=20000.)
+        self.assertNotIn('Founder2', new_val_results['capital_structure'].ownerships)
+        self.assertValResultsEqual(new_val_results, val_results)
+        self.assertValResultsEqual(
+            capital_structure.val(pareto_equil_conversions=True, enterprise_val=20000.),
+            scenario_loop_val(capital_structure, enterprise_val=20000.)[1])
+
+    def test_enterprise_val_dependent_claim_falls_back_to_scenario_loop(self):
+        capital_structure = convertible_preferred_capital_structure(debt_claim_val=.1 * Symbol('enterprise_val'))
+        self.assertEqual(capital_structure.enterprise_val_dependent_claims(), ['Debt'])
+        with self.assertRaises(ValueError):
+            capital_structure.conversion_breakpoints()
+        for enterprise_val in (1000., 5000.):
+            conversion_scenario, reference_val_results = \
+                scenario_loop_val(capital_structure, enterprise_val=enterprise_val)
+            val_results = capital_structure.val(pareto_equil_conversions=True, enterprise_val=enterprise_val)
+            self.assertEqual(val_results['conversion_scenario'], conversion_scenario)
+            self.assertValResultsEqual(val_results, reference_val_results)
+
+    def test_array_enterprise_vals_rejected(self):
+        capital_structure = convertible_preferred_capital_structure()
+        with self.assertRaises(ValueError):
+            capital_structure.val(pareto_equil_conversions=True, enterprise_val=[1000., 2000.])
+
+
+class TestOptionPricingMethod(unittest.TestCase):
+    enterprise_vals = array([500., 2000., 3500., 8000., 20000.])
+
+    def test_security_vals_sum_to_enterprise_val(self):
+        capital_structure = convertible_preferred_capital_structure()
+        opm_results = \
+            capital_structure.opm_allocation(
+                enterprise_val=self.enterprise_vals[:, None], volatility=[.3, .8], term=2.5, risk_free_rate=.02,
+                pareto_equil_conversions=True)
+        self.assertTrue(allclose(
+            sum(capital_structure.outstanding[security_label][0] * security_vals
+                for security_label, security_vals in opm_results['security_vals'].items()),
+            self.enterprise_vals[:, None]))
+        self.assertTrue(allclose(sum(opm_results['ownership_vals'].values()), self.enterprise_vals[:, None]))
+
+    def test_single_class_matches_black_scholes(self):
+        # Common Shares under Debt: a call on Enterprise Value struck at the Debt's claim
+        capital_structure = CapitalStructure(Security('Common'), Security('Debt', claim_val=1000.))
+        capital_structure.issue('Founder', {'Common': 400.})
+        capital_structure.issue('Bank', {'Debt': 1.})
+        volatility, term, risk_free_rate = .6, 3., .03
+        opm_results = \
+            capital_structure.opm_allocation(
+                enterprise_val=self.enterprise_vals, volatility=volatility, term=term, risk_free_rate=risk_free_rate)
+        call_vals = black_scholes_call_val(self.enterprise_vals, 1000., volatility, term, risk_free_rate)
+        self.assertTrue(allclose(400. * opm_results['security_vals']['Common'], call_vals))
+        self.assertTrue(allclose(opm_results['security_vals']['Debt'], self.enterprise_vals - call_vals))
+        self.assertTrue(allclose(opm_results['ownership_vals']['Founder'], call_vals))
+
+    def test_backsolve_recovers_enterprise_val(self):
+        capital_structure = convertible_preferred_capital_structure()
+        volatilities = array([.3, .6, .9])
+        opm_results = \
+            capital_structure.opm_allocation(
+                enterprise_val=self.enterprise_vals[:, None], volatility=volatilities, term=2., risk_free_rate=.02,
+                pareto_equil_conversions=True)
+        enterprise_vals = \
+            capital_structure.opm_backsolve(
+                'PrefB', opm_results['security_vals']['PrefB'], volatility=volatilities, term=2., risk_free_rate=.02,
+                pareto_equil_conversions=True)
+        self.assertEqual(enterprise_vals.shape, (len(self.enterprise_vals), len(volatilities)))
+        self.assertTrue(allclose(enterprise_vals, self.enterprise_vals[:, None] * ones(len(volatilities)), rtol=1e-6))
+
+
+class TestSimulateExits(unittest.TestCase):
+    def test_lognormal_moments(self):
+        # a sole Founder's payoff is the exit Enterprise Value itself: lognormal, of known mean & variance
+        capital_structure = CapitalStructure(Security('Common'))
+        capital_structure.issue('Founder', {'Common': 100.})
+        enterprise_val, volatility, years_to_exit, risk_free_rate, nb_paths = 1000., .4, 2., .05, 2 * 10 ** 5
+        summary = \
+            capital_structure.simulate_exits(
+                nb_paths=nb_paths, enterprise_val=enterprise_val, volatility=volatility, years_to_exit=years_to_exit,
+                risk_free_rate=risk_free_rate, discount_rate=0., chunk_size=30000, random_state=0)
+        mean = enterprise_val * exp(risk_free_rate * years_to_exit)
+        std = mean * sqrt(exp(volatility ** 2 * years_to_exit) - 1)
+        self.assertEqual(summary['nb_paths'], nb_paths)
+        ownership_vals = summary['ownership_vals']
+        self.assertLess(abs(ownership_vals['Mean']['Founder'] - mean), 4 * std / sqrt(nb_paths))
+        self.assertLess(abs(ownership_vals['StdDev']['Founder'] / std - 1), .02)
+        median = enterprise_val * exp((risk_free_rate - volatility ** 2 / 2) * years_to_exit)
+        self.assertLess(abs(ownership_vals[.5]['Founder'] / median - 1), .01)
+        self.assertAlmostEqual(100. * summary['security_vals']['Mean']['Common'], ownership_vals['Mean']['Founder'])
+
+    def test_reservoir(self):
+        capital_structure = convertible_preferred_capital_structure()
+        enterprise_vals = RandomState(0).uniform(0., 10000., size=1000)
+        exit_simulations = []
+        capital_structure.simulate_exits(
+            enterprise_vals=enterprise_vals, years_to_exit=3., discount_rate=.1, chunk_size=64, reservoir_size=100,
+            random_state=1, callback=exit_simulations.append, pareto_equil_conversions=True)
+        reservoir_rows = exit_simulations[-1].reservoir.rows
+        self.assertEqual(reservoir_rows.shape, (100, 2))
+        self.assertEqual(len(set(reservoir_rows[:, 0])), 100)
+        self.assertTrue(set(reservoir_rows[:, 0]) <= set(enterprise_vals))
+        self.assertTrue(allclose(reservoir_rows[:, 1], exp(-.1 * 3.)))
+
+    def test_chunking_invariance(self):
+        capital_structure = convertible_preferred_capital_structure()
+        enterprise_vals = RandomState(0).lognormal(log(3000.), 1., size=5000)
+        summaries = [
+            capital_structure.simulate_exits(
+                enterprise_vals=enterprise_vals, years_to_exit=2., discount_rate=.05, chunk_size=chunk_size,
+                reservoir_size=len(enterprise_vals), random_state=0, pareto_equil_conversions=True)
+            for chunk_size in (len(enterprise_vals), 777, 1)]
+        # Owners' payoffs sum to the discounted exit Enterprise Value, path by path
+        self.assertAlmostEqual(
+            summaries[0]['ownership_vals']['Mean'].sum(), enterprise_vals.mean() * exp(-.05 * 2.), places=6)
+        for summary in summaries[1:]:
+            self.assertEqual(summary['nb_paths'], len(enterprise_vals))
+            for vals in ('security_vals', 'ownership_vals'):
+                self.assertTrue(allclose(summary[vals].values, summaries[0][vals].values))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,89 @@
+from __future__ import absolute_import, division, print_function
+import unittest
+from datetime import date, timedelta
+from CorpFin.CapitalHistory import CapitalHistory, apply_capital_event, parse_capital_event
+
+
+INCEPTION = date(2015, 1, 1)
+
+
+def capital_events():
+    # one Capital Event per day from inception
+    capital_events = [
+        dict(action='create_securities', label='Common'),
+        dict(action='issue', owner='Founder0', securities={'Common': 600.}),
+        dict(action='issue', owner='Founder1', securities={'Common': 400.}),
+        dict(action='create_securities', label='PrefA', claim_val=10., conversion_ratio=1.),
+        dict(action='issue', owner='InvestorA', securities={'PrefA': 150.}),
+        dict(action='transfer', from_owner='Founder0', to_owner='Founder1', securities={'Common': 100.}),
+        dict(action='create_securities', label='Debt', claim_val=1000.),
+        dict(action='issue', owner='Bank', securities={'Debt': 1.}),
+        dict(action='create_securities', label='PrefB', claim_val=20., conversion_ratio=2.),
+        dict(action='issue', owner='InvestorB', securities={'PrefB': 100.}),
+        dict(action='redeem', owners='Founder1', securities={'Common': 50.}),
+        dict(action='convert_to_common', owners='InvestorA', securities='PrefA'),
+        dict(action='issue', owner='Founder2', securities={'Common': 200.})]
+    for i, capital_event in enumerate(capital_events):
+        capital_event['date'] = (INCEPTION + timedelta(days=i)).isoformat()
+    return capital_events
+
+
+def replayed(capital_events):
+    # Capital Structure from applying Capital Events one by one, with no snapshots
+    capital_structure = None
+    for capital_event in capital_events:
+        capital_structure = apply_capital_event(capital_structure, parse_capital_event(capital_event))
+    return capital_structure
+
+
+class TestCapitalHistory(unittest.TestCase):
+    def assertCapitalStructuresEqual(self, capital_structure, reference_capital_structure):
+        self.assertEqual(capital_structure.ownerships, reference_capital_structure.ownerships)
+        self.assertEqual(capital_structure.lifo_liquidation_order, reference_capital_structure.lifo_liquidation_order)
+        self.assertEqual({security_label: n for security_label, (n, security) in capital_structure.outstanding.items()},
+                         {security_label: n
+                          for security_label, (n, security) in reference_capital_structure.outstanding.items()})
+        for enterprise_val in 800., 3000., 9000.:
+            ownership_vals = capital_structure.val(enterprise_val=enterprise_val)['ownership_vals']
+            reference_ownership_vals = reference_capital_structure.val(enterprise_val=enterprise_val)['ownership_vals']
+            self.assertEqual(set(ownership_vals), set(reference_ownership_vals))
+            for owner, ownership_val in reference_ownership_vals.items():
+                self.assertAlmostEqual(ownership_vals[owner], ownership_val)
+
+    def test_as_of_equals_replay(self):
+        events = capital_events()
+        for snapshot_interval in 3, 100:
+            capital_history = CapitalHistory(capital_events=events, snapshot_interval=snapshot_interval)
+            # in order, & then in reverse, i.e. mostly from snapshots once they are all taken
+            for i in list(range(len(events))) + list(reversed(range(len(events)))):
+                self.assertCapitalStructuresEqual(
+                    capital_history.as_of(INCEPTION + timedelta(days=i)), replayed(events[:(i + 1)]))
+            self.assertEqual(
+                sorted(capital_history.snapshots), list(range(snapshot_interval, len(events) + 1, snapshot_interval)))
+
+    def test_as_of_leaves_history_unchanged(self):
+        events = capital_events()
+        capital_history = CapitalHistory(capital_events=events, snapshot_interval=3)
+        capital_history.as_of().issue('Founder3', {'Common': 1000.})
+        self.assertCapitalStructuresEqual(capital_history.as_of(), replayed(events))
+
+    def test_amendment_drops_later_snapshots(self):
+        events = capital_events()
+        capital_history = CapitalHistory(capital_events=events, snapshot_interval=3)
+        capital_history.as_of()
+        self.assertEqual(sorted(capital_history.snapshots), [3, 6, 9, 12])
+
+        # a Capital Event amended into the history after its first 7 Capital Events
+        amendment = dict(date=(INCEPTION + timedelta(days=6)).isoformat(), action='issue', owner='Founder0',
+                         securities={'Common': 300.})
+        capital_history.record(amendment)
+        self.assertEqual(sorted(capital_history.snapshots), [3, 6])
+        amended_events = events[:7] + [amendment] + events[7:]
+        for i in range(len(events)):
+            self.assertCapitalStructuresEqual(
+                capital_history.as_of(INCEPTION + timedelta(days=i)),
+                replayed([event for event in amended_events if event['date'] <= events[i]['date']]))
+
+
+if __name__ == '__main__':
+    unittest.main()
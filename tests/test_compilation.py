@@ -0,0 +1,59 @@
+from __future__ import absolute_import, division, print_function
+import unittest
+from numpy import allclose, arange, array, shares_memory
+from pandas import DataFrame
+from sympy import Max, Symbol
+from CorpFin.Compilation import CompiledExprs, compile_exprs
+
+
+x, y = Symbol('x'), Symbol('y')
+
+
+class TestCompiledExprsVals(unittest.TestCase):
+    def compiled_exprs_recording_inputs(self, *exprs):
+        # CompiledExprs whose compiled function records the input arrays it is called with
+        compiled_exprs = CompiledExprs(*exprs).compile(vectorized=True)
+        vectorized_function = compiled_exprs.vectorized_function
+        compiled_exprs.inputs = []
+
+        def recording_function(*inputs):
+            compiled_exprs.inputs.append(inputs)
+            return vectorized_function(*inputs)
+
+        compiled_exprs.vectorized_function = recording_function
+        return compiled_exprs
+
+    def test_columns_passed_uncopied(self):
+        scenarios = DataFrame(dict(x=arange(5.), y=arange(5.) * 2))
+        compiled_exprs = self.compiled_exprs_recording_inputs(Max(x, y - 3.) + 1.5)
+        vals = compiled_exprs.vals(x=scenarios['x'].values, y=scenarios['y'].values)
+        self.assertTrue(allclose(vals, [1.5, 2.5, 3.5, 4.5, 6.5]))
+        inputs = dict(zip(compiled_exprs.symbol_names, compiled_exprs.inputs[0]))
+        self.assertTrue(shares_memory(inputs['x'], scenarios['x'].values))
+        self.assertTrue(shares_memory(inputs['y'], scenarios['y'].values))
+
+    def test_broadcasting(self):
+        compiled_exprs = self.compiled_exprs_recording_inputs(x * y, x + 1., y * 0. + 2.)
+        xs = array([[1., 2., 3.], [4., 5., 6.]])
+        products, sums, constants = compiled_exprs.vals(x=xs, y=2.)
+        self.assertTrue(allclose(products, 2 * xs))
+        self.assertTrue(allclose(sums, xs + 1))
+        self.assertEqual(constants.shape, xs.shape)
+        inputs = dict(zip(compiled_exprs.symbol_names, compiled_exprs.inputs[0]))
+        self.assertTrue(shares_memory(inputs['x'], xs))
+        self.assertTrue(allclose(compiled_exprs.vals(x=3., y=[1., 2.])[0], [3., 6.]))
+
+
+class TestCompileExprs(unittest.TestCase):
+    def test_rebased_exprs_share_function(self):
+        # the same expressions with Inputs of later years, whose number of digits grows
+        revenue_8, revenue_9, revenue_10 = Symbol('Revenue___8'), Symbol('Revenue___9'), Symbol('Revenue___10')
+        symbol_names, param_vals, function = compile_exprs([2. * revenue_9 - revenue_8])
+        rebased_symbol_names, rebased_param_vals, rebased_function = compile_exprs([2. * revenue_10 - revenue_9])
+        self.assertEqual(rebased_symbol_names, ['Revenue___9', 'Revenue___10'])
+        self.assertIs(rebased_function, function)
+        self.assertTrue(allclose(rebased_function(*([1., 3.] + rebased_param_vals)), 5.))
+
+
+if __name__ == '__main__':
+    unittest.main()
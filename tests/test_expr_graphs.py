@@ -0,0 +1,65 @@
+from __future__ import absolute_import, division, print_function
+import json
+import os
+import unittest
+from CorpFin.ExprGraphs import check_graph_stats
+from CorpFin.Valuation import LevValModel, UnlevValModel
+from test_capital import convertible_preferred_capital_structure
+
+
+# nb_nodes of every expression of the models below, as of their last intended change:
+# model name -> [[expression name, year or other label, nb_nodes], ...];
+# re-recorded, for the models buildable with the installed SymPy, by running the tests with RECORD_GRAPH_STATS=1
+BASELINE_FILE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'graph_stats_baseline.json')
+
+# expression graphs far beyond these small models' are regressions whatever the baseline
+MAX_NB_NODES = 10 ** 4
+
+
+def unlev_val_model():
+    return UnlevValModel(nb_pro_forma_years_excl_0=1, compile=False)
+
+
+def lev_val_model():
+    return LevValModel(unlev_val_model())
+
+
+class TestGraphStats(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        with open(BASELINE_FILE_PATH) as baseline_file:
+            cls.baselines = json.load(baseline_file)
+
+    def check_model(self, model_name, build_model):
+        try:
+            model = build_model()
+        except TypeError as error:   # e.g. SymPy versions rejecting the models' numeric Piecewise conditions
+            self.skipTest('%s cannot be built with the installed SymPy: %s' % (model_name, error))
+        graph_stats = model.graph_stats()
+        if os.environ.get('RECORD_GRAPH_STATS'):
+            self.baselines[model_name] = \
+                [[name, label, int(nb_nodes)] for (name, label), nb_nodes in graph_stats['nb_nodes'].items()]
+            with open(BASELINE_FILE_PATH, 'w') as baseline_file:
+                baseline_file.write(
+                    '{\n%s\n}\n'
+                    % ',\n'.join('"%s": [\n  %s]' % (name, ',\n  '.join(json.dumps(item) for item in baseline))
+                                  for name, baseline in sorted(self.baselines.items())))
+        check_graph_stats(graph_stats, max_nb_nodes=MAX_NB_NODES)
+        if model_name not in self.baselines:
+            self.skipTest('no recorded baseline for %s' % model_name)
+        baseline = {(name, label): nb_nodes for name, label, nb_nodes in self.baselines[model_name]}
+        self.assertEqual(sorted(graph_stats.index), sorted(baseline))
+        check_graph_stats(graph_stats, baseline=baseline)
+
+    def test_capital_structure(self):
+        self.check_model('capital_structure', convertible_preferred_capital_structure)
+
+    def test_unlev_val_model(self):
+        self.check_model('unlev_val_model', unlev_val_model)
+
+    def test_lev_val_model(self):
+        self.check_model('lev_val_model', lev_val_model)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,51 @@
+from __future__ import absolute_import, division, print_function
+import os
+import sys
+import unittest
+from subprocess import check_output
+
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def run_in_fresh_interpreter(statements):
+    # what the statements print, run from a fresh interpreter, whose imports are not those of the test run
+    statements = 'from __future__ import print_function\n' + statements
+    return check_output([sys.executable, '-c', statements], cwd=REPO_DIR).decode('utf-8').strip()
+
+
+class TestLazyPackage(unittest.TestCase):
+    def test_submodules(self):
+        # Book, Portfolio & Security are the submodules, as with an eager package, whichever the import order
+        self.assertEqual(
+            run_in_fresh_interpreter(
+                'import CorpFin\n'
+                'from CorpFin import Portfolio\n'
+                'print(Portfolio.__name__, callable(Portfolio.val))\n'
+                'print(CorpFin.Security.DOLLAR.label, CorpFin.Book.__name__)\n'
+                'import CorpFin.Security as m\n'
+                'print(m is CorpFin.Security)'),
+            'CorpFin.Portfolio True\n$ CorpFin.Book\nTrue')
+
+    def test_public_api(self):
+        self.assertEqual(
+            run_in_fresh_interpreter(
+                'import CorpFin.Capital\n'
+                'import CorpFin\n'
+                'from CorpFin import CapitalStructure, Stake\n'
+                'print(CapitalStructure is CorpFin.Capital.CapitalStructure, Stake is CorpFin.Portfolio.Stake)'),
+            'True True')
+
+    def test_lazy_imports(self):
+        self.assertEqual(
+            run_in_fresh_interpreter(
+                'import sys\n'
+                'import CorpFin\n'
+                'print(sorted(name for name in ("sympy", "pandas", "theano") if name in sys.modules))\n'
+                'import CorpFin.Capital\n'
+                'print(sorted(name for name in ("scipy.special", "pandas", "theano") if name in sys.modules))'),
+            "[]\n[]")
+
+
+if __name__ == '__main__':
+    unittest.main()
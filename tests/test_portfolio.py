@@ -0,0 +1,121 @@
+from __future__ import absolute_import, division, print_function
+import unittest
+from numpy import allclose, array
+from sympy import Max, Symbol
+from CorpFin.Portfolio import Portfolio, Stake
+from CorpFin.Security import DOLLAR, Security
+from test_capital import convertible_preferred_capital_structure
+
+
+s, r = Symbol('s'), Symbol('r')
+
+
+def securities():
+    call = Security('Call', val=Max(s - 100., 0.))
+    bond = Security('Bond', claim_val=100., val=100. / (1. + r))
+    stock = Security('Stock', val=s)
+    return call, bond, stock
+
+
+def nested_portfolio(call, bond, stock):
+    # a sub-Portfolio held twice, directly & through another sub-Portfolio, & cash at every level
+    hedge = Portfolio('Hedge', (-.5, stock), (2., call), 10.)
+    book = Portfolio('Book', (3., hedge), (1., bond), (4., DOLLAR))
+    return Portfolio('Fund', (2., book), (1., hedge), (5., stock), 7.)
+
+
+def leaf_positions_val(s_val, r_val):
+    call_val, bond_val, stock_val = max(s_val - 100., 0.), 100. / (1. + r_val), s_val
+    hedge_val = -.5 * stock_val + 2. * call_val + 10.
+    book_val = 3. * hedge_val + bond_val + 4.
+    return 2. * book_val + hedge_val + 5. * stock_val + 7.
+
+
+class TestNestedPortfolio(unittest.TestCase):
+    def test_val_sums_leaf_positions(self):
+        call, bond, stock = securities()
+        portfolio = nested_portfolio(call, bond, stock)
+        for s_val, r_val in (80., .05), (130., .1):
+            self.assertAlmostEqual(
+                float(portfolio.val(s=s_val, r=r_val)), leaf_positions_val(s_val, r_val))
+            self.assertAlmostEqual(
+                portfolio(s=s_val, r=r_val)['val'].iloc[0], leaf_positions_val(s_val, r_val))
+
+    def test_val_follows_tree_changes(self):
+        call, bond, stock = securities()
+        portfolio = nested_portfolio(call, bond, stock)
+        portfolio.val(s=130., r=.1)
+        hedge = portfolio.c[1].asset
+        hedge.c[0].n = -1.   # changed quantity deep in the tree, whose Hedge is held 2 x 3 + 1 times in all
+        self.assertAlmostEqual(
+            float(portfolio.val(s=130., r=.1)), leaf_positions_val(130., .1) - 7. * .5 * 130.)
+
+
+class TestPortfolioTable(unittest.TestCase):
+    def test_claim_vals_evaluated_once_per_security(self):
+        call, bond, stock = securities()
+        bond_claim_val = bond.claim_val
+        bond_claim_val_kwargs = []
+
+        def recording_bond_claim_val(**kwargs):
+            bond_claim_val_kwargs.append(kwargs)
+            return bond_claim_val(**kwargs)
+
+        bond.claim_val = recording_bond_claim_val
+        portfolio = Portfolio('Bonds', (1., bond), (2., bond), (3., call), (4., bond))
+        df = portfolio(s=130., r=.25)
+        self.assertEqual(len(bond_claim_val_kwargs), 1)
+        self.assertEqual(list(df['asset'])[1:3], ['Security "Bond": Claim Val = 100, Val = 80'] * 2)
+        self.assertAlmostEqual(df['val'].iloc[0], 7. * 80. + 3. * 30.)
+
+
+class TestScenarioVals(unittest.TestCase):
+    def test_vector_equals_scalar_calls(self):
+        portfolio = nested_portfolio(*securities())
+        s_vals = array([50., 99., 100., 101., 250.])
+        self.assertTrue(allclose(
+            portfolio.val(s=s_vals, r=.05),
+            [float(portfolio.val(s=s_val, r=.05)) for s_val in s_vals]))
+
+    def test_broadcasting_inputs(self):
+        portfolio = nested_portfolio(*securities())
+        s_vals = array([[80.], [120.], [160.]])
+        r_vals = array([0., .05])
+        vals = portfolio.val(s=s_vals, r=r_vals)
+        self.assertEqual(vals.shape, (3, 2))
+        self.assertTrue(allclose(
+            vals, [[leaf_positions_val(s_val, r_val) for r_val in r_vals] for s_val in s_vals[:, 0]]))
+        contribution_vals = portfolio.contribution_vals(s=s_vals, r=r_vals)
+        self.assertEqual(contribution_vals['contribution_vals'].shape, (len(contribution_vals['securities']), 3, 2))
+
+
+class TestStake(unittest.TestCase):
+    def assertStakesFollow(self, capital_structure, portfolio, enterprise_vals, pareto_equil_conversions=False):
+        # Stakes' per-unit values are as converted, i.e. those of their sole holders' Ownerships per unit held
+        vals = portfolio.val(enterprise_val=array(enterprise_vals))
+        for enterprise_val, val in zip(enterprise_vals, vals):
+            ownership_vals = \
+                capital_structure.val(
+                    pareto_equil_conversions=pareto_equil_conversions, enterprise_val=enterprise_val)['ownership_vals']
+            self.assertAlmostEqual(
+                val, 100. * ownership_vals['Founder0'] / 600. + 10. * ownership_vals['InvestorB'] / 100.)
+
+    def test_stake_follows_issue(self):
+        for pareto_equil_conversions in False, True:
+            capital_structure = convertible_preferred_capital_structure()
+            portfolio = \
+                Portfolio(
+                    'Stakes',
+                    (100., Stake(capital_structure, 'Common', pareto_equil_conversions=pareto_equil_conversions)),
+                    (10., Stake(capital_structure, 'PrefB', pareto_equil_conversions=pareto_equil_conversions)))
+            enterprise_vals = [6000., 8000., 20000.]
+            vals = portfolio.val(enterprise_val=array(enterprise_vals))
+            self.assertStakesFollow(capital_structure, portfolio, enterprise_vals, pareto_equil_conversions)
+
+            capital_structure.issue('Founder2', {'Common': 1000.})
+            self.assertTrue((portfolio.val(enterprise_val=array(enterprise_vals)) < vals).all())
+            self.assertStakesFollow(capital_structure, portfolio, enterprise_vals, pareto_equil_conversions)
+
+
+if __name__ == '__main__':
+    unittest.main()
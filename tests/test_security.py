@@ -0,0 +1,32 @@
+from __future__ import absolute_import, division, print_function
+import unittest
+from numpy import allclose, array
+from sympy import Max, Symbol, sympify
+from CorpFin.Portfolio import Portfolio
+from CorpFin.Security import Security
+
+
+x = Symbol('x')
+
+
+class TestSensitivities(unittest.TestCase):
+    def test_deltas_and_gammas(self):
+        sensitivities = Security('Call', val=Max(x - 1., 0.) * x).sensitivities(x=array([.5, 2., 3.]))
+        self.assertTrue(allclose(sensitivities['val'], [0., 2., 6.]))
+        self.assertTrue(allclose(sensitivities['deltas']['x'], [0., 3., 5.]))
+        self.assertTrue(allclose(sensitivities['gammas'][('x', 'x')], [0., 2., 2.]))
+
+    def test_no_free_symbols(self):
+        # e.g. a constant val_expr from a Capital Structure's waterfall
+        security = Security('Constant', val=sympify(5.))
+        for second_order in True, False:
+            sensitivities = security.sensitivities(second_order=second_order, x=array([1., 2.]))
+            self.assertTrue(allclose(sensitivities['val'], 5.))
+            self.assertEqual((sensitivities['deltas'], sensitivities['gammas']), ({}, {}))
+        sensitivities = Portfolio('', (2., security), (1., Security('X', val=x))).sensitivities(x=array([1., 2.]))
+        self.assertTrue(allclose(sensitivities['val'], [11., 12.]))
+        self.assertTrue(allclose(sensitivities['deltas']['x'], 1.))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,180 @@
+from __future__ import absolute_import, division, print_function
+import json
+import unittest
+from threading import Event, Thread
+from numpy import allclose, nan
+from sympy import Max, Symbol, symbols
+from CorpFin.Service import \
+    SERVICE_CLOSED, WORKER_MODELS, ValuationHTTPServer, ValuationService, evaluate, evaluate_batch
+from CorpFin.Valuation import ValModel
+
+try:
+    from Queue import Full
+    from urllib2 import HTTPError, Request, urlopen
+except ImportError:
+    from queue import Full
+    from urllib.error import HTTPError
+    from urllib.request import Request, urlopen
+
+
+RELEASE = Event()
+
+
+class RevenueModel(ValModel):
+    def set_model_structure(self):
+        self.Revenue___input = symbols('Revenue___%d:%d' % (self.year_0, self.final_pro_forma_year + 1))
+        self.CorpTaxRate___input = Symbol('CorpTaxRate')
+        self.input_attrs = ['Revenue', 'CorpTaxRate']
+        self.EBIAT = [(1 - self.CorpTaxRate___input) * Max(revenue, 0.) for revenue in self.Revenue___input]
+        self.Growth = \
+            [nan] + [self.Revenue___input[i] / self.Revenue___input[i - 1] - 1 for i in self.index_range_from_1]
+        self.TotalRevenue = sum(self.Revenue___input)
+        self.output_attrs = ['EBIAT', 'Growth', 'TotalRevenue']
+
+
+def doubler():
+    return lambda x: 2 * x
+
+
+def unpicklable_result():
+    # results of which cannot come back from worker processes
+    return lambda x: (lambda: x)
+
+
+def blocking():
+    def model(x):
+        RELEASE.wait(10.)
+        return x
+    return model
+
+
+class TestValuationHTTPServer(unittest.TestCase):
+    nb_processes = 0
+
+    def setUp(self):
+        self.service = \
+            ValuationService(
+                dict(double=doubler, cs='benchmarks.bench_capital:capital_structure'),
+                nb_processes=self.nb_processes, request_timeout=30.)
+        self.server = ValuationHTTPServer(self.service, port=0)
+        self.url = 'http://127.0.0.1:%d' % self.server.server_address[1]
+        server_thread = Thread(target=self.server.serve_forever)
+        server_thread.daemon = True
+        server_thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.service.close()
+
+    def request(self, path, body=None):
+        # (HTTP status, JSON response)
+        request = Request(self.url + path) if body is None else \
+            Request(self.url + path, json.dumps(body).encode('utf-8'), {'Content-Type': 'application/json'})
+        try:
+            response = urlopen(request)
+            return response.getcode(), json.loads(response.read().decode('utf-8'))
+        except HTTPError as error:
+            return error.code, json.loads(error.read().decode('utf-8'))
+
+    def test_health(self):
+        self.assertEqual(self.request('/health'), (200, dict(models=['cs', 'double'])))
+
+    def test_round_trip(self):
+        self.assertEqual(self.request('/models/double', dict(x=21)), (200, dict(result=42)))
+
+    def test_capital_structure_round_trip(self):
+        status, response = self.request('/models/cs', dict(enterprise_val=5000., pareto_equil_conversions=True))
+        self.assertEqual(status, 200)
+        val_results = self.service.val('cs', enterprise_val=5000., pareto_equil_conversions=True)
+        for owner, ownership_val in val_results['ownership_vals'].items():
+            self.assertAlmostEqual(response['result']['ownership_vals'][owner], ownership_val)
+
+    def test_concurrent_requests(self):
+        responses = {}
+
+        def request(i):
+            responses[i] = self.request('/models/double', dict(x=i))
+
+        threads = [Thread(target=request, args=(i,)) for i in range(50)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(responses, {i: (200, dict(result=2 * i)) for i in range(50)})
+
+    def test_errors(self):
+        self.assertEqual(self.request('/models/unknown', {})[0], 404)
+        self.assertEqual(self.request('/models/double', dict(y=1))[0], 422)
+
+
+class TestValuationHTTPServerWithWorkerProcesses(TestValuationHTTPServer):
+    nb_processes = 1
+
+
+class TestValuationService(unittest.TestCase):
+    def test_val_model_batch(self):
+        model = WORKER_MODELS['revenue'] = RevenueModel(year_0=2020, nb_pro_forma_years_excl_0=2)
+        kwargs_list = [
+            dict(Revenue=[100., 110., 121.], CorpTaxRate=.2),
+            dict(Revenue=[200., nan, -5.]),
+            dict(CorpTaxRate=.3, Revenue=[50.]),
+            dict(Revenue=[100., 110., 121.], outputs=['TotalRevenue']),
+            dict(Revenue=[300., 330., 363.], outputs=['TotalRevenue'])]
+        calc_results = model.calc_results
+        model.calc_results = None   # batched requests are evaluated through scenario_vals, not one at a time
+        try:
+            results = evaluate_batch('revenue', kwargs_list)
+        finally:
+            model.calc_results = calc_results
+            del WORKER_MODELS['revenue']
+        for kwargs, (error, result) in zip(kwargs_list, results):
+            self.assertIsNone(error)
+            expected_result = evaluate(model, kwargs)
+            self.assertEqual(sorted(result), sorted(expected_result))
+            for output, expected_output_result in expected_result.items():
+                self.assertTrue(
+                    allclose(result[output], expected_output_result, equal_nan=True),
+                    (kwargs, output, result[output], expected_output_result))
+
+    def test_failed_batch_releases_slot(self):
+        service = \
+            ValuationService(
+                dict(double=doubler, unpicklable=unpicklable_result),
+                nb_processes=1, max_nb_batches_in_flight=1, request_timeout=30.)
+        try:
+            with self.assertRaises(ValueError):
+                service.val('unpicklable', x=1)
+            self.assertEqual(service.val('double', x=2), 4)
+        finally:
+            service.close()
+
+    def test_close_with_full_queue(self):
+        service = ValuationService(dict(blocking=blocking), nb_processes=0, max_queue_size=1, max_batch_delay=0.)
+        RELEASE.clear()
+        try:
+            pending_requests = [service.submit('blocking', dict(x=1))]
+            # the dispatcher is busy evaluating the 1st request, so the 2nd fills the queue
+            while True:
+                try:
+                    pending_requests.append(service.submit('blocking', dict(x=2)))
+                    break
+                except Full:
+                    pass
+            closer = Thread(target=service.close)
+            closer.start()
+            closer.join(5.)
+            self.assertFalse(closer.is_alive())
+            # in-flight & queued requests fail rather than being dropped, as do later ones
+            pending_requests.append(service.submit('blocking', dict(x=3)))
+            for pending_request in pending_requests:
+                self.assertTrue(pending_request.done.is_set())
+                self.assertEqual(pending_request.error, SERVICE_CLOSED)
+        finally:
+            RELEASE.set()
+            for dispatcher in service.dispatchers:
+                dispatcher.join(5.)
+
+
+if __name__ == '__main__':
+    unittest.main()
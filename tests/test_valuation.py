@@ -0,0 +1,35 @@
+from __future__ import absolute_import, division, print_function
+import unittest
+from numpy import allclose, array, empty
+from CorpFin.Valuation import \
+    discount_factors, net_present_value, net_present_values, period_times, present_value, present_values
+
+
+class TestArrayValuations(unittest.TestCase):
+    def test_period_times(self):
+        self.assertEqual(period_times(0).shape, (0,))
+        self.assertTrue(allclose(period_times(4), [0., 1., 2., 3.]))
+        self.assertTrue(allclose(period_times(4, mid_year=True, stub_period=.5), [0., .25, 1., 2.]))
+
+    def test_present_values(self):
+        amounts = array([[100.], [200.]])
+        discount_rates = array([.05, .1, .2])
+        out = empty((2, 3))
+        self.assertIs(present_values(amounts, discount_rates, 3., out=out), out)
+        for i, amount in enumerate(amounts[:, 0]):
+            for j, discount_rate in enumerate(discount_rates):
+                self.assertAlmostEqual(out[i, j], present_value(amount, discount_rate, 3.))
+
+    def test_net_present_values(self):
+        cash_flows = array([[-100., 50., 60., 70.], [10., 20., 30., 40.]])
+        npvs = net_present_values(cash_flows, array([[.1], [.2]]))
+        self.assertEqual(npvs.shape, (2, 2))
+        self.assertAlmostEqual(npvs[1, 0], net_present_value(cash_flows[0], .2))
+        self.assertTrue(allclose(
+            net_present_values(cash_flows, precomputed_discount_factors=discount_factors(.1, 4)),
+            [net_present_value(cash_flows[i], .1) for i in range(2)]))
+        self.assertEqual(discount_factors(.1, 0).shape, (0,))
+
+
+if __name__ == '__main__':
+    unittest.main()